@@ -0,0 +1,686 @@
+"""
+Benchmarks of statgram hot paths on synthetic, scalable versions of
+the demos: FST arc marking at growing |Sigma| (nasal spreading), tree
+marking across input lengths (FootGen, GridGen), gradient alignment
+over long words, HGStat vs OTStat scoring throughput, typology
+sweeps, and cold vs warm starts of the on-disk cache. Run with
+    python -m statgram.bench [--quick] [--json results.json]
+"""
+import argparse, itertools, json, platform, re, sys, tempfile, time
+import numpy as np
+
+from statgram.harmony import Mark, Eval, EvalMatrix, HGStat, OTStat, Stat, \
+    StatMatrix, StatBatch, CompiledOT, weight_vector, profile
+from statgram.fst import ArcContext, from_arcs, ngram, EvalArcs, DeadArcs, \
+    ArcCosts, best_words, ComposePrune
+from statgram.forest import Grammar, Forest
+from statgram.tree import ArrayTree, EvalTrees
+from statgram.typology import Typology, weight_sample, rankings
+from statgram.cache import DiskCache
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+bos, eos = '⋊', '⋉'
+
+# # # # # # # # # #
+# Nasal spreading (demo/nasal_spreading)
+# Symbols are segment + head (1/0) + span bracket, e.g. 'N1(';
+# alphabets are scaled by appending a copy index, which the
+# constraints do not read.
+nasal_spec = [('0[-]|1[|]', 1, 1), ('1[(]', 1, 2), ('0[+]', 2, 2),
+              ('0[)]', 2, 1), ('0[(]', 1, 3), ('0[+]', 3, 3),
+              ('1[)]', 3, 1), ('1[+]', 3, 4), ('0[+]', 4, 4),
+              ('0[)]', 4, 1)]
+
+
+def nasal_sigma(copies=1):
+    """
+    Alphabet of 50 x copies symbols.
+    """
+    return [s + h + b + (str(k) if copies > 1 else '') \
+        for s in 'TSNGV' for h in '10' for b in '(+)|-' \
+            for k in range(copies)]
+
+
+def nasal_span(sigma):
+    """
+    Machine of well-formed headed spans over sigma.
+    """
+    arcs = [(0, bos, bos, 1), (1, eos, eos, 5)]
+    for x in sigma:
+        for (pattern, q, r) in nasal_spec:
+            if re.match(pattern, x[1:3]):
+                arcs.append((q, x, x, r))
+    return from_arcs(arcs, 0, [5], [bos, eos] + sigma)
+
+
+def NasN(t):
+    v = 0
+    if t.x[0] == 'N':
+        v = +1 if t.x[1] == '1' else -1
+    return Mark('NasN', v, subnode='nasal')
+
+
+def NoNasObs(t):
+    v = 0
+    if t.x[0] in 'TS':
+        v = +1 if t.x[2] == '-' else -1
+    return Mark('NoNasObs', v, subnode='nasal')
+
+
+def NoNasVoc(t):
+    v = 0
+    if t.x[0] in 'GV':
+        v = +1 if t.x[2] == '-' else -1
+    return Mark('NoNasVoc', v, subnode='nasal')
+
+
+def SpreadNasR(t):
+    v = 0
+    if t.prec[2:3] in (')', '|'):
+        v = -1
+    elif t.prec[2:3] in ('(', '+') and t.x[1:3] in ('0+', '0)'):
+        v = +1
+    return Mark('SpreadNasR', v, subnode='nasal')
+
+
+def SyllStrucR(t):
+    v = 0
+    if t.prec[0] in 'TSNG' and t.x[0] in 'TSNG':
+        v = -1
+    elif t.prec[0] == 'V' and t.x[0] == 'V':
+        v = -1
+    return Mark('SyllStrucR', v)
+
+
+nasal_Con = [NasN, NoNasObs, NoNasVoc, SpreadNasR, SyllStrucR]
+nasal_weights = {
+    'NasN': 3.0,
+    'NoNasObs': 3.0,
+    'NoNasVoc': 1.0,
+    'SpreadNasR': 2.0,
+    'SyllStrucR': 10.0
+}
+nasal_prec = lambda q: q[1][-1] if q[1] else bos
+nasal_ignore = lambda t: t.x in (bos, eos)
+
+# # # # # # # # # #
+# FootGen (demo/stress/foot_grammars.py) with unbounded words
+foot_grammar = """
+Constituent = Ft | Syll
+PrWd -> Constituent* MainFt Constituent*
+MainFt -> MainStressSyll Syll? | Syll MainStressSyll
+Ft -> StressSyll Syll? | Syll StressSyll
+MainStressSyll -> s1
+StressSyll -> s2
+Syll -> s0
+s0 | s1 | s2 -> "σ"
+"""
+
+is_foot = lambda s: 'Ft' in s.label()
+
+
+def Iambic(s):
+    v = 0
+    if is_foot(s) and len(s) > 1:
+        v = +1 if 'StressSyll' in s[1].label() else -1
+    return Mark('Iambic', v, subnode='lower')
+
+
+def Trochaic(s):
+    v = 0
+    if is_foot(s) and len(s) > 1:
+        v = +1 if 'StressSyll' in s[0].label() else -1
+    return Mark('Trochaic', v, subnode='lower')
+
+
+def ParseSyll(s):
+    v = -1 if s.label() == 'Syll' else 0
+    return Mark('ParseSyll', v)
+
+
+def FootBinarity(s):
+    v = 0
+    if is_foot(s):
+        v = +1 if len(s) == 2 else -1
+    return Mark('FootBinarity', v, subnode='lower')
+
+
+def AllFeetLeft(s):
+    v = 0
+    if is_foot(s) and s.left_sibling() is not None \
+        and s.left_sibling().label() == 'Syll':
+        v = -1
+    return Mark('AllFeetLeft', v, subnode='upper')
+
+
+def AllFeetRight(s):
+    v = 0
+    if is_foot(s) and s.right_sibling() is not None \
+        and s.right_sibling().label() == 'Syll':
+        v = -1
+    return Mark('AllFeetRight', v, subnode='upper')
+
+
+foot_Con = [
+    Iambic, Trochaic, ParseSyll, FootBinarity, AllFeetLeft, AllFeetRight
+]
+
+# # # # # # # # # #
+# GridGen (demo/stress/grid_grammars.py) with unbounded words
+grid_grammar = """
+PrWd -> (x | o)* x (x | o)*
+x | o -> "σ"
+"""
+
+
+def AlternateR(t):
+    v = 0
+    s = t.left_sibling()
+    if s is not None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == s.label() else +1
+    return Mark('AlternateR', v)
+
+
+def AlternateL(t):
+    v = 0
+    s = t.right_sibling()
+    if s is not None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == s.label() else +1
+    return Mark('AlternateL', v)
+
+
+def StressInitial(t):
+    v = 0
+    if t.left_sibling() is None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == 'o' else +1
+    return Mark('StressInitial', v)
+
+
+def StressFinal(t):
+    v = 0
+    if t.right_sibling() is None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == 'o' else +1
+    return Mark('StressFinal', v)
+
+
+def NonFinality(t):
+    v = 0
+    if t.right_sibling() is None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == 'x' else +1
+    return Mark('NonFinality', v)
+
+
+grid_Con = [AlternateR, AlternateL, StressInitial, StressFinal, NonFinality]
+
+gens = {
+    'foot': (foot_grammar, foot_Con),
+    'grid': (grid_grammar, grid_Con),
+}
+
+
+def parses(grammar, n):
+    """
+    All parses of n syllables under grammar, as nltk ParentedTrees.
+    """
+    return list(Forest(grammar, ['σ'] * n).parses([], {}))
+
+
+# # # # # # # # # #
+# Measurement
+def peak_rss_kb():
+    """
+    Peak resident set size of this process in KB (None if unknown).
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def constraint_profile(M, Con, weights, stat_func=HGStat, ignore_func=None):
+    """
+    Per-constraint profile (see harmony.profile) of Eval + Stat over
+    nodes M, as a dict from constraint name to its fields.
+    """
+    with profile() as prof:
+        Stat(Eval(M, Con, ignore_func), weights, stat_func)
+    return {x.constraint: x._asdict() for x in prof.report()}
+
+
+def timed(func, repeat=3, min_seconds=0.05):
+    """
+    Seconds per call of func(): the minimum over repeat rounds of
+    the mean per call in a round, each round calling func() until
+    min_seconds have elapsed.
+    """
+    best = None
+    for _ in range(repeat):
+        (calls, t0) = (0, time.perf_counter())
+        while True:
+            func()
+            calls += 1
+            seconds = time.perf_counter() - t0
+            if seconds >= min_seconds:
+                break
+        if best is None or seconds / calls < best:
+            best = seconds / calls
+    return best
+
+
+def num_marks(markup):
+    """
+    Number of nonzero marks in markup (list of MarkedNodes).
+    """
+    return sum(len(marks) for node in markup \
+        for marks in node.marks.values())
+
+
+def result(bench, params, seconds, nodes=None, marks=None, **extra):
+    """
+    Benchmark record with throughput and peak RSS so far.
+    """
+    record = {'bench': bench, 'params': params, 'seconds': seconds}
+    if nodes is not None:
+        record['nodes'] = nodes
+        record['nodes_per_sec'] = (nodes / seconds) if seconds > 0 else None
+    if marks is not None:
+        record['marks'] = marks
+        record['marks_per_sec'] = (marks / seconds) if seconds > 0 else None
+    record.update(extra)
+    record['peak_rss_kb'] = peak_rss_kb()
+    return record
+
+
+# # # # # # # # # #
+# Benchmarks
+def bench_fst(copies):
+    """
+    Arc marking of the nasal-spreading Gen (span machine composed
+    with a left bigram machine) at growing |Sigma|: Eval + Stat of
+    every arc context, compiled EvalArcs + DeadArcs, ArcCosts with
+    the 100 most harmonic words, and lazy ComposePrune.
+    """
+    records = []
+    for k in copies:
+        sigma = nasal_sigma(k)
+        (M_span, M_left) = (nasal_span(sigma), ngram(sigma, 'left', 1))
+        Gen = ComposePrune(M_span, M_left, [], {}, prec=nasal_prec)
+        arcs = [ArcContext(nasal_prec(Gen.states[q]), Gen.sigma[x], None) \
+            for (q, x) in zip(Gen.src.tolist(), Gen.olabel.tolist())]
+        params = {'sigma': len(sigma), 'arcs': len(arcs)}
+
+        markup = Eval(arcs, nasal_Con, nasal_ignore)
+        records.append(
+            result('fst.eval',
+                   params,
+                   timed(lambda: Stat(Eval(arcs, nasal_Con, nasal_ignore),
+                                      nasal_weights, HGStat)),
+                   nodes=len(arcs),
+                   marks=num_marks(markup),
+                   per_constraint=constraint_profile(
+                       arcs, nasal_Con, nasal_weights, HGStat,
+                       nasal_ignore)))
+
+        (mm, _) = EvalArcs(Gen, nasal_Con, nasal_prec, None, nasal_ignore)
+        records.append(
+            result('fst.dead_arcs',
+                   params,
+                   timed(lambda: DeadArcs(Gen, nasal_Con, nasal_weights,
+                                          HGStat, nasal_prec, None,
+                                          nasal_ignore)),
+                   nodes=len(arcs),
+                   contexts=mm.num_nodes(),
+                   eval_seconds=timed(lambda: EvalArcs(
+                       Gen, nasal_Con, nasal_prec, None, nasal_ignore))))
+
+        costs = lambda: ArcCosts(Gen, nasal_Con, nasal_weights, HGStat,
+                                 nasal_prec, None, nasal_ignore)
+        cost = costs()
+        records.append(
+            result('fst.best_words',
+                   params,
+                   timed(lambda: best_words(Gen, costs(), 100)),
+                   nodes=len(arcs),
+                   cost_seconds=timed(costs),
+                   words=len(best_words(Gen, cost, 100))))
+
+        compose = lambda: ComposePrune(M_span, M_left, nasal_Con,
+                                       nasal_weights, HGStat, nasal_prec,
+                                       None, nasal_ignore)
+        records.append(
+            result('fst.compose_prune',
+                   params,
+                   timed(compose),
+                   nodes=len(arcs),
+                   lang_arcs=len(compose().src)))
+    return records
+
+
+def bench_trees(lengths):
+    """
+    Tree marking over all parses of each input length under FootGen
+    and GridGen: Eval + Stat of every subtree of nltk ParentedTrees
+    and of ArrayTrees (per node and per local configuration), and
+    counting of well-formed parses over the packed forest.
+    """
+    records = []
+    for (name, (text, Con)) in gens.items():
+        grammar = Grammar.fromstring(text)
+        weights = {c.__name__: 1.0 for c in Con}
+        for n in lengths:
+            trees = parses(grammar, n)
+            nodes = [s for tree in trees for s in tree.subtrees()]
+            markup = Eval(nodes, Con)
+            params = {'gen': name, 'length': n, 'parses': len(trees)}
+            records.append(
+                result('trees.eval',
+                       params,
+                       timed(lambda: Stat(Eval(nodes, Con), weights,
+                                          HGStat)),
+                       nodes=len(nodes),
+                       marks=num_marks(markup),
+                       enumerate_seconds=timed(lambda: parses(grammar, n)),
+                       per_constraint=constraint_profile(
+                           nodes, Con, weights)))
+            del trees, nodes, markup
+
+            array_parses = lambda: list(
+                Forest(grammar, ['σ'] * n).parses([], {}, array=True))
+            (trees, seconds) = (array_parses(), timed(array_parses))
+            for local in (False, True):
+                markups = EvalTrees(trees, Con, local)
+                records.append(
+                    result('trees.eval_array_local' if local \
+                        else 'trees.eval_array',
+                           params,
+                           timed(lambda: [
+                               Stat(markup, weights, HGStat) \
+                                   for markup in EvalTrees(trees, Con, local)
+                           ]),
+                           nodes=sum(len(markup) for markup in markups),
+                           marks=sum(num_marks(markup) \
+                               for markup in markups),
+                           enumerate_seconds=seconds))
+            del trees, markups
+
+            records.append(
+                result('trees.forest_count', params,
+                       timed(lambda: Forest(grammar, ['σ'] * n).count(
+                           Con, weights, HGStat))))
+    return records
+
+
+def AlignFeetLeft(s):
+    # Gradient: one mark per syllable between a foot and the left
+    # edge of PrWd, walking left siblings (quadratic in the word)
+    v = 0
+    if is_foot(s):
+        t = s.left_sibling()
+        while t is not None:
+            v -= len(t.leaves())
+            t = t.left_sibling()
+    return Mark('AlignFeetLeft', v)
+
+
+def AlignFeetLeftIndexed(s):
+    # As AlignFeetLeft, from the leaf spans of an ArrayTree
+    v = 0
+    if is_foot(s):
+        v = s.parent().leaf_span()[0] - s.leaf_span()[0]
+    return Mark('AlignFeetLeft', v)
+
+
+def footed_word(n):
+    """
+    PrWd of n constituents, two feet after every unfooted syllable.
+    """
+    return '(PrWd ' + ' '.join('(Syll (s0 σ))' if k % 3 == 0 else \
+        '(Ft (StressSyll (s2 σ)) (Syll (s0 σ)))' for k in range(n)) + ')'
+
+
+def bench_alignment(lengths):
+    """
+    Gradient alignment over words of growing length: sibling walks
+    on nltk ParentedTrees and ArrayTrees vs positional indexes of
+    ArrayTrees (including the time to build them).
+    """
+    from nltk.tree import ParentedTree
+    records = []
+    for n in lengths:
+        tree = ParentedTree.fromstring(footed_word(n))
+        versions = [('nltk_walk', tree, AlignFeetLeft),
+                    ('array_walk', ArrayTree.from_nltk(tree), AlignFeetLeft),
+                    ('array_indexed', ArrayTree.from_nltk(tree),
+                     AlignFeetLeftIndexed)]
+        for (name, tree1, constraint) in versions:
+
+            def run():
+                # Positional indexes are rebuilt on every call
+                if isinstance(tree1, ArrayTree):
+                    (tree1.siblings, tree1.spans) = ({}, None)
+                return Eval(tree1.subtrees(), [constraint])
+
+            markup = run()
+            records.append(
+                result('alignment.' + name, {'constituents': n},
+                       timed(run),
+                       nodes=len(markup),
+                       marks=num_marks(markup)))
+    return records
+
+
+def bench_scoring(lengths, k):
+    """
+    HGStat vs OTStat throughput on the marked subtrees of all GridGen
+    parses: Stat over MarkedNodes, StatMatrix over the compiled
+    MarkMatrix, and StatBatch (CompiledOT for OTStat) under k
+    grammars. Nodes are counted once per grammar.
+    """
+    records = []
+    grammar = Grammar.fromstring(grid_grammar)
+    for n in lengths:
+        nodes = [s for tree in parses(grammar, n) for s in tree.subtrees()]
+        markup = Eval(nodes, grid_Con)
+        mm = EvalMatrix(nodes, grid_Con)
+        W = {
+            HGStat: weight_sample(mm.con, k, seed=0),
+            OTStat: rankings(mm.con)[:k]
+        }
+        for (stat_func, W1) in W.items():
+            params = {
+                'stat': stat_func.__name__,
+                'length': n,
+                'grammars': len(W1)
+            }
+            weights = dict(zip(mm.con, W1[0].tolist()))
+            records.append(
+                result('scoring.stat',
+                       params,
+                       timed(lambda: Stat(markup, weights, stat_func)),
+                       nodes=len(markup)))
+
+            w = weight_vector(mm, weights)
+            records.append(
+                result('scoring.stat_matrix',
+                       params,
+                       timed(lambda: StatMatrix(mm, w, stat_func)),
+                       nodes=mm.num_nodes()))
+
+            if stat_func is OTStat:
+                compiled = CompiledOT(mm)
+                batch = lambda: compiled.stat_batch(W1)
+            else:
+                batch = lambda: StatBatch(mm, W1, stat_func)
+            records.append(
+                result('scoring.stat_batch',
+                       params,
+                       timed(batch),
+                       nodes=mm.num_nodes() * len(W1)))
+    return records
+
+
+def bench_typology(lengths, k):
+    """
+    Typology sweeps of k sampled HG weightings and all OT rankings
+    of the GridGen constraints over the given input lengths.
+    """
+    records = []
+    grammar = Grammar.fromstring(grid_grammar)
+    gen = lambda n: parses(grammar, n)
+    for stat_func in (HGStat, OTStat):
+        build = lambda: Typology(gen, grid_Con, lengths, stat_func)
+        typology = build()
+        W = weight_sample(typology.con, k, seed=0) \
+            if stat_func is HGStat else rankings(typology.con)
+        report = typology.report(W)
+        seconds = timed(lambda: typology.report(W))
+        params = {
+            'stat': stat_func.__name__,
+            'lengths': list(lengths),
+            'grammars': len(W)
+        }
+        records.append(
+            result('typology.report',
+                   params,
+                   seconds,
+                   nodes=len(W) * len(typology.markings),
+                   languages=len(report.languages),
+                   grammars_per_sec=len(W) / seconds,
+                   markings=len(typology.markings),
+                   compile_seconds=timed(build)))
+    return records
+
+
+def bench_cache(copies):
+    """
+    Cold and warm starts of the nasal-spreading Gen and its arc
+    markup through a DiskCache in a temporary directory: building
+    and storing (cold, in a fresh directory per call) vs loading
+    memory-mapped entries (warm).
+    """
+    records = []
+    with tempfile.TemporaryDirectory() as root:
+        fresh = itertools.count()
+        for k in copies:
+            sigma = nasal_sigma(k)
+            build = lambda: ComposePrune(nasal_span(sigma),
+                                         ngram(sigma, 'left', 1), [], {},
+                                         prec=nasal_prec)
+            machine = lambda path: DiskCache(path).machine(('nasal', sigma),
+                                                          build)
+            eval_arcs = lambda path, Gen: DiskCache(path).eval_arcs(
+                Gen, nasal_Con, nasal_prec, None, nasal_ignore)
+
+            def start(path):
+                cache = DiskCache(path)
+                Gen = cache.machine(('nasal', sigma), build)
+                (mm, _) = cache.eval_arcs(Gen, nasal_Con, nasal_prec, None,
+                                          nasal_ignore)
+                return (cache, Gen, mm)
+
+            warm = f'{root}/warm'
+            for name in ('cold', 'warm'):
+                path = (lambda: warm) if name == 'warm' else \
+                    (lambda: f'{root}/cold{next(fresh)}')
+                start(path())  # fills the warm directory
+                (cache, Gen, mm) = start(path())
+                records.append(
+                    result(f'cache.{name}', {
+                        'sigma': len(sigma),
+                        'arcs': len(Gen.src)
+                    },
+                           timed(lambda: start(path())),
+                           nodes=len(Gen.src),
+                           contexts=mm.num_nodes(),
+                           gen_seconds=timed(lambda: machine(path())),
+                           eval_seconds=timed(
+                               lambda: eval_arcs(path(), Gen)),
+                           hits=cache.hits))
+    return records
+
+
+# Benchmark sizes: full and quick (--quick) runs
+sizes = {
+    'fst': ([1, 2, 4, 8], [1, 2]),
+    'trees': ([4, 6, 8], [4, 6]),
+    'alignment': ([16, 64, 256], [16, 64]),
+    'scoring': (([6, 8, 10], 1000), ([6], 100)),
+    'typology': (([2, 3, 4, 5, 6, 7], 100000), ([2, 3, 4], 1000)),
+    'cache': ([1, 4, 8], [1, 2]),
+}
+
+benches = {
+    'fst': lambda x: bench_fst(x),
+    'trees': lambda x: bench_trees(x),
+    'alignment': lambda x: bench_alignment(x),
+    'scoring': lambda x: bench_scoring(*x),
+    'typology': lambda x: bench_typology(*x),
+    'cache': lambda x: bench_cache(x),
+}
+
+
+def run(names=None, quick=False):
+    """
+    Run the named benchmarks (default: all), returning a JSON-ready
+    dict with environment information and the list of records.
+    """
+    records = []
+    for name in (names or benches):
+        records += benches[name](sizes[name][1 if quick else 0])
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'quick': quick,
+        'results': records,
+        'peak_rss_kb': peak_rss_kb()
+    }
+
+
+def format_record(record):
+    params = ' '.join(f'{key}={val}' \
+        for (key, val) in record['params'].items() if key != 'lengths')
+    line = f"{record['bench']:24} {params:40} {record['seconds']:11.6f}s"
+    if record.get('nodes_per_sec'):
+        line += f"  {record['nodes_per_sec']:12.0f} nodes/s"
+    if record.get('marks_per_sec'):
+        line += f"  {record['marks_per_sec']:12.0f} marks/s"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m statgram.bench',
+                                     description=__doc__.strip())
+    parser.add_argument('benches',
+                        nargs='*',
+                        help='benchmarks to run: ' + ', '.join(benches) + \
+                            ' (default: all)')
+    parser.add_argument('--quick',
+                        action='store_true',
+                        help='small sizes, for smoke tests')
+    parser.add_argument('--json', metavar='PATH', help='write results here')
+    args = parser.parse_args(argv)
+    for name in args.benches:
+        if name not in benches:
+            parser.error(f'unknown benchmark {name}')
+
+    results = run(args.benches, args.quick)
+    for record in results['results']:
+        print(format_record(record))
+        for (c, x) in record.get('per_constraint', {}).items():
+            per_call = (1.0e6 * x['seconds'] / x['calls']) \
+                if x['calls'] else 0.0
+            print(f"    {c:20} {per_call:8.2f} us/call {x['marks']:9} marks "
+                  f"{x['ill_fraction']:7.2%} ill")
+    print(f"peak RSS: {results['peak_rss_kb']} KB")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,498 @@
+import functools, hashlib, inspect, marshal, os, pickle, re, shutil, \
+    tempfile, types
+from array import array
+from collections.abc import Sequence
+from pathlib import Path
+import numpy as np
+
+from statgram.harmony import MarkMatrix
+from statgram.fst import Machine, ArcContext, EvalArcs
+from statgram.tree import ArrayTree, Labels, NodeRef, EvalTrees
+
+# Version of the on-disk layout, part of every key
+_FORMAT = 1
+
+# Array fields of stored Machines, MarkMatrices and ArrayTrees
+_MACHINE_ARRAYS = ('finals', 'src', 'ilabel', 'olabel', 'dest')
+_MATRIX_ARRAYS = ('node', 'subnode', 'indptr', 'col', 'val')
+_TREE_ARRAYS = ('label', 'parent', 'first_child', 'last_child',
+                'next_sibling', 'prev_sibling', 'index', 'num_children',
+                'depth')
+
+
+def default_root():
+    """
+    Cache directory: $STATGRAM_CACHE, else statgram under
+    $XDG_CACHE_HOME (default ~/.cache).
+    """
+    root = os.environ.get('STATGRAM_CACHE')
+    if root:
+        return Path(root)
+    return Path(os.environ.get('XDG_CACHE_HOME') or
+                Path.home() / '.cache') / 'statgram'
+
+
+# Modules of the package that entries cannot depend on
+_DEV_MODULES = ('bench', )
+
+
+def _runtime_module(module):
+    """
+    Whether module (a __module__ name) is a statgram module whose
+    source is part of package_digest.
+    """
+    (package, _, name) = (module or '').partition('.')
+    return package == 'statgram' and name not in _DEV_MODULES
+
+
+@functools.lru_cache(maxsize=None)
+def package_digest():
+    """
+    Digest of the source of the statgram runtime modules (not the
+    benchmarks), so that entries built by another version of the
+    package are never loaded.
+    """
+    h = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob('*.py')):
+        if path.stem in _DEV_MODULES:
+            continue
+        h.update(path.name.encode('utf-8'))
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+# Types of the module globals read by a function that are part of
+# its fingerprint (modules and other objects are not)
+_GLOBAL_TYPES = (types.FunctionType, type, str, bytes, int, float, tuple,
+                 list, dict, set, frozenset, re.Pattern, np.ndarray)
+
+
+def fingerprint(*parts):
+    """
+    Hex sha256 digest of parts: None, numbers, strings, bytes,
+    arrays, regular expressions, containers of these (including
+    namedtuples such as Machine), and functions, which are
+    identified by their source (with decorators), defaults, closure
+    variables and the module globals they read by name whose values
+    are functions, classes, data of the above types or containers
+    (e.g. a dict of legal parents). Functions and classes of the
+    statgram runtime modules are identified by name, as their source
+    is covered by package_digest. Other objects are hashed by their
+    pickle, or by identity if they cannot be pickled (which only
+    costs cache misses).
+
+    Data a function reaches in other ways is not part of the key:
+    attributes of modules or objects (e.g. config.sigma or self.x),
+    globals of other types, and anything read through a call.
+    """
+    h = hashlib.sha256()
+    _update(h, parts, set())
+    return h.hexdigest()
+
+
+def _update(h, x, seen):
+    tag = lambda s: h.update(s.encode('utf-8') + b'\0')
+    if x is None or isinstance(x, (bool, int, float, complex, str)):
+        tag(f'{type(x).__name__}:{x!r}')
+    elif isinstance(x, bytes):
+        tag(f'bytes:{len(x)}')
+        h.update(x)
+    elif isinstance(x, re.Pattern):
+        tag(f'pattern:{x.flags}')
+        _update(h, x.pattern, seen)
+    elif isinstance(x, (np.ndarray, np.generic, array)):
+        x = np.ascontiguousarray(x)
+        tag(f'ndarray:{x.dtype.str}:{x.shape}')
+        h.update(x.tobytes())
+    elif isinstance(x, (tuple, list)):
+        tag(f'{type(x).__name__}:{len(x)}')
+        for y in x:
+            _update(h, y, seen)
+    elif isinstance(x, (set, frozenset)):
+        tag(f'{type(x).__name__}:{len(x)}')
+        for y in sorted(fingerprint(y) for y in x):
+            tag(y)
+    elif isinstance(x, dict):
+        tag(f'dict:{len(x)}')
+        for (k, v) in sorted(((fingerprint(k), v) for (k, v) in x.items()),
+                             key=lambda kv: kv[0]):
+            tag(k)
+            _update(h, v, seen)
+    elif callable(x):
+        _update_callable(h, x, seen)
+    else:
+        try:
+            data = pickle.dumps(x, protocol=4)
+        except Exception:
+            data = f'{type(x).__qualname__}@{id(x)}'.encode('utf-8')
+        tag(f'object:{type(x).__qualname__}')
+        h.update(data)
+
+
+def _update_callable(h, func, seen):
+    tag = lambda s: h.update(s.encode('utf-8') + b'\0')
+    if id(func) in seen:
+        tag(f'seen:{getattr(func, "__qualname__", "")}')
+        return
+    seen.add(id(func))
+    # Decorated or wrapped constraints (SymbolicConstraint,
+    # CachedConstraint) are identified by the functions they wrap
+    wrapped = getattr(func, '__wrapped__', None)
+    if wrapped is not None:
+        tag('wrapped')
+        _update(h, wrapped, seen)
+    elif isinstance(func, functools.partial):
+        tag('partial')
+        _update(h, (func.func, func.args, func.keywords), seen)
+    elif isinstance(func, types.MethodType):
+        tag('method')
+        _update(h, (func.__func__, type(func.__self__)), seen)
+    elif isinstance(func, type) and _runtime_module(func.__module__):
+        tag(f'type:{func.__module__}.{func.__qualname__}')
+    elif isinstance(func, types.FunctionType):
+        tag(f'function:{func.__module__}.{func.__qualname__}')
+        # Source of the runtime modules is in package_digest
+        names = ()
+        if not _runtime_module(func.__module__):
+            (digest, names) = _code_digest(func.__code__)
+            h.update(digest)
+        _update(h, (func.__defaults__, func.__kwdefaults__), seen)
+        for cell in (func.__closure__ or ()):
+            try:
+                _update(h, cell.cell_contents, seen)
+            except ValueError:  # empty cell
+                tag('empty')
+        for name in names:
+            value = func.__globals__.get(name)
+            if isinstance(value, _GLOBAL_TYPES):
+                tag(name)
+                _update(h, value, seen)
+    elif isinstance(func, type) or isinstance(func,
+                                              types.BuiltinFunctionType):
+        tag(f'type:{func.__module__}.{func.__qualname__}')
+        if isinstance(func, type):
+            h.update(_class_digest(func))
+    else:
+        # Callable object: its class and state
+        _update(h, type(func), seen)
+        _update(h, vars(func) if hasattr(func, '__dict__') else None, seen)
+
+
+@functools.lru_cache(maxsize=None)
+def _code_digest(code):
+    """
+    Static part of the fingerprint of a function, computed once per
+    process for its code object: the digest of its source (with
+    decorators), or of its marshalled code if the source is
+    unavailable, and the sorted global names it reads.
+    """
+    try:
+        data = inspect.getsource(code).encode('utf-8')
+    except (OSError, TypeError):
+        data = marshal.dumps(code)
+    return (hashlib.sha256(data).digest(),
+            tuple(sorted(_global_names(code))))
+
+
+@functools.lru_cache(maxsize=None)
+def _class_digest(cls):
+    """
+    Digest of the source of class cls (empty if unavailable),
+    computed once per process.
+    """
+    try:
+        data = inspect.getsource(cls).encode('utf-8')
+    except (OSError, TypeError):
+        data = b''
+    return hashlib.sha256(data).digest()
+
+
+def _global_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _global_names(const)
+    return names
+
+
+class DiskCache():
+    """
+    Content-addressed store of compiled Gen (Machines, Grammars and
+    parses as ArrayTrees) and Eval markups (MarkMatrices) under
+    directory root (default: default_root()). An entry is keyed on
+    the sha256 fingerprint of everything that determines it (e.g.
+    the Gen spec and builder, the alphabet and the source of each
+    constraint) plus the statgram source, and holds its arrays as
+    .npy files and its remaining (small) objects as a pickle.
+
+    Arrays are loaded memory-mapped and read-only, so a warm start
+    only maps the files, and processes that load the same entry
+    share one copy in the page cache. Entries are written to a
+    temporary directory and renamed into place, so concurrent
+    writers and readers never see partial entries. Keys capture
+    function source and the module-level data functions read by
+    name (see fingerprint), but not state reached through modules,
+    objects or calls (e.g. attributes of objects); use clear() if
+    such state changes.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root) if root is not None else default_root()
+        self.hits = self.misses = 0
+
+    def path(self, key):
+        return self.root / key[:2] / key
+
+    def key(self, kind, *parts):
+        """
+        Key of an entry of the given kind determined by parts.
+        """
+        return fingerprint(_FORMAT, package_digest(), kind, *parts)
+
+    def get(self, key):
+        """
+        Arrays (dict of read-only memory-mapped arrays) and objects
+        of entry key, or None if there is no such entry.
+        """
+        path = self.path(key)
+        try:
+            with open(path / 'objects.pickle', 'rb') as f:
+                objects = pickle.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        arrays = {
+            name: np.load(path / f'{name}.npy', mmap_mode='r')
+            for name in objects.pop('_arrays')
+        }
+        return (arrays, objects)
+
+    def put(self, key, arrays, objects):
+        """
+        Store arrays (dict of name -> array) and objects (dict of
+        picklable values) as entry key, unless it already exists.
+        """
+        path = self.path(key)
+        if path.exists():
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            for (name, x) in arrays.items():
+                np.save(os.path.join(tmp, f'{name}.npy'),
+                        np.ascontiguousarray(x))
+            objects = dict(objects, _arrays=list(arrays))
+            with open(os.path.join(tmp, 'objects.pickle'), 'wb') as f:
+                pickle.dump(objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+            path.parent.mkdir(exist_ok=True)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Entry written concurrently by another process
+                if not path.exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def machine(self, spec, build):
+        """
+        Machine built by build() (e.g. a ComposePrune of Gen
+        components) for spec, which should include everything
+        build depends on beyond its source (e.g. the alphabet).
+        """
+        key = self.key('machine', spec, build)
+        entry = self.get(key)
+        if entry is not None:
+            return _load_machine(*entry)
+        machine = build()
+        self.put(key, *_save_machine(machine))
+        return machine
+
+    def grammar(self, spec, build):
+        """
+        Grammar (or other picklable Gen) built by build() for spec;
+        not memory-mapped, as compiled rules are Python objects.
+        """
+        key = self.key('grammar', spec, build)
+        entry = self.get(key)
+        if entry is not None:
+            return entry[1]['grammar']
+        grammar = build()
+        self.put(key, {}, {'grammar': grammar})
+        return grammar
+
+    def trees(self, spec, build, labels=None):
+        """
+        List of ArrayTrees built by build() for spec (e.g. all parses
+        of an input), stored as one set of concatenated arrays. Node
+        arrays are copied out of the mapped files on load, as they
+        are indexed element by element. Labels are interned in
+        labels (default: the shared table).
+        """
+        key = self.key('trees', spec, build)
+        entry = self.get(key)
+        if entry is not None:
+            return _load_trees(*entry, labels)
+        trees = build()
+        self.put(key, *_save_trees(trees))
+        return trees
+
+    def eval_arcs(self,
+                  machine,
+                  Con,
+                  prec=None,
+                  succ=None,
+                  ignore_func=None):
+        """
+        Cached EvalArcs: the MarkMatrix of the distinct arc contexts
+        of machine and the index of each arc's context, keyed on the
+        machine, the constraints and the context functions.
+        """
+        key = self.key('eval_arcs', machine, Con, prec, succ, ignore_func)
+        entry = self.get(key)
+        if entry is not None:
+            (arrays, objects) = entry
+            objects['nodes'] = _ArcContexts(arrays['contexts'],
+                                            machine.sigma)
+            return (_load_matrix(arrays, objects), arrays['inv'])
+        (mm, inv) = EvalArcs(machine, Con, prec, succ, ignore_func)
+        (arrays, objects) = _save_matrix(mm)
+        arrays['inv'] = inv
+        symbol_id = {x: i for (i, x) in enumerate(machine.sigma)}
+        symbol_id[None] = -1
+        arrays['contexts'] = np.array(
+            [[symbol_id[x] for x in node] for node in mm.nodes],
+            dtype=np.int32).reshape(-1, 3)
+        self.put(key, arrays, objects)
+        return (mm, inv)
+
+    def eval_trees(self, trees, Con, local=False, ignore_func=None):
+        """
+        Cached EvalTrees: one markup per ArrayTree in trees, keyed on
+        the trees, the constraints and ignore_func. Loaded markups
+        are views of a single MarkMatrix over all trees.
+        """
+        key = self.key('eval_trees', [_tree_key(tree) for tree in trees],
+                       Con, local, ignore_func)
+        entry = self.get(key)
+        if entry is None:
+            markups = EvalTrees(trees, Con, local, ignore_func)
+            mm = MarkMatrix.from_markup(
+                [node for markup in markups for node in markup])
+            (arrays, objects) = _save_matrix(mm)
+            arrays['tree'] = np.repeat(np.arange(len(trees)),
+                                       [len(markup) for markup in markups])
+            arrays['index'] = np.array(
+                [node.n.i for markup in markups for node in markup],
+                dtype=np.int64)
+            self.put(key, arrays, objects)
+            return markups
+        (arrays, objects) = entry
+        (tree, index) = (arrays['tree'].tolist(), arrays['index'].tolist())
+        objects['nodes'] = [NodeRef(trees[t], i) for (t, i) in zip(tree, index)]
+        mm = _load_matrix(arrays, objects)
+        markups = [[] for _ in trees]
+        for (k, t) in enumerate(tree):
+            markups[t].append(mm[k])
+        return markups
+
+
+class _ArcContexts(Sequence):
+    """
+    Read-only sequence of the ArcContexts of a stored MarkMatrix,
+    built on access from an array of their symbol ids.
+    """
+
+    def __init__(self, contexts, sigma):
+        self.contexts = contexts
+        self.symbols = list(sigma) + [None]  # id -1 is None
+
+    def __len__(self):
+        return len(self.contexts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        symbols = self.symbols
+        return ArcContext(*(symbols[j] for j in self.contexts[i].tolist()))
+
+
+def _save_machine(machine):
+    arrays = {name: getattr(machine, name) for name in _MACHINE_ARRAYS}
+    objects = {
+        'sigma': list(machine.sigma),
+        'states': list(machine.states),
+        'start': int(machine.start)
+    }
+    return (arrays, objects)
+
+
+def _load_machine(arrays, objects):
+    return Machine(objects['sigma'], objects['states'], objects['start'],
+                   *(arrays[name] for name in _MACHINE_ARRAYS))
+
+
+def _save_matrix(mm):
+    arrays = {name: getattr(mm, name) for name in _MATRIX_ARRAYS}
+    objects = {'con': list(mm.con), 'subnodes': list(mm.subnodes)}
+    return (arrays, objects)
+
+
+def _load_matrix(arrays, objects):
+    return MarkMatrix(objects['nodes'], objects['con'], objects['subnodes'],
+                      *(arrays[name] for name in _MATRIX_ARRAYS))
+
+
+def _tree_arrays(tree):
+    return [getattr(tree, name) for name in _TREE_ARRAYS] + [tree.leaf]
+
+
+def _tree_key(tree):
+    # Structure and label strings (ids depend on the label table)
+    return [getattr(tree, name) for name in _TREE_ARRAYS[1:]] + \
+        [tree.leaf, '\x1f'.join(map(str, tree.label_str))]
+
+
+def _save_trees(trees):
+    # Label ids are rewritten into one table for the stored trees
+    table = Labels()
+    arrays = {name: [] for name in _TREE_ARRAYS + ('leaf', )}
+    for tree in trees:
+        ids = np.array([table(x) for x in tree.names], dtype=np.int32)
+        for (name, x) in zip(_TREE_ARRAYS + ('leaf', ),
+                             _tree_arrays(tree)):
+            x = np.frombuffer(x, dtype=np.int32 if name != 'leaf' \
+                else np.uint8)
+            arrays[name].append(ids[x] if name == 'label' else x)
+    arrays = {
+        name: np.concatenate(x) if x else np.zeros(0, np.int32)
+        for (name, x) in arrays.items()
+    }
+    arrays['offsets'] = np.cumsum([0] + [len(tree) for tree in trees])
+    return (arrays, {'labels': table.labels})
+
+
+def _load_trees(arrays, objects, labels=None):
+    tree0 = ArrayTree(labels)
+    ids = np.array([tree0.labels(x) for x in objects['labels']],
+                   dtype=np.int32)
+    names = tree0.labels.labels
+    label = ids[arrays['label']] if len(ids) else arrays['label']
+    offsets = arrays['offsets'].tolist()
+    trees = []
+    for (a, b) in zip(offsets, offsets[1:]):
+        tree = ArrayTree(tree0.labels)
+        for name in _TREE_ARRAYS:
+            x = label if name == 'label' else arrays[name]
+            getattr(tree, name).frombytes(x[a:b].tobytes())
+        tree.leaf.extend(arrays['leaf'][a:b].tobytes())
+        tree.label_str = [names[i] for i in tree.label]
+        trees.append(tree)
+    return trees
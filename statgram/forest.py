@@ -0,0 +1,833 @@
+import itertools, math, re
+from collections import namedtuple
+
+from statgram.harmony import MarkedNode, HGStat, Eval1, Stat1
+from statgram.tree import ArrayTree
+
+
+class LocalityError(Exception):
+    """
+    Raised when a constraint evaluated over a packed forest reads
+    beyond the local configuration of a node.
+    """
+
+
+class _Untracked(LocalityError):
+    """
+    Raised when a constraint reads siblings or daughters that a
+    bounded rule can track but is not tracking.
+    """
+
+    def __init__(self, message, rule):
+        super().__init__(message)
+        self.rule = rule
+
+
+class _Window():
+    """
+    Marker for the untracked siblings or daughters of a node
+    expanded by bounded rule (rule id), used in place of True
+    (unknown siblings) or the daughters in local configurations.
+    """
+    __slots__ = ('rule', )
+
+    def __init__(self, rule):
+        self.rule = rule
+
+
+# Right-hand side of a rule as a finite automaton over symbols:
+# arcs[q] lists (symbol, is_terminal, q') transitions from state q;
+# each accepted sequence must have a single path for counts to
+# be correct
+class Nfa():
+
+    def __init__(self, arcs, start, finals):
+        self.arcs = arcs
+        self.start = start
+        self.finals = set(finals)
+        self.bounded = self._acyclic()
+
+    @classmethod
+    def sequence(cls, symbols):
+        """
+        Automaton accepting exactly the (symbol, is_terminal)
+        sequence symbols.
+        """
+        arcs = {q: [(x, is_term, q + 1)] \
+            for (q, (x, is_term)) in enumerate(symbols)}
+        return cls(arcs, 0, [len(symbols)])
+
+    @classmethod
+    def from_regex(cls, text, macros=None):
+        """
+        Deterministic automaton for a regular expression over symbols:
+        categories, quoted terminals, grouping, alternation (|) and
+        repetition (*, +, ?, {m,n}). Names in macros stand for the
+        expressions they map to. Construction is linear in the
+        length of text including repetition bounds, apart from
+        subset construction on ambiguous expressions.
+        """
+        node = _parse_regex(text, macros or {})
+        (eps, arcs) = ({}, {})
+        (start, end) = _thompson(node, eps, arcs, itertools.count())
+        return _determinize(start, end, eps, arcs)
+
+    def _acyclic(self):
+        # Bounded (finite) right-hand sides have no cycles
+        # reachable from the start state
+        (visiting, done) = (set(), set())
+
+        def visit(q):
+            visiting.add(q)
+            for (_, _, q2) in self.arcs.get(q, ()):
+                if q2 in visiting or (q2 not in done and not visit(q2)):
+                    return False
+            visiting.discard(q)
+            done.add(q)
+            return True
+
+        return visit(self.start)
+
+
+Rule = namedtuple('Rule', ['lhs', 'rhs'])
+
+
+class Grammar():
+    """
+    Context-free grammar whose rules rewrite a category as any
+    sequence of symbols accepted by an Nfa.
+    """
+
+    def __init__(self, rules, start):
+        self.rules = rules
+        self.start = start
+        self.rules_by_lhs = {}
+        for (r, rule) in enumerate(rules):
+            self.rules_by_lhs.setdefault(rule.lhs, []).append(r)
+
+    @classmethod
+    def from_cfg(cls, cfg):
+        """
+        Convert an nltk CFG.
+        """
+        rules = []
+        for prod in cfg.productions():
+            if len(prod.rhs()) == 0:
+                raise ValueError(f'empty production {prod}')
+            symbols = [(x, True) if isinstance(x, str) else \
+                (str(x), False) for x in prod.rhs()]
+            rules.append(Rule(str(prod.lhs()), Nfa.sequence(symbols)))
+        return cls(rules, str(cfg.start()))
+
+    @classmethod
+    def fromstring(cls, text, start=None):
+        """
+        Grammar from lines 'A -> regex', whose right-hand side is a
+        regular expression over symbols (see Nfa.from_regex), and
+        class definitions 'N = regex'. A class of categories on the
+        left-hand side gives one rule per category. Lines beginning
+        with # are comments. The start category defaults to the
+        left-hand side of the first rule.
+        """
+        (rules, macros) = ([], {})
+        for line in text.splitlines():
+            line = line.strip()
+            if line == '' or line[0] == '#':
+                continue
+            if '->' in line:
+                (lhs, rhs) = line.split('->', 1)
+                rhs = Nfa.from_regex(rhs, macros)
+                for A in _categories(_parse_regex(lhs, macros)):
+                    rules.append(Rule(A, rhs))
+                    if start is None:
+                        start = A
+            elif '=' in line:
+                (name, rhs) = line.split('=', 1)
+                macros[name.strip()] = _parse_regex(rhs, macros)
+            else:
+                raise ValueError(f'cannot parse rule {line!r}')
+        return cls(rules, start)
+
+
+def _categories(node):
+    """
+    Categories named by a symbol or an alternation of symbols.
+    """
+    nodes = node[1] if node[0] == 'alt' else [node]
+    if any(x[0] != 'sym' or x[2] for x in nodes):
+        raise ValueError('left-hand side must be a category or '
+                         'alternation of categories')
+    return [x[1] for x in nodes]
+
+
+_REGEX_TOKEN = re.compile(r'\s*("[^"]*"|\'[^\']*\'|\{\d*(?:,\d*)?\}|[()|*+?]' \
+                          r'|[^\s()|*+?{}"\']+)')
+
+
+def _parse_regex(text, macros):
+    """
+    Syntax tree of a regular expression over symbols: ('sym', x,
+    is_terminal), ('seq', nodes), ('alt', nodes), or ('rep', node,
+    lo, hi) with hi None for unbounded repetition.
+    """
+    text = text.strip()
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        match = _REGEX_TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError(f'cannot parse {text[pos:]!r}')
+        tokens.append(match.group(1))
+        pos = match.end()
+    tokens.append(None)
+    pos = 0
+
+    def alt():
+        nonlocal pos
+        nodes = [seq()]
+        while tokens[pos] == '|':
+            pos += 1
+            nodes.append(seq())
+        return nodes[0] if len(nodes) == 1 else ('alt', nodes)
+
+    def seq():
+        nodes = []
+        while tokens[pos] not in (None, '|', ')'):
+            nodes.append(rep())
+        return nodes[0] if len(nodes) == 1 else ('seq', nodes)
+
+    def rep():
+        nonlocal pos
+        node = atom()
+        while tokens[pos] is not None \
+            and (tokens[pos] in ('*', '+', '?') or tokens[pos][0] == '{'):
+            op = tokens[pos]
+            pos += 1
+            if op[0] == '{':
+                bounds = op[1:-1].split(',')
+                lo = int(bounds[0] or 0)
+                hi = lo if len(bounds) == 1 else \
+                    (int(bounds[1]) if bounds[1] else None)
+                if hi is not None and hi < lo:
+                    raise ValueError(f'bad repetition {op} in {text!r}')
+            else:
+                (lo, hi) = {'*': (0, None), '+': (1, None), '?': (0, 1)}[op]
+            node = ('rep', node, lo, hi)
+        return node
+
+    def atom():
+        nonlocal pos
+        x = tokens[pos]
+        pos += 1
+        if x == '(':
+            node = alt()
+            if tokens[pos] != ')':
+                raise ValueError(f'missing ) in {text!r}')
+            pos += 1
+            return node
+        if x is None or x in (')', '|', '*', '+', '?') or x[0] == '{':
+            raise ValueError(f'unexpected {x} in {text!r}')
+        if x[0] in ('"', "'"):
+            return ('sym', x[1:-1], True)
+        if x in macros:
+            return macros[x]
+        return ('sym', x, False)
+
+    node = alt()
+    if tokens[pos] is not None:
+        raise ValueError(f'unexpected {tokens[pos]} in {text!r}')
+    return node
+
+
+def _thompson(node, eps, arcs, states):
+    """
+    Add the states of an epsilon-automaton for node to eps
+    and arcs, returning its (start, end) states.
+    """
+    start = next(states)
+    end = start
+    link = lambda q, q2: eps.setdefault(q, []).append(q2)
+    if node[0] == 'sym':
+        end = next(states)
+        arcs.setdefault(start, []).append((node[1], node[2], end))
+    elif node[0] == 'seq':
+        for x in node[1]:
+            (q, q2) = _thompson(x, eps, arcs, states)
+            link(end, q)
+            end = q2
+    elif node[0] == 'alt':
+        end = next(states)
+        for x in node[1]:
+            (q, q2) = _thompson(x, eps, arcs, states)
+            link(start, q)
+            link(q2, end)
+    else:
+        (_, x, lo, hi) = node
+        for _ in range(lo):
+            (q, q2) = _thompson(x, eps, arcs, states)
+            link(end, q)
+            end = q2
+        skip = next(states)
+        if hi is None:
+            (q, q2) = _thompson(x, eps, arcs, states)
+            link(end, q)
+            link(q2, q)
+            link(q2, skip)
+        else:
+            # Optional copies, each of which may be the last
+            for _ in range(hi - lo):
+                link(end, skip)
+                (q, q2) = _thompson(x, eps, arcs, states)
+                link(end, q)
+                end = q2
+        link(end, skip)
+        end = skip
+    return (start, end)
+
+
+def _determinize(start, end, eps, arcs):
+    """
+    Subset construction over epsilon-closures.
+    """
+
+    def closure(Q):
+        Q = set(Q)
+        stack = list(Q)
+        while stack:
+            for q2 in eps.get(stack.pop(), ()):
+                if q2 not in Q:
+                    Q.add(q2)
+                    stack.append(q2)
+        return frozenset(Q)
+
+    Q0 = closure([start])
+    index = {Q0: 0}
+    agenda = [Q0]
+    (dfa_arcs, finals) = ({}, [])
+    while agenda:
+        Q = agenda.pop()
+        if end in Q:
+            finals.append(index[Q])
+        dest = {}
+        for q in sorted(Q):
+            for (x, is_term, q2) in arcs.get(q, ()):
+                dest.setdefault((x, is_term), []).append(q2)
+        for ((x, is_term), Q2) in dest.items():
+            Q2 = closure(Q2)
+            if Q2 not in index:
+                index[Q2] = len(index)
+                agenda.append(Q2)
+            dfa_arcs.setdefault(index[Q], []).append(
+                (x, is_term, index[Q2]))
+    return Nfa(dfa_arcs, 0, finals)
+
+
+# Unknown part of a local configuration
+_UNKNOWN = object()
+
+
+class LocalNode():
+    """
+    View of a forest node through its local configuration, offering
+    the part of the nltk ParentedTree interface used by constraints:
+    its label, its parent's label, its siblings and its daughters'
+    labels. Daughters are visible if the node was expanded by a rule
+    with a bounded right-hand side, siblings are all visible if
+    the parent was, and otherwise only the adjacent siblings are.
+    Reading further raises LocalityError. Bounded rules only track
+    their daughters once a constraint reads them (see _Inside).
+    """
+    __slots__ = ('_parent', '_siblings', '_index', '_lo_open', '_hi_open',
+                 '_daughters')
+
+    def __init__(self,
+                 parent,
+                 siblings,
+                 index,
+                 lo_open=False,
+                 hi_open=False,
+                 daughters=_UNKNOWN):
+        self._parent = parent  # parent label (None for root)
+        self._siblings = siblings  # (label, is_terminal) of siblings
+        self._index = index  # position of node among siblings
+        self._lo_open = lo_open  # unknown siblings precede siblings
+        self._hi_open = hi_open  # unknown siblings follow siblings
+        self._daughters = daughters  # (label, is_terminal) of daughters
+
+    def label(self):
+        return self._siblings[self._index][0]
+
+    def parent(self):
+        if self._parent is _UNKNOWN:
+            raise LocalityError(f'parent of {self.label()} is not local')
+        if self._parent is None:
+            return None
+        daughters = self._siblings \
+            if not (self._lo_open or self._hi_open) else _UNKNOWN
+        for window in (self._lo_open, self._hi_open):
+            if isinstance(window, _Window):
+                daughters = window
+        return LocalNode(_UNKNOWN, ((self._parent, False), ), 0, True, True,
+                         daughters)
+
+    def _sibling(self, index):
+        window = self._lo_open if index < 0 else self._hi_open \
+            if index >= len(self._siblings) else False
+        if isinstance(window, _Window):
+            raise _Untracked(f'sibling of {self.label()} is not tracked',
+                             window.rule)
+        if window:
+            raise LocalityError(f'sibling of {self.label()} is not local')
+        if index < 0 or index >= len(self._siblings):
+            return None
+        (x, is_term) = self._siblings[index]
+        if is_term:
+            return x
+        return LocalNode(self._parent, self._siblings, index, self._lo_open,
+                         self._hi_open)
+
+    def left_sibling(self):
+        return self._sibling(self._index - 1)
+
+    def right_sibling(self):
+        return self._sibling(self._index + 1)
+
+    def _get_daughters(self):
+        if isinstance(self._daughters, _Window):
+            raise _Untracked(f'daughters of {self.label()} are not tracked',
+                             self._daughters.rule)
+        if self._daughters is _UNKNOWN or self._daughters is None:
+            raise LocalityError(f'daughters of {self.label()} are not local')
+        return self._daughters
+
+    def __len__(self):
+        return len(self._get_daughters())
+
+    def __getitem__(self, index):
+        daughters = self._get_daughters()
+        (x, is_term) = daughters[index]
+        if is_term:
+            return x
+        return LocalNode(self.label(), daughters, index % len(daughters))
+
+    def __repr__(self):
+        return f'LocalNode({self.label()})'
+
+
+# Semiring in which forest values are computed; mark maps the
+# harmony of a node to its value (None: every node has value one),
+# or node_mark, if given, maps its harmony and MarkedNode
+Semiring = namedtuple('Semiring',
+                      ['zero', 'one', 'plus', 'times', 'mark', 'node_mark'],
+                      defaults=[None])
+
+Counting = Semiring(0, 1, int.__add__, int.__mul__, None)
+WellFormed = Semiring(0, 1, int.__add__, int.__mul__, \
+    lambda h: 1 if h >= 0.0 else 0)
+MaxHarmony = Semiring(-float('inf'), 0.0, max, float.__add__, float)
+
+
+def _logaddexp(a, b):
+    if a < b:
+        (a, b) = (b, a)
+    if b == -math.inf:
+        return a
+    return a + math.log1p(math.exp(b - a))
+
+
+# Log of the sum of exp(harmony) over derivations (MaxEnt)
+LogSum = Semiring(-math.inf, 0.0, _logaddexp, float.__add__, float)
+
+
+def Expectation(con, weights):
+    """
+    Semiring of pairs (log Z, e) over derivations, where e is the
+    vector (tuple aligned with con) of expected HG feature values
+    under the MaxEnt distribution P(d) = exp(harmony(d)) / Z. The
+    features of a node are the marks on its subnodes with negative
+    weighted sum, so that its harmony is their weighted sum.
+    """
+    C = len(con)
+    column = {c: k for (k, c) in enumerate(con)}
+    zero = (-math.inf, (0.0, ) * C)
+    one = (0.0, (0.0, ) * C)
+
+    def plus(x, y):
+        if x[0] == -math.inf:
+            return y
+        if y[0] == -math.inf:
+            return x
+        l = _logaddexp(x[0], y[0])
+        (a, b) = (math.exp(x[0] - l), math.exp(y[0] - l))
+        return (l, tuple(a * u + b * v for (u, v) in zip(x[1], y[1])))
+
+    def times(x, y):
+        if x[0] == -math.inf or y[0] == -math.inf:
+            return zero
+        return (x[0] + y[0], tuple(u + v for (u, v) in zip(x[1], y[1])))
+
+    def node_mark(harmony, node):
+        e = [0.0] * C
+        for marks in node.marks.values():
+            if sum(weights[c] * v for (c, v, _) in marks) < 0.0:
+                for (c, v, _) in marks:
+                    e[column[c]] += v
+        return (harmony, tuple(e))
+
+    return Semiring(zero, one, plus, times, None, node_mark)
+
+
+class _Inside():
+    """
+    Inside values of forest items (A, i, j) in a semiring. Each item
+    maps derivation keys d = (rule, daughters) to values, where
+    daughters are the (label, is_terminal) daughters of the node
+    (None for rules with unbounded right-hand sides). The value
+    covers the subtree below the node, whose own marks depend on
+    its parent and siblings and are added by the item above it.
+
+    Chains of bounded rules, like unbounded ones, record only the
+    last daughter, so parsing stays polynomial. A bounded rule is
+    tracked in full (all daughters in chain states and derivation
+    keys) once a constraint reads siblings or daughters beyond
+    that window, after which the values are recomputed.
+    """
+
+    def __init__(self, grammar, tokens, semiring, Con, weights, stat_func):
+        self.grammar = grammar
+        self.tokens = tokens
+        self.sr = semiring
+        self.Con = Con
+        self.weights = weights
+        self.stat_func = stat_func
+        self.tracked = set()  # bounded rules tracking all daughters
+        self.windows = {}  # rule -> _Window
+        self._reset()
+
+    def _reset(self):
+        self.inside = {}
+        self.chains = {}  # (item, rule) -> (value, incoming, finals)
+        self.node_values = {}  # local configuration -> value
+        self.in_progress = set()
+
+    def node_value(self, config):
+        value = self.node_values.get(config)
+        if value is None:
+            if self.sr.mark is None and self.sr.node_mark is None:
+                value = self.sr.one
+            else:
+                node = LocalNode(*config)
+                marked = MarkedNode(node, Eval1(node, self.Con))
+                harmony = Stat1(marked, self.weights, self.stat_func)
+                value = self.sr.mark(harmony) if self.sr.node_mark is None \
+                    else self.sr.node_mark(harmony, marked)
+            self.node_values[config] = value
+        return value
+
+    def root(self):
+        """
+        Values of derivations of the whole input, including the
+        marks of the root.
+        """
+        while True:
+            try:
+                return self._root()
+            except _Untracked as e:
+                if e.rule in self.tracked:
+                    raise
+                self.tracked.add(e.rule)
+                self._reset()
+
+    def _root(self):
+        Y = (self.grammar.start, 0, len(self.tokens))
+        return {d: self.sr.times(v, self.node_value( \
+                    (None, ((Y[0], False), ), 0, False, False, d[1]))) \
+                for (d, v) in self.item(Y).items()}
+
+    def item(self, Y):
+        inside = self.inside.get(Y)
+        if inside is not None:
+            return inside
+        if Y in self.in_progress:
+            raise ValueError(f'cyclic unary derivation of {Y}')
+        self.in_progress.add(Y)
+        inside = {}
+        for r in self.grammar.rules_by_lhs.get(Y[0], ()):
+            self._chain(Y, r, inside)
+        self.in_progress.discard(Y)
+        self.inside[Y] = inside
+        return inside
+
+    def _children(self, k, ends, x, is_term):
+        """
+        Derivations (symbol, item, d, end, value) of symbol x
+        starting at k and ending at one of ends.
+        """
+        if is_term:
+            if k + 1 in ends and self.tokens[k] == x:
+                yield ((x, True), None, None, k + 1, self.sr.one)
+            return
+        for m in ends:
+            Z = (x, k, m)
+            for (dZ, vZ) in self.item(Z).items():
+                yield ((x, False), Z, dZ, m, vZ)
+
+    def _finish(self, A, siblings, index, lo_open, hi_open, daughters):
+        if siblings[index][1]:  # terminals are not marked
+            return self.sr.one
+        return self.node_value(
+            (A, siblings, index, lo_open, hi_open, daughters))
+
+    def _chain(self, Y, r, inside):
+        """
+        Derivations of item Y by rule r, as paths through the
+        automaton of r that cover the span of Y. For tracked bounded
+        rules the state records all daughters so far and daughters
+        are marked at the end; otherwise it records the last
+        daughter, which is marked once its right sibling is known.
+        """
+        (A, i, j) = Y
+        sr = self.sr
+        nfa = self.grammar.rules[r].rhs
+        bounded = (r in self.tracked)
+        window = self._window(r)
+        start = (nfa.start, i, ()) if bounded \
+            else (nfa.start, i, None, None)
+        value = {start: sr.one}
+        incoming = {start: []}
+        finals = []
+        agenda = [[] for _ in range(i, j + 1)]
+        agenda[0].append(start)
+        for k in range(i, j + 1):
+            for key in agenda[k - i]:
+                val = value[key]
+                q = key[0]
+                if k == j:
+                    if q in nfa.finals:
+                        (d, factor) = self._final(A, r, key)
+                        if factor != sr.zero:
+                            finals.append((key, d, factor))
+                            inside[d] = sr.plus(inside.get(d, sr.zero),
+                                                sr.times(val, factor))
+                    continue
+                for (x, is_term, q2) in nfa.arcs.get(q, ()):
+                    if bounded:
+                        prev_factor = sr.one
+                    else:
+                        (prev, left) = key[2:]
+                        prev_factor = sr.one if prev is None else \
+                            self._finish(A,
+                                         (left, prev[0], (x, is_term))[
+                                             (left is None):],
+                                         (left is not None),
+                                         left is not None and window,
+                                         window, prev[1])
+                    if prev_factor == sr.zero:
+                        continue
+                    # Daughters are non-empty, so the last one ends
+                    # at j and the others before it
+                    last = (q2 in nfa.finals)
+                    if nfa.arcs.get(q2):
+                        ends = range(k + 1, j + 1 if last else j)
+                    else:
+                        ends = [j] if last else []
+                    for (lab, Z, dZ, m, vZ) in \
+                            self._children(k, ends, x, is_term):
+                        daughtersZ = dZ[1] if dZ is not None else None
+                        if bounded:
+                            key2 = (q2, m, key[2] + ((lab, daughtersZ), ))
+                        else:
+                            key2 = (q2, m, (lab, daughtersZ),
+                                    None if key[2] is None else key[2][0])
+                        factor = sr.times(prev_factor, vZ)
+                        val2 = sr.times(val, factor)
+                        if val2 == sr.zero:
+                            continue
+                        if key2 not in value:
+                            value[key2] = sr.zero
+                            incoming[key2] = []
+                            agenda[m - i].append(key2)
+                        value[key2] = sr.plus(value[key2], val2)
+                        incoming[key2].append((key, (lab, Z, dZ), factor))
+        self.chains[(Y, r)] = (value, incoming, finals)
+
+    def _window(self, r):
+        """
+        Value standing for unknown siblings in chains of rule r:
+        True, or a _Window for untracked bounded rules.
+        """
+        if not self.grammar.rules[r].rhs.bounded:
+            return True
+        window = self.windows.get(r)
+        if window is None:
+            window = self.windows[r] = _Window(r)
+        return window
+
+    def _final(self, A, r, key):
+        """
+        Derivation key of a final chain state and the value of
+        the daughters still to be marked.
+        """
+        sr = self.sr
+        if r in self.tracked:
+            daughters = key[2]
+            siblings = tuple(lab for (lab, _) in daughters)
+            factor = sr.one
+            for (index, (_, daughtersZ)) in enumerate(daughters):
+                factor = sr.times(
+                    factor,
+                    self._finish(A, siblings, index, False, False,
+                                 daughtersZ))
+            return ((r, siblings), factor)
+        (prev, left) = key[2:]
+        window = self._window(r)
+        factor = self._finish(A, (left, prev[0])[(left is None):],
+                              (left is not None), left is not None and window,
+                              False, prev[1])
+        return ((r, None if window is True else window), factor)
+
+
+class Forest():
+    """
+    Packed forest of all parses of a token sequence. Constraints are
+    evaluated once per distinct local configuration of a node (its
+    label, parent label, siblings, daughters) rather than once per
+    node of each parse, and counts, best harmony and well-formed
+    parses are computed by dynamic programming over the forest.
+    """
+
+    def __init__(self, grammar, tokens):
+        self.grammar = grammar
+        self.tokens = list(tokens)
+
+    def _inside(self, semiring, Con=(), weights=None, stat_func=HGStat):
+        return _Inside(self.grammar, self.tokens, semiring, Con, weights,
+                       stat_func)
+
+    def num_parses(self):
+        """
+        Number of parses of the tokens.
+        """
+        return sum(self._inside(Counting).root().values())
+
+    def count(self, Con, weights, stat_func=HGStat):
+        """
+        Number of well-formed parses (in which every node has
+        zero harmony) under Con and weights (or ranks).
+        """
+        inside = self._inside(WellFormed, Con, weights, stat_func)
+        return sum(inside.root().values())
+
+    def best(self, Con, weights, stat_func=HGStat):
+        """
+        Maximum harmony of any parse under Con and weights
+        (or ranks).
+        """
+        inside = self._inside(MaxHarmony, Con, weights, stat_func)
+        return max(inside.root().values(), default=MaxHarmony.zero)
+
+    def log_Z(self, Con, weights):
+        """
+        Log of the MaxEnt normalizer: the sum of exp(harmony) over
+        all parses under Con and HG weights, so that the probability
+        of a parse is exp(harmony - log_Z).
+        """
+        inside = self._inside(LogSum, Con, weights, HGStat)
+        log_Z = LogSum.zero
+        for v in inside.root().values():
+            log_Z = _logaddexp(log_Z, v)
+        return log_Z
+
+    def expected_counts(self, Con, weights):
+        """
+        Log normalizer and dict of the expected HG feature values of
+        each constraint (mark name in weights) over parses under the
+        MaxEnt distribution (see Expectation); the gradient of the
+        log-likelihood of a parse is its features minus these.
+        """
+        con = list(weights)
+        sr = Expectation(con, weights)
+        inside = self._inside(sr, Con, weights, HGStat)
+        total = sr.zero
+        for v in inside.root().values():
+            total = sr.plus(total, v)
+        return (total[0], dict(zip(con, total[1])))
+
+    def parses(self, Con, weights, stat_func=HGStat, array=False):
+        """
+        Generate the well-formed parses as nltk ParentedTrees (or
+        ArrayTrees if array is true), visiting only parts of the
+        forest that lead to one.
+        """
+        inside = self._inside(WellFormed, Con, weights, stat_func)
+        root = inside.root()
+        Y = (self.grammar.start, 0, len(self.tokens))
+        trees = (tree for (d, v) in root.items() if v != 0 \
+            for tree in _Trees(inside).item(Y, d))
+        if array:
+            expand = lambda x: x if isinstance(x, tuple) else None
+            for tree in trees:
+                yield ArrayTree.build(tree, expand)
+            return
+
+        from nltk.tree import ParentedTree, Tree
+
+        def convert(tree):
+            if isinstance(tree, str):
+                return tree
+            return Tree(tree[0], [convert(x) for x in tree[1]])
+
+        for tree in trees:
+            yield ParentedTree.convert(convert(tree))
+
+
+class _Trees():
+    """
+    Enumeration of subtrees from the chains of a WellFormed
+    inside computation, following only non-zero values.
+    """
+
+    def __init__(self, inside):
+        self.inside = inside
+
+    def item(self, Y, d):
+        (value, incoming, finals) = self.inside.chains[(Y, d[0])]
+        for (key, d1, factor) in finals:
+            if d1 != d or value[key] * factor == 0:
+                continue
+            for children in self._paths(value, incoming, key):
+                daughters = [self._child(child) for child in children]
+                for subtrees in itertools.product(*daughters):
+                    yield (Y[0], subtrees)
+
+    def _child(self, child):
+        ((x, is_term), Z, dZ) = child
+        if is_term:
+            return [x]
+        return list(self.item(Z, dZ))
+
+    def _paths(self, value, incoming, key):
+        if len(incoming[key]) == 0:
+            yield []
+            return
+        for (key0, child, factor) in incoming[key]:
+            if value[key0] * factor == 0:
+                continue
+            for path in self._paths(value, incoming, key0):
+                yield path + [child]
+
+
+class ForestGen():
+    """
+    Gen that maps an input string of space-separated tokens to the
+    packed forest of its parses under grammar (a Grammar or an
+    nltk CFG).
+    """
+
+    def __init__(self, grammar):
+        if not isinstance(grammar, Grammar):
+            grammar = Grammar.from_cfg(grammar)
+        self.grammar = grammar
+
+    def forest(self, inpt):
+        return Forest(self.grammar, inpt.split())
@@ -0,0 +1,776 @@
+import heapq, itertools, random
+from collections import namedtuple
+import numpy as np
+
+from statgram.harmony import MarkedNode, HGStat, Eval1, Stat1, \
+    StatMatrix, node_harmony, weight_vector, Compile, instrumented, \
+    _MarkMatrixBuilder, _ranges
+
+# Finite-state machine as arc arrays: symbol table sigma (symbol id ->
+# symbol), state labels (state id -> label), start state id, finals
+# (boolean mask over states), and for each arc its source state,
+# input and output symbol ids, and destination state
+Machine = namedtuple('Machine', [
+    'sigma', 'states', 'start', 'finals', 'src', 'ilabel', 'olabel', 'dest'
+])
+
+# Local context of an arc: symbol preceding it, its output symbol,
+# and symbol following it (None if not given)
+ArcContext = namedtuple('ArcContext', ['prec', 'x', 'succ'])
+
+
+class _Interner():
+    """
+    Map hashable labels to consecutive ids.
+    """
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.ids = {}
+        for x in labels:
+            self(x)
+
+    def __call__(self, x):
+        i = self.ids.get(x)
+        if i is None:
+            i = self.ids[x] = len(self.labels)
+            self.labels.append(x)
+        return i
+
+
+def from_arcs(arcs, start, finals, sigma=()):
+    """
+    Machine from (src, ilabel, olabel, dest) arcs with state labels
+    and symbols, the start state label and final state labels.
+    Symbol ids follow the order of sigma, then first occurrence.
+    """
+    (states, symbols) = (_Interner([start]), _Interner(sigma))
+    (src, ilabel, olabel, dest) = ([], [], [], [])
+    for (q, x, y, r) in arcs:
+        src.append(states(q))
+        ilabel.append(symbols(x))
+        olabel.append(symbols(y))
+        dest.append(states(r))
+    is_final = np.zeros(len(states.labels), dtype=bool)
+    is_final[[states.ids[q] for q in finals if q in states.ids]] = True
+    return Machine(symbols.labels, states.labels, 0, is_final,
+                   *(np.array(x, dtype=np.int64) \
+                    for x in (src, ilabel, olabel, dest)))
+
+
+def from_wyfst(M, sigma=()):
+    """
+    Machine from a wyfst Wfst, together with the list of its arcs as
+    (src, arc) pairs aligned with the machine's arcs, which can be
+    passed back to M.delete_arcs. Reads M through states, arcs,
+    input_label, output_label and state_label (as the demos do) and
+    start and finals, all with state ids (label=False).
+    """
+    (arcs, refs) = ([], [])
+    for src in M.states(label=False):
+        for t in M.arcs(src):
+            arcs.append((src, M.input_label(t.ilabel),
+                         M.output_label(t.olabel), t.nextstate))
+            refs.append((src, t))
+    machine = from_arcs(arcs, M.start(label=False),
+                        M.finals(label=False), sigma)
+    # Replace state ids with their labels
+    states = [M.state_label(q) for q in machine.states]
+    return (machine._replace(states=states), refs)
+
+
+def arc_contexts(machine, prec=None, succ=None):
+    """
+    Symbol ids (prec, x, succ) of each arc as an (arcs x 3) array,
+    where x is the output symbol, prec(q) gives the symbol preceding
+    arcs out of state label q and succ(q) the symbol following arcs
+    into it; missing contexts (no function, or None returned, e.g.
+    at the start state) are -1. Context functions are applied once
+    per state.
+    """
+    symbol_id = {x: i for (i, x) in enumerate(machine.sigma)}
+    symbol_id[None] = -1
+
+    def state_symbols(func):
+        if func is None:
+            return np.full(len(machine.states), -1, dtype=np.int64)
+        return np.array([symbol_id[func(q)] for q in machine.states],
+                        dtype=np.int64)
+
+    return np.stack([
+        state_symbols(prec)[machine.src], machine.olabel,
+        state_symbols(succ)[machine.dest]
+    ],
+                    axis=1)
+
+
+def EvalArcs(machine, Con, prec=None, succ=None, ignore_func=None):
+    """
+    Evaluate constraints in Con on the distinct ArcContexts of the
+    arcs of machine; returns a MarkMatrix whose nodes are the
+    contexts and the index of each arc's context. Constraints are
+    called once per distinct context rather than once per arc, and
+    symbolic constraints (over fields of ArcContext) are compiled
+    over the machine's alphabet.
+    (Contexts for which ignore_func evaluates to true are not marked.)
+    """
+    Con = instrumented(Compile(Con, machine.sigma))
+    ctx = arc_contexts(machine, prec, succ) + 1
+    S = len(machine.sigma) + 1
+    key = (ctx[:, 0] * S + ctx[:, 1]) * S + ctx[:, 2]
+    (key, inv) = np.unique(key, return_inverse=True)
+    builder = _MarkMatrixBuilder()
+    ignore = (ignore_func is not None)
+    symbol = lambda i: machine.sigma[i - 1] if i > 0 else None
+    for k in key.tolist():
+        node = ArcContext(symbol(k // (S * S)), symbol(k // S % S),
+                          symbol(k % S))
+        if ignore and ignore_func(node):
+            builder.add(node, [])
+        else:
+            builder.add(node, [constraint(node) for constraint in Con])
+    return (builder.build(), inv.ravel())
+
+
+def DeadArcs(machine,
+             Con,
+             weights,
+             stat_func=HGStat,
+             prec=None,
+             succ=None,
+             ignore_func=None):
+    """
+    Boolean mask of the ill-formed arcs of machine.
+    (For OTStat pass in ranks instead of weights.)
+    """
+    (mm, inv) = EvalArcs(machine, Con, prec, succ, ignore_func)
+    (_, ill) = StatMatrix(mm, weights, stat_func)
+    return ill[inv]
+
+
+def ArcCosts(machine,
+             Con,
+             weights,
+             stat_func=HGStat,
+             prec=None,
+             succ=None,
+             ignore_func=None):
+    """
+    Tropical-semiring weight of each arc of machine: its negated
+    harmony, so well-formed arcs cost 0 and the cost of a path is
+    minus the harmony of its form (for OTStat, with ranks in place
+    of weights, the number of ill-formed arcs).
+    """
+    (mm, inv) = EvalArcs(machine, Con, prec, succ, ignore_func)
+    if isinstance(weights, dict):
+        weights = weight_vector(mm, weights)
+    harmony = node_harmony(mm, weights, stat_func)
+    return np.abs(np.minimum(harmony, 0.0))[inv]
+
+
+def delete_arcs(machine, mask):
+    """
+    Machine without the arcs selected by boolean mask.
+    """
+    keep = ~np.asarray(mask, dtype=bool)
+    return machine._replace(src=machine.src[keep],
+                            ilabel=machine.ilabel[keep],
+                            olabel=machine.olabel[keep],
+                            dest=machine.dest[keep])
+
+
+def ngram(sigma, context='left', length=1, bos='⋊', eos='⋉'):
+    """
+    Acceptor of bos sigma* eos whose states record context. For
+    context='left' each state is labelled by the last length symbols
+    read, so the symbol preceding an arc is src[-1]; for
+    context='right' by the next length symbols to be read, so the
+    symbol following an arc is dest[0].
+    """
+    sigma = list(sigma)
+    if context == 'left':
+        start = ()
+        step = lambda h: [(bos, (bos, ))] if h == () else \
+            [] if h[-1] == eos else \
+            [(x, (h + (x, ))[-length:]) for x in sigma + [eos]]
+        is_final = lambda h: h[-1:] == (eos, )
+    elif context == 'right':
+        start = (bos, )
+        windows = [w + tail for k in range(length + 1) \
+            for w in itertools.product(sigma, repeat=k) \
+            for tail in ([(eos, )] if k < length else [()])]
+        step = lambda w: [(bos, w2) for w2 in windows] if w == start else \
+            [] if w == () else \
+            [(w[0], w[1:])] if w[-1] == eos else \
+            [(w[0], w[1:] + (x, )) for x in sigma + [eos]]
+        is_final = lambda w: w == ()
+    else:
+        raise ValueError(f'unknown context {context}')
+    (arcs, finals) = ([], [])
+    (agenda, seen) = ([start], {start})
+    while agenda:
+        q = agenda.pop()
+        if is_final(q):
+            finals.append(q)
+        for (x, r) in step(q):
+            arcs.append((q, x, x, r))
+            if r not in seen:
+                seen.add(r)
+                agenda.append(r)
+    return from_arcs(arcs, start, finals, [bos, eos] + sigma)
+
+
+def _out_arcs(num_states, src):
+    """
+    Arc indices sorted by source state and the offset of each
+    state's arcs.
+    """
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(num_states + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_states), out=indptr[1:])
+    return (order, indptr)
+
+
+def _reachable(num_states, src, dest, seeds):
+    """
+    Boolean mask of states reachable from seeds along arcs src -> dest.
+    """
+    (order, indptr) = _out_arcs(num_states, src)
+    seen = np.zeros(num_states, dtype=bool)
+    seen[seeds] = True
+    frontier = np.flatnonzero(seen)
+    while len(frontier) > 0:
+        (idx, _) = _ranges(indptr, frontier)
+        frontier = np.unique(dest[order[idx]])
+        frontier = frontier[~seen[frontier]]
+        seen[frontier] = True
+    return seen
+
+
+def trim(machine):
+    """
+    Machine restricted to states that are accessible from the start
+    state and co-accessible from a final state (the start state is
+    always kept), with states renumbered in order.
+    """
+    return _trim(machine)[0]
+
+
+def _trim(machine):
+    """
+    Trimmed machine and boolean mask of the arcs kept.
+    """
+    n = len(machine.states)
+    keep = _reachable(n, machine.src, machine.dest, [machine.start]) \
+        & _reachable(n, machine.dest, machine.src, \
+            np.flatnonzero(machine.finals))
+    keep[machine.start] = True
+    state_id = np.cumsum(keep) - 1
+    arcs = keep[machine.src] & keep[machine.dest]
+    return (machine._replace(
+        states=[q for (q, k) in zip(machine.states, keep) if k],
+        start=int(state_id[machine.start]),
+        finals=machine.finals[keep],
+        src=state_id[machine.src[arcs]],
+        ilabel=machine.ilabel[arcs],
+        olabel=machine.olabel[arcs],
+        dest=state_id[machine.dest[arcs]]), arcs)
+
+
+def prune_arcs(machine, cost, threshold=0.0):
+    """
+    Weighted machine without arcs costing more than threshold,
+    trimmed; returns the machine and the costs of its arcs. With
+    threshold 0 the result is the pruned Lang (as from DeadArcs).
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    keep = (cost <= threshold)
+    (machine, arcs) = _trim(delete_arcs(machine, ~keep))
+    return (machine, cost[keep][arcs])
+
+
+def ComposePrune(M1,
+                 M2,
+                 Con,
+                 weights,
+                 stat_func=HGStat,
+                 prec=None,
+                 succ=None,
+                 ignore_func=None):
+    """
+    Lazily compose M1 with M2 (matching output symbols of M1 with input
+    symbols of M2) from the start state, evaluating each arc of the
+    composition in its ArcContext as it is generated and dropping
+    ill-formed arcs before they are added; states reachable only
+    through dropped arcs are never created. Non-coaccessible states
+    are trimmed afterwards, so the result is the pruned Lang without
+    materializing Gen. Composed states are labelled (q1, q2) and
+    prec and succ are functions of these labels; arcs are judged
+    once per distinct context.
+    """
+    symbols = _Interner(M1.sigma)
+    sigma2 = np.array([symbols(x) for x in M2.sigma], dtype=np.int64)
+    S = len(symbols.labels)
+    Con = Compile(Con, symbols.labels)
+    (order1, indptr1) = _out_arcs(len(M1.states), M1.src)
+    # Arcs of M2 sorted by source state and input symbol
+    key2 = M2.src * S + sigma2[M2.ilabel]
+    order2 = np.argsort(key2, kind='stable')
+    key2 = key2[order2]
+    (olabel2, dest2) = (sigma2[M2.olabel[order2]], M2.dest[order2])
+    label = lambda q: (M1.states[q[0]], M2.states[q[1]])
+    context_symbol = lambda func, q: None if func is None \
+        else func(label(q))
+    dead = {}  # ArcContext -> ill-formed
+
+    def is_dead(node):
+        d = dead.get(node)
+        if d is None:
+            if ignore_func is not None and ignore_func(node):
+                d = False
+            else:
+                marks = Eval1(node, Con)
+                d = Stat1(MarkedNode(node, marks), weights, stat_func) < 0.0
+            dead[node] = d
+        return d
+
+    states = _Interner([(M1.start, M2.start)])
+    succ_of = {}
+    (src, ilabel, olabel, dest) = ([], [], [], [])
+    agenda = [0]
+    while agenda:
+        q = agenda.pop()
+        (q1, q2) = states.labels[q]
+        p = context_symbol(prec, (q1, q2))
+        # Matching pairs of arcs out of q1 and q2
+        a = order1[indptr1[q1]:indptr1[q1 + 1]]
+        keys = q2 * S + M1.olabel[a]
+        lo = np.searchsorted(key2, keys, side='left')
+        hi = np.searchsorted(key2, keys, side='right')
+        counts = hi - lo
+        b = np.arange(counts.sum()) \
+            - np.repeat(np.cumsum(counts) - counts - lo, counts)
+        a = np.repeat(a, counts)
+        for (x, r1, z, r2) in zip(M1.ilabel[a].tolist(),
+                                  M1.dest[a].tolist(),
+                                  olabel2[b].tolist(),
+                                  dest2[b].tolist()):
+            r = (r1, r2)
+            s = succ_of.get(r)
+            if s is None:
+                s = succ_of[r] = context_symbol(succ, r)
+            if is_dead(ArcContext(p, symbols.labels[z], s)):
+                continue
+            n = len(states.labels)
+            r = states(r)
+            if r == n:
+                agenda.append(r)
+            src.append(q)
+            ilabel.append(x)
+            olabel.append(z)
+            dest.append(r)
+    pairs = np.array(states.labels, dtype=np.int64).reshape(-1, 2)
+    machine = Machine(symbols.labels, [label(q) for q in states.labels], 0,
+                      M1.finals[pairs[:, 0]] & M2.finals[pairs[:, 1]],
+                      *(np.array(x, dtype=np.int64) \
+                        for x in (src, ilabel, olabel, dest)))
+    return trim(machine)
+
+
+class _Layers():
+    """
+    Number of paths from each state to a final state that read
+    exactly n non-delimiter symbols, for n = 0, 1, ... on demand
+    (exact integers). Delimiter arcs must not form cycles.
+    """
+
+    def __init__(self, machine, delim):
+        self.machine = machine
+        is_delim = np.isin(np.array(machine.sigma, dtype=object),
+                           np.array(list(delim), dtype=object))
+        self.is_delim = is_delim
+        zero = is_delim[machine.olabel]
+        (self.src0, self.dest0) = (machine.src[zero], machine.dest[zero])
+        (self.src1, self.dest1) = (machine.src[~zero], machine.dest[~zero])
+        self.layers = []
+
+    def _close(self, base):
+        # Add paths that begin with delimiter arcs
+        v = base
+        while True:
+            w = base.copy()
+            np.add.at(w, self.src0, v[self.dest0])
+            if (w == v).all():
+                return w
+            v = w
+
+    def __getitem__(self, n):
+        while len(self.layers) <= n:
+            base = np.zeros(len(self.machine.states), dtype=object)
+            if not self.layers:
+                base[self.machine.finals] = 1
+            else:
+                np.add.at(base, self.src1, self.layers[-1][self.dest1])
+            self.layers.append(self._close(base))
+        return self.layers[n]
+
+
+def count_words(machine, max_len, delim=('⋊', '⋉')):
+    """
+    Number of accepted words of each length 0..max_len, counting
+    only symbols not in delim, by dynamic programming over the
+    machine without enumerating words. (Counts paths, which equal
+    words if machine is unambiguous, as the deterministic machines
+    built by ComposePrune from deterministic inputs are.)
+    """
+    layers = _Layers(machine, delim)
+    return [int(layers[n][machine.start]) for n in range(max_len + 1)]
+
+
+def sample_words(machine, n, k=1, delim=('⋊', '⋉'), seed=None):
+    """
+    k accepted words of length n (without delimiters) drawn uniformly
+    at random (uniformly over paths if machine is ambiguous), each
+    as a tuple of symbols; returns [] if there are none.
+    """
+    rng = random.Random(seed)
+    layers = _Layers(machine, delim)
+    if layers[n][machine.start] == 0:
+        return []
+    (order, indptr) = _out_arcs(len(machine.states), machine.src)
+    step = (~layers.is_delim[machine.olabel]).astype(np.int64)
+    words = []
+    for _ in range(k):
+        (q, m, word) = (machine.start, n, [])
+        while True:
+            arcs = order[indptr[q]:indptr[q + 1]]
+            stop = int(m == 0 and machine.finals[q])
+            weights = [
+                layers[m - step[a]][machine.dest[a]] if m >= step[a] else 0
+                for a in arcs.tolist()
+            ]
+            r = rng.randrange(stop + sum(weights))
+            if r < stop:
+                break
+            r -= stop
+            for (a, w) in zip(arcs.tolist(), weights):
+                if r < w:
+                    break
+                r -= w
+            if step[a]:
+                word.append(machine.sigma[machine.olabel[a]])
+            (q, m) = (int(machine.dest[a]), m - step[a])
+        words.append(tuple(word))
+    return words
+
+
+def iter_words(machine, max_len=None, delim=('⋊', '⋉'), printer=None):
+    """
+    Generate the accepted words (without delimiters) lazily in
+    shortlex order: by length, then lexicographically by position
+    of symbols in machine.sigma. Each word is generated once even
+    if machine is ambiguous, and only prefixes of accepted words of
+    the current length are explored. Stops after max_len, or when
+    there are no longer words. Words are tuples of symbols, or
+    printer(word) if printer is given (see word_printer).
+    """
+    layers = _Layers(machine, delim)
+    (order, indptr) = _out_arcs(len(machine.states), machine.src)
+    order = order[np.argsort(machine.olabel[order], kind='stable')]
+    order = order[np.argsort(machine.src[order], kind='stable')]
+    is_delim = layers.is_delim
+
+    def close(Q, m):
+        # States reachable from Q by delimiter arcs that can
+        # still read m symbols
+        Q = set(Q)
+        stack = list(Q)
+        while stack:
+            q = stack.pop()
+            for a in order[indptr[q]:indptr[q + 1]].tolist():
+                r = int(machine.dest[a])
+                if is_delim[machine.olabel[a]] and r not in Q \
+                    and layers[m][r] > 0:
+                    Q.add(r)
+                    stack.append(r)
+        return Q
+
+    def expand(Q, m, prefix):
+        if m == 0:
+            if machine.finals[list(Q)].any():
+                yield prefix
+            return
+        step = {}
+        for q in Q:
+            for a in order[indptr[q]:indptr[q + 1]].tolist():
+                (x, r) = (int(machine.olabel[a]), int(machine.dest[a]))
+                if not is_delim[x] and layers[m - 1][r] > 0:
+                    step.setdefault(x, set()).add(r)
+        for x in sorted(step):
+            yield from expand(close(step[x], m - 1), m - 1,
+                              prefix + (machine.sigma[x], ))
+
+    n = 0
+    while max_len is None or n <= max_len:
+        if not layers[n].any():
+            return
+        if layers[n][machine.start] > 0:
+            for word in expand(close([machine.start], n), n, ()):
+                yield word if printer is None else printer(word)
+        n += 1
+
+
+def _distances(machine, cost):
+    """
+    Cost of the cheapest path from each state to a final state
+    (inf if there is none), by Dijkstra's algorithm on reversed arcs.
+    """
+    n = len(machine.states)
+    dist = np.full(n, np.inf)
+    (order, indptr) = _out_arcs(n, machine.dest)
+    (src, cost) = (machine.src.tolist(), cost.tolist())
+    heap = [(0.0, q) for q in np.flatnonzero(machine.finals).tolist()]
+    heapq.heapify(heap)
+    while heap:
+        (d, q) = heapq.heappop(heap)
+        if d >= dist[q]:
+            continue
+        dist[q] = d
+        for a in order[indptr[q]:indptr[q + 1]].tolist():
+            d1 = d + cost[a]
+            if d1 < dist[src[a]]:
+                heapq.heappush(heap, (d1, src[a]))
+    return dist
+
+
+def iter_best_words(machine,
+                    cost,
+                    delim=('⋊', '⋉'),
+                    printer=None,
+                    unique=True):
+    """
+    Generate (word, cost) for the accepted words of any length in
+    order of increasing cost (minus harmony, see ArcCosts), shorter
+    words first among equal costs. A* search guided by the exact
+    cost-to-final of each state expands only prefixes of paths no
+    costlier than the current one. With unique, each word is
+    generated once, at its cheapest path (the default; repeats only
+    arise if machine is ambiguous). Words are tuples of symbols
+    without delimiters, or printer(word) if printer is given.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    h = _distances(machine, cost).tolist()
+    (order, indptr) = _out_arcs(len(machine.states), machine.src)
+    is_delim = np.isin(np.array(machine.sigma, dtype=object),
+                       np.array(list(delim), dtype=object))
+    (dest, olabel) = (machine.dest.tolist(), machine.olabel.tolist())
+    (cost, finals) = (cost.tolist(), machine.finals.tolist())
+    symbol = [None if is_delim[x] else x for x in range(len(machine.sigma))]
+    seen = set()
+    # Entries: (estimated total cost, length, tie, cost so far, state
+    # or -1 when complete, word as nested (prefix, symbol) pairs)
+    tie = itertools.count()
+    heap = []
+    if h[machine.start] < np.inf:
+        heap.append((h[machine.start], 0, next(tie), 0.0, machine.start,
+                     None))
+    while heap:
+        (f, m, _, g, q, word) = heapq.heappop(heap)
+        if q < 0:
+            symbols = []
+            while word is not None:
+                (word, x) = word
+                symbols.append(machine.sigma[x])
+            word = tuple(reversed(symbols))
+            if unique:
+                if word in seen:
+                    continue
+                seen.add(word)
+            yield (word if printer is None else printer(word), g)
+            continue
+        if finals[q]:
+            heapq.heappush(heap, (g, m, next(tie), g, -1, word))
+        for a in order[indptr[q]:indptr[q + 1]].tolist():
+            r = dest[a]
+            if h[r] == np.inf:
+                continue
+            g1 = g + cost[a]
+            x = symbol[olabel[a]]
+            (m1, word1) = (m, word) if x is None else (m + 1, (word, x))
+            heapq.heappush(heap, (g1 + h[r], m1, next(tie), g1, r, word1))
+
+
+def best_words(machine,
+               cost,
+               k=1,
+               delim=('⋊', '⋉'),
+               printer=None,
+               unique=True):
+    """
+    List of the k cheapest (most harmonic) (word, cost) pairs of
+    any length (see iter_best_words).
+    """
+    return list(
+        itertools.islice(
+            iter_best_words(machine, cost, delim, printer, unique), k))
+
+
+class MaxEnt():
+    """
+    MaxEnt distribution over the accepted words of each length n
+    (without delimiters) of machine, in which P(word) is proportional
+    to exp(harmony) under Con and HG weights, computed by the
+    forward-backward algorithm in log space over layers of states
+    rather than by enumerating words. Arcs are evaluated once per
+    distinct ArcContext. Features of an arc are the marks on its
+    subnodes with negative weighted sum, so its harmony is their
+    weighted sum. Delimiter arcs must not form cycles.
+    """
+
+    def __init__(self,
+                 machine,
+                 Con,
+                 weights,
+                 prec=None,
+                 succ=None,
+                 ignore_func=None,
+                 delim=('⋊', '⋉')):
+        self.machine = machine
+        (mm, inv) = EvalArcs(machine, Con, prec, succ, ignore_func)
+        w = weight_vector(mm, weights) if isinstance(weights, dict) \
+            else np.asarray(weights, dtype=np.float64)
+        self.con = mm.con
+        # Features (active marks) of each distinct context
+        rows = np.repeat(np.arange(mm.num_rows()), np.diff(mm.indptr))
+        val = mm.val.astype(np.float64)
+        score = np.bincount(rows, weights=w[mm.col] * val,
+                            minlength=mm.num_rows())
+        active = (score < 0.0)[rows]
+        F = np.zeros((mm.num_nodes(), len(mm.con)))
+        np.add.at(F, (mm.node[rows[active]], mm.col[active]), val[active])
+        self.features = F[inv]
+        self.log_weight = self.features @ w
+        is_delim = np.isin(np.array(machine.sigma, dtype=object),
+                           np.array(list(delim), dtype=object))
+        self.zero = is_delim[machine.olabel]  # delimiter arcs
+        self.alpha = []  # log forward values by length
+        self.beta = []  # log backward values by length
+        self.symbol_id = {x: i for (i, x) in enumerate(machine.sigma)}
+
+    def _close(self, base, src, dest, arcs):
+        # Add paths that continue with delimiter arcs src -> dest
+        v = base
+        lw = self.log_weight[arcs]
+        while True:
+            u = base.copy()
+            np.logaddexp.at(u, dest, v[src] + lw)
+            if np.array_equal(u, v):
+                return u
+            v = u
+
+    def _layer(self, layers, n, forward):
+        M = self.machine
+        (src, dest) = (M.src, M.dest) if forward else (M.dest, M.src)
+        zero = self.zero
+        while len(layers) <= n:
+            base = np.full(len(M.states), -np.inf)
+            if not layers:
+                if forward:
+                    base[M.start] = 0.0
+                else:
+                    base[M.finals] = 0.0
+            else:
+                arcs = np.flatnonzero(~zero)
+                np.logaddexp.at(base, dest[arcs],
+                                layers[-1][src[arcs]] + self.log_weight[arcs])
+            arcs = np.flatnonzero(zero)
+            layers.append(self._close(base, src[arcs], dest[arcs], arcs))
+        return layers[n]
+
+    def forward(self, n):
+        """
+        Log sum of the weights of paths from the start state to
+        each state that read n non-delimiter symbols.
+        """
+        return self._layer(self.alpha, n, True)
+
+    def backward(self, n):
+        """
+        Log sum of the weights of paths from each state to a final
+        state that read n non-delimiter symbols.
+        """
+        return self._layer(self.beta, n, False)
+
+    def log_Z(self, n):
+        """
+        Log of the normalizer over accepted words of length n
+        (-inf if there are none).
+        """
+        return float(self.backward(n)[self.machine.start])
+
+    def log_prob(self, word):
+        """
+        Log probability of word (sequence of symbols without
+        delimiters) among words of its length (-inf if rejected).
+        """
+        M = self.machine
+        n = len(word)
+        arcs0 = np.flatnonzero(self.zero)
+        v = np.full(len(M.states), -np.inf)
+        v[M.start] = 0.0
+        v = self._close(v, M.src[arcs0], M.dest[arcs0], arcs0)
+        for x in word:
+            x = self.symbol_id.get(x)
+            if x is None:
+                return -np.inf
+            arcs = np.flatnonzero(M.olabel == x)
+            u = np.full(len(M.states), -np.inf)
+            np.logaddexp.at(u, M.dest[arcs],
+                            v[M.src[arcs]] + self.log_weight[arcs])
+            v = self._close(u, M.src[arcs0], M.dest[arcs0], arcs0)
+        log_score = np.logaddexp.reduce(v[M.finals]) \
+            if M.finals.any() else -np.inf
+        return float(log_score - self.log_Z(n))
+
+    def expected_counts(self, n):
+        """
+        Dict of the expected feature value of each constraint over
+        words of length n; the gradient of the log-likelihood of a
+        word is its features minus these.
+        """
+        M = self.machine
+        log_Z = self.log_Z(n)
+        E = np.zeros(len(self.con))
+        if log_Z == -np.inf:
+            return dict(zip(self.con, E.tolist()))
+        (src, dest, lw, zero) = (M.src, M.dest, self.log_weight, self.zero)
+        for m in range(n + 1):
+            alpha = self.forward(m)
+            # Delimiter arcs within layer m, others from m to m + 1
+            post = np.where(
+                zero, alpha[src] + lw + self.backward(n - m)[dest],
+                alpha[src] + lw + self.backward(n - m - 1)[dest] \
+                    if m < n else -np.inf)
+            post = np.exp(post - log_Z)
+            E += post @ self.features
+        return dict(zip(self.con, E.tolist()))
+
+
+def word_printer(func, sigma=(), sep=' '):
+    """
+    Single-pass printer for words: func (e.g. a chain of re.sub
+    calls) is applied once per distinct symbol, precomputed for
+    symbols in sigma, and printed words join the results with sep.
+    """
+    table = {x: func(x) for x in sigma}
+
+    def printer(word):
+        try:
+            return sep.join([table[x] for x in word])
+        except KeyError:
+            for x in word:
+                if x not in table:
+                    table[x] = func(x)
+            return sep.join([table[x] for x in word])
+
+    return printer
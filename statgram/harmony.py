@@ -1,4 +1,8 @@
-from collections import namedtuple
+import contextlib, functools, operator, time
+from array import array
+from collections import namedtuple, OrderedDict
+from collections.abc import Mapping
+import numpy as np
 
 # Mark with value v assigned by constraint c,
 # optionally specifying subnode to which mark is assigned;
@@ -14,22 +18,185 @@ def Eval(M, Con, ignore_func=None):
     Evaluate each node of structure M with constraints in Con.
     (Nodes for which function ignore evaluates to true are not marked.)
     """
-    markup = []
+    return list(iter_eval(M, Con, ignore_func))
+
+
+def iter_eval(M, Con, ignore_func=None):
+    """
+    Lazy Eval: consume nodes of M (any iterable) one at a time 
+    and yield each marked node as soon as it is evaluated.
+    """
     ignore = (ignore_func is not None)
     for node in M:
         if ignore and ignore_func(node):
             continue
-        marks = dict()
-        for constraint in Con:
-            mark = constraint(node)
-            if mark.v == 0:
-                continue
-            subnode = mark.subnode
-            if not subnode in marks:
-                marks[subnode] = set()
-            marks[subnode].add(mark)
-        markup.append(MarkedNode(node, marks))
-    return markup
+        yield MarkedNode(node, Eval1(node, Con))
+
+
+def Eval1(node, Con):
+    """
+    Evaluate a single node with constraints in Con, 
+    returning mapping from subnodes to sets of marks.
+    """
+    if _profile is not None:
+        Con = _profile.instrument(Con)
+    marks = dict()
+    for constraint in Con:
+        mark = constraint(node)
+        if mark.v == 0:
+            continue
+        subnode = mark.subnode
+        if not subnode in marks:
+            marks[subnode] = set()
+        marks[subnode].add(mark)
+    return marks
+
+
+def locality(key):
+    """
+    Decorator declaring the locality window of a constraint: 
+    key(node) must be hashable and capture everything about node 
+    that the constraint reads, so that nodes with equal keys 
+    receive equal marks. For example, 
+        @locality(lambda t: (get_prec(t), t.olabel))
+        def SpreadNasR(t): ...
+    """
+
+    def decorate(constraint):
+        constraint.key = key
+        return constraint
+
+    return decorate
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class CachedConstraint():
+    """
+    Constraint with marks memoized on its key function, 
+    evicting least-recently used keys beyond maxsize 
+    (maxsize=None for an unbounded cache).
+    """
+
+    def __init__(self, constraint, key=None, maxsize=(1 << 16)):
+        functools.update_wrapper(self, constraint)
+        self.constraint = constraint
+        self.key = key if key is not None else constraint.key
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = self.misses = 0
+
+    def __call__(self, node):
+        k = self.key(node)
+        mark = self.cache.get(k)
+        if mark is not None:
+            self.hits += 1
+            if self.maxsize is not None:
+                self.cache.move_to_end(k)
+            return mark
+        self.misses += 1
+        mark = self.constraint(node)
+        self.cache[k] = mark
+        if self.maxsize is not None and len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return mark
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self.cache))
+
+    def cache_clear(self):
+        self.cache.clear()
+        self.hits = self.misses = 0
+
+
+def Memoize(Con, maxsize=(1 << 16)):
+    """
+    Wrap each constraint in Con that declares a locality key 
+    in an LRU cache; other constraints are returned unchanged.
+    """
+    return [
+        CachedConstraint(constraint, maxsize=maxsize) \
+            if hasattr(constraint, 'key') else constraint
+        for constraint in Con
+    ]
+
+
+def symbolic(*fields):
+    """
+    Decorator for a constraint over a finite alphabet, written as a
+    function of symbols; each field is an attribute name or function
+    selecting one symbol of a node. For example,
+        @symbolic(lambda t: get_prec(t), 'olabel')
+        def SpreadNasR(prec, x): ...
+    The decorated constraint is called on nodes as usual, and once
+    compiled over an alphabet it looks its marks up in a table.
+    """
+
+    def decorate(func):
+        return SymbolicConstraint(func, fields)
+
+    return decorate
+
+
+class SymbolicConstraint():
+    """
+    Constraint whose marks depend only on symbols selected from
+    a node, with a mark table over symbol tuples of an alphabet.
+    Table entries are filled on first use, so each distinct tuple
+    is evaluated once rather than every tuple of the alphabet up
+    front. The table is cleared when the alphabet changes; symbols
+    outside the alphabet (other than None, for missing context)
+    are evaluated directly.
+    """
+
+    def __init__(self, func, fields):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.fields = fields
+        getters = [operator.attrgetter(f) if isinstance(f, str) \
+            else f for f in fields]
+        if len(fields) > 1 and all(isinstance(f, str) for f in fields):
+            self.key = operator.attrgetter(*fields)
+        elif len(fields) == 1:
+            self.key = lambda node: (getters[0](node), )
+        else:
+            self.key = lambda node: tuple(get(node) for get in getters)
+        self.sigma = None
+        self.alphabet = frozenset()
+        self.table = {}
+
+    def __call__(self, node):
+        symbols = self.key(node)
+        mark = self.table.get(symbols)
+        if mark is None:
+            mark = self.func(*symbols)
+            alphabet = self.alphabet
+            if all(x in alphabet for x in symbols):
+                self.table[symbols] = mark
+        return mark
+
+    def compile(self, sigma):
+        sigma = tuple(sigma)
+        if sigma != self.sigma:
+            self.table = {}
+            self.sigma = sigma
+            self.alphabet = frozenset(sigma) | {None}
+        return self
+
+
+def Compile(Con, sigma):
+    """
+    Compile the symbolic constraints in Con over alphabet sigma
+    (their tables are filled as symbol tuples are seen); other
+    constraints are returned unchanged.
+    """
+    return [
+        constraint.compile(sigma) \
+            if isinstance(constraint, SymbolicConstraint) else constraint
+        for constraint in Con
+    ]
 
 
 def HGStat(marks, weights):
@@ -68,6 +235,8 @@ def Stat1(node, weights, stat_func=HGStat):
     for (subnode, marks) in node.marks.items():
         harmony = stat_func(marks, weights)
         harmony_total += harmony
+    if _profile is not None:
+        _profile.stat(node, weights, stat_func)
     return harmony_total
 
 
@@ -85,3 +254,979 @@ def Stat(markup, weights, stat_func=HGStat):
             harmony_total += harmony
             ill_nodes.append(node)
     return (harmony_total, ill_nodes)
+
+
+def iter_stat(markup, weights, stat_func=HGStat, early_exit=False):
+    """
+    Lazy Stat: yield (marked node, harmony) for each node of 
+    markup (any iterable, e.g. output of iter_eval). With 
+    early_exit, stop after the first ill-formed node.
+    """
+    for node in markup:
+        harmony = Stat1(node, weights, stat_func)
+        yield (node, harmony)
+        if early_exit and harmony < 0.0:
+            return
+
+
+# Profile of one constraint: calls, cumulative wall time (seconds),
+# nonzero marks assigned (positive and negative), and number and
+# fraction of nodes scored by Stat that it made ill-formed
+ConstraintProfile = namedtuple('ConstraintProfile', [
+    'constraint', 'calls', 'seconds', 'marks', 'positive', 'negative',
+    'ill', 'ill_fraction'
+])
+
+# Profile being recorded (None when profiling is off)
+_profile = None
+
+
+class _TimedConstraint():
+    """
+    Constraint that records its calls and marks in a Profile.
+    """
+
+    def __init__(self, constraint, record):
+        functools.update_wrapper(self, constraint)
+        self.constraint = constraint
+        self.record = record  # [calls, seconds, positive, negative]
+
+    def __call__(self, node):
+        t0 = time.perf_counter()
+        mark = self.constraint(node)
+        record = self.record
+        record[1] += time.perf_counter() - t0
+        record[0] += 1
+        if mark.v > 0:
+            record[2] += 1
+        elif mark.v < 0:
+            record[3] += 1
+        return mark
+
+
+class Profile():
+    """
+    Per-constraint counts and timings recorded by Eval1 (and so
+    Eval, iter_eval, Wellformed), EvalMatrix and Stat1 (and so Stat,
+    iter_stat) while profiling is on; see profile().
+
+    A node scored by Stat is made ill-formed by a constraint if it
+    marks an ill-formed subnode: with a weighted negative mark under
+    HGStat, with the highest-ranked (deciding) negative mark under
+    OTStat. Ill-formedness is attributed to mark names, which are
+    usually the names of the constraints.
+    """
+
+    def __init__(self):
+        self.constraints = OrderedDict()  # name -> record
+        self.wrappers = {}  # constraint -> _TimedConstraint
+        self.ill = {}  # mark name -> number of ill-formed nodes
+        self.nodes = 0  # nodes scored by Stat
+        self.ill_nodes = 0
+
+    def instrument(self, Con):
+        """
+        Constraints of Con wrapped to record into this profile.
+        """
+        wrappers = self.wrappers
+        timed = []
+        for constraint in Con:
+            wrapper = wrappers.get(constraint)
+            if wrapper is None:
+                name = getattr(constraint, '__name__', repr(constraint))
+                record = self.constraints.setdefault(name, [0, 0.0, 0, 0])
+                wrapper = wrappers[constraint] = \
+                    _TimedConstraint(constraint, record)
+            timed.append(wrapper)
+        return timed
+
+    def add(self, constraints):
+        """
+        Add constraint records (name -> [calls, seconds, positive,
+        negative]) from another profile, e.g. of a worker process.
+        """
+        for (name, record) in constraints.items():
+            total = self.constraints.setdefault(name, [0, 0.0, 0, 0])
+            for (k, x) in enumerate(record):
+                total[k] += x
+
+    def stat(self, node, weights, stat_func):
+        """
+        Record the constraints that make node ill-formed.
+        """
+        self.nodes += 1
+        culprits = set()
+        for (subnode, marks) in node.marks.items():
+            if stat_func(marks, weights) >= 0.0:
+                continue
+            if stat_func is OTStat:
+                top = max(weights[c] for (c, _, _) in marks)
+                culprits.update(c for (c, v, _) in marks \
+                    if v < 0 and weights[c] == top)
+            elif stat_func is HGStat:
+                culprits.update(c for (c, v, _) in marks \
+                    if weights[c] * v < 0.0)
+            else:
+                culprits.update(c for (c, v, _) in marks if v < 0)
+        if culprits:
+            self.ill_nodes += 1
+            for c in culprits:
+                self.ill[c] = self.ill.get(c, 0) + 1
+
+    def report(self):
+        """
+        List of ConstraintProfiles, in order of first call, followed
+        by mark names that were only seen by Stat.
+        """
+        names = list(self.constraints) + \
+            [c for c in self.ill if c not in self.constraints]
+        report = []
+        for name in names:
+            (calls, seconds, positive, negative) = \
+                self.constraints.get(name, (0, 0.0, 0, 0))
+            ill = self.ill.get(name, 0)
+            report.append(
+                ConstraintProfile(name, calls, seconds, positive + negative,
+                                  positive, negative, ill,
+                                  (ill / self.nodes) if self.nodes else 0.0))
+        return report
+
+    def format(self):
+        """
+        Text table of the report, slowest constraints first.
+        """
+        lines = [
+            f'{"constraint":20} {"calls":>9} {"seconds":>9} {"us/call":>8} '
+            f'{"marks":>9} {"+":>9} {"-":>9} {"ill":>7}'
+        ]
+        for x in sorted(self.report(), key=lambda x: -x.seconds):
+            per_call = (1.0e6 * x.seconds / x.calls) if x.calls else 0.0
+            lines.append(f'{x.constraint:20} {x.calls:9} {x.seconds:9.4f} '
+                         f'{per_call:8.2f} {x.marks:9} {x.positive:9} '
+                         f'{x.negative:9} {x.ill_fraction:7.2%}')
+        lines.append(f'{self.ill_nodes} of {self.nodes} nodes ill-formed')
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile():
+    """
+    Context manager that turns on per-constraint profiling and
+    yields the Profile being recorded. For example,
+        with profile() as prof:
+            Stat(Eval(M, Con), weights)
+        print(prof.format())
+    Outside of profile() the only cost is a check of a module
+    global per node.
+    """
+    global _profile
+    (previous, _profile) = (_profile, Profile())
+    try:
+        yield _profile
+    finally:
+        _profile = previous
+
+
+def instrumented(Con):
+    """
+    Constraints of Con, wrapped to record into the active profile
+    if any (for code that calls constraints directly).
+    """
+    return Con if _profile is None else _profile.instrument(Con)
+
+
+def Wellformed(M, Con, weights, stat_func=HGStat, ignore_func=None):
+    """
+    Well-formedness verdict for structure M, evaluating nodes 
+    only until the first ill-formed one is found.
+    """
+    markup = iter_eval(M, Con, ignore_func)
+    for (_, harmony) in iter_stat(markup, weights, stat_func,
+                                  early_exit=True):
+        if harmony < 0.0:
+            return False
+    return True
+
+
+def bounds(lo, hi, subnode=None, c=None):
+    """
+    Decorator declaring the range [lo, hi] of mark values a
+    constraint can assign, and optionally the only subnode it
+    marks and the name of its marks (default: the function name),
+    for use by PrunedStat. For example,
+        @bounds(-1, +1, subnode='nasal')
+        def NasN(t): ...
+    """
+
+    def decorate(constraint):
+        constraint.bounds = (lo, hi, subnode,
+                             c if c is not None else constraint.__name__)
+        return constraint
+
+    return decorate
+
+
+class PrunedStat():
+    """
+    Ill-formedness verdicts under HGStat or OTStat that call only as
+    many constraints as needed. Constraints are called in order of
+    decreasing absolute weight (or rank), and after each call the
+    best and worst harmony still reachable by each subnode is
+    bounded from the declared value ranges of the constraints not
+    yet called; evaluation stops as soon as the sign of the node's
+    harmony is fixed. Constraints without declared bounds can
+    assign any value to any subnode and are called first under
+    HGStat. (For OTStat pass in ranks instead of weights; ties in
+    rank go to the positive mark.)
+    """
+
+    def __init__(self, Con, weights, stat_func=HGStat):
+        if stat_func not in (HGStat, OTStat):
+            raise ValueError(f'unknown stat_func {stat_func}')
+        self.stat_func = stat_func
+        self.weights = weights
+        self.calls = 0
+        inf = float('inf')
+        plan = []
+        for constraint in Con:
+            (lo, hi, subnode, c) = getattr(constraint, 'bounds',
+                                           (-inf, inf, None, None))
+            # Weight (rank) of undeclared constraints is unknown
+            plan.append((constraint, lo, hi, subnode, weights.get(c)))
+        if stat_func is HGStat:
+            # Undeclared constraints first, then by absolute weight
+            plan.sort(key=lambda x: inf if x[4] is None else abs(x[4]),
+                      reverse=True)
+        else:
+            plan.sort(key=lambda x: inf if x[4] is None else x[4],
+                      reverse=True)
+        self.plan = plan
+        self.suffix = self._suffix_hg() if stat_func is HGStat \
+            else self._suffix_ot()
+
+    def _suffix_hg(self):
+        """
+        For each position in the plan, the lowest and highest weighted
+        sum that the constraints from there on can add to each
+        declared subnode (key None: to any subnode).
+        """
+        (lo_sum, hi_sum) = ({None: 0.0}, {None: 0.0})
+        suffix = [(dict(lo_sum), dict(hi_sum))]
+        for (constraint, lo, hi, subnode, w) in reversed(self.plan):
+            if w is None:
+                (lo_w, hi_w) = (-float('inf'), float('inf'))
+            elif w == 0.0:
+                (lo_w, hi_w) = (0.0, 0.0)
+            else:
+                (lo_w, hi_w) = sorted((w * lo, w * hi))
+            lo_sum[subnode] = lo_sum.get(subnode, 0.0) + min(lo_w, 0.0)
+            hi_sum[subnode] = hi_sum.get(subnode, 0.0) + max(hi_w, 0.0)
+            suffix.append((dict(lo_sum), dict(hi_sum)))
+        return suffix[::-1]
+
+    def _suffix_ot(self):
+        """
+        For each position in the plan, the highest rank of the
+        constraints from there on that can assign positive marks and
+        negative marks to each declared subnode (key None: to any
+        subnode).
+        """
+        (pos_rank, neg_rank) = ({None: -float('inf')}, {None: -float('inf')})
+        suffix = [(dict(pos_rank), dict(neg_rank))]
+        for (constraint, lo, hi, subnode, r) in reversed(self.plan):
+            r = float('inf') if r is None else r
+            if hi > 0:
+                pos_rank[subnode] = max(pos_rank.get(subnode, r), r)
+            if lo < 0:
+                neg_rank[subnode] = max(neg_rank.get(subnode, r), r)
+            suffix.append((dict(pos_rank), dict(neg_rank)))
+        return suffix[::-1]
+
+    def _decided_hg(self, score, i):
+        (lo_sum, hi_sum) = self.suffix[i]
+        (lo_any, hi_any) = (lo_sum[None], hi_sum[None])
+        for (subnode, x) in score.items():
+            if x + hi_sum.get(subnode, 0.0) + hi_any < 0.0:
+                return True
+        for (subnode, x) in score.items():
+            if x + lo_sum.get(subnode, 0.0) + lo_any < 0.0:
+                return None
+        # Subnodes not yet marked
+        if lo_any < 0.0 or any(x < 0.0 for (subnode, x) in \
+                lo_sum.items() if subnode not in score):
+            return None
+        return False
+
+    def _decided_ot(self, top, i):
+        (pos_rank, neg_rank) = self.suffix[i]
+        (pos_any, neg_any) = (pos_rank[None], neg_rank[None])
+        undecided = False
+        for (subnode, (r, v)) in top.items():
+            if v < 0:
+                if max(pos_rank.get(subnode, pos_any), pos_any) < r:
+                    return True
+                undecided = True
+            elif max(neg_rank.get(subnode, neg_any), neg_any) > r:
+                undecided = True
+        # Subnodes not yet marked
+        if undecided or neg_any > -float('inf') or any(subnode not in top \
+                for subnode in neg_rank if subnode is not None):
+            return None
+        return False
+
+    def __call__(self, node):
+        """
+        Evaluate node; returns ill-formedness and the marks assigned
+        by the constraints called, by subnode.
+        """
+        marks = dict()
+        state = dict()
+        is_hg = (self.stat_func is HGStat)
+        decide = self._decided_hg if is_hg else self._decided_ot
+        ill = decide(state, 0)
+        for (i, (constraint, _, _, _, w)) in enumerate(self.plan):
+            if ill is not None:
+                break
+            mark = constraint(node)
+            self.calls += 1
+            if mark.v != 0:
+                subnode = mark.subnode
+                marks.setdefault(subnode, set()).add(mark)
+                if is_hg:
+                    state[subnode] = state.get(subnode, 0.0) \
+                        + self.weights[mark.c] * mark.v
+                else:
+                    r = self.weights[mark.c]
+                    (r0, v0) = state.get(subnode, (-float('inf'), 0))
+                    if r > r0 or (r == r0 and mark.v > 0):
+                        state[subnode] = (r, mark.v)
+            ill = decide(state, i + 1)
+        return (ill, marks)
+
+
+def IllFormed(M, Con, weights, stat_func=HGStat, ignore_func=None):
+    """
+    Ill-formed nodes of structure M (as in Stat(Eval(...))), found
+    with PrunedStat; each is returned as a MarkedNode with the marks
+    of the constraints that were called on it.
+    (Nodes for which ignore_func evaluates to true are not marked.)
+    """
+    pruned = PrunedStat(Con, weights, stat_func)
+    ill_nodes = []
+    for node in M:
+        if ignore_func is not None and ignore_func(node):
+            continue
+        (ill, marks) = pruned(node)
+        if ill:
+            ill_nodes.append(MarkedNode(node, marks))
+    return ill_nodes
+
+
+class MarkMatrix():
+    """
+    Compiled markup: sparse (node, subnode) x constraint matrix of marks.
+    Each row holds the non-zero marks assigned to one subnode of one 
+    node, stored in compressed-row form (indptr, col, val); node[r] 
+    and subnode[r] give the node index and subnode id of row r.
+    Rows are ordered by node, nodes in the order they were evaluated.
+    Indices and values are stored in the smallest integer dtypes 
+    that hold them. A MarkMatrix is also a sequence of MarkedNode 
+    views, so it can stand in for Eval output (e.g. in Stat).
+    """
+
+    def __init__(self, nodes, con, subnodes, node, subnode, indptr, col,
+                 val):
+        self.nodes = nodes  # evaluated nodes
+        self.con = con  # constraint names (columns)
+        self.subnodes = subnodes  # subnode names
+        self.node = node  # node index of each row
+        self.subnode = subnode  # subnode id of each row
+        self.indptr = indptr  # marks of row r are indptr[r]:indptr[r+1]
+        self.col = col  # constraint index of each mark
+        self.val = val  # value of each mark
+
+    @classmethod
+    def from_markup(cls, markup):
+        """
+        Compile a list of MarkedNodes (output of Eval).
+        """
+        builder = _MarkMatrixBuilder()
+        for node in markup:
+            builder.add(node.n,
+                        (mark for marks in node.marks.values() \
+                            for mark in marks))
+        return builder.build()
+
+    @classmethod
+    def concat(cls, mms):
+        """
+        Stack MarkMatrices node-wise, merging their constraint 
+        and subnode vocabularies.
+        """
+        nodes, con_id, subnode_id = [], {}, {}
+        node, subnode, indptr, col, val = [], [], [], [], []
+        offset = 0
+        for mm in mms:
+            con_map = [con_id.setdefault(c, len(con_id)) for c in mm.con]
+            subnode_map = [
+                subnode_id.setdefault(x, len(subnode_id))
+                for x in mm.subnodes
+            ]
+            node.append(mm.node.astype(np.int64) + len(nodes))
+            subnode.append(np.array(subnode_map, dtype=np.int64)[mm.subnode])
+            indptr.append(mm.indptr[1:].astype(np.int64) + offset)
+            col.append(np.array(con_map, dtype=np.int64)[mm.col])
+            val.append(mm.val)
+            nodes += mm.nodes
+            offset += mm.num_marks()
+        stack = lambda x, dtype: np.concatenate([np.zeros(0, dtype)] + x) \
+            .astype(dtype)
+        return MarkMatrix(
+            nodes, list(con_id), list(subnode_id),
+            stack(node, _min_dtype(len(nodes))),
+            stack(subnode, _min_dtype(len(subnode_id))),
+            stack([np.zeros(1, np.int64)] + indptr, _min_dtype(offset)),
+            stack(col, _min_dtype(len(con_id))),
+            stack(val, np.result_type(np.int8, *val)))
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getitem__(self, i):
+        return MarkedNode(self.nodes[i], _MarksView(self, i))
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self.nodes)))
+
+    def node_rows(self, i):
+        """
+        Range of rows of node i.
+        """
+        if not hasattr(self, '_node_ptr'):
+            self._node_ptr = np.searchsorted(
+                self.node, np.arange(len(self.nodes) + 1)).tolist()
+        return range(self._node_ptr[i], self._node_ptr[i + 1])
+
+    def num_nodes(self):
+        return len(self.nodes)
+
+    def num_rows(self):
+        return len(self.node)
+
+    def num_marks(self):
+        return len(self.col)
+
+    def patterns(self, max_size=(1 << 22)):
+        """
+        Distinct rows of mm as a dense matrix X (one column per 
+        constraint), distinct nodes as a matrix P listing the row 
+        patterns of each, and index of each row / node into X / P.
+        Returns (X, row_inv, P, node_inv), or None if X would 
+        have more than max_size entries.
+        """
+        if not hasattr(self, '_patterns'):
+            self._patterns = None
+            if self.num_rows() * len(self.con) <= max_size:
+                X = np.zeros((self.num_rows(), len(self.con)))
+                row = np.repeat(np.arange(self.num_rows()),
+                                np.diff(self.indptr))
+                np.add.at(X, (row, self.col), self.val)
+                X, row_inv = np.unique(X, axis=0, return_inverse=True)
+                row_inv = row_inv.reshape(-1)
+                (P, node_inv) = self.node_patterns(row_inv)
+                self._patterns = (X, row_inv, P, node_inv)
+        return self._patterns
+
+    def node_patterns(self, row_inv):
+        """
+        Given the pattern id of each row, distinct nodes as a matrix 
+        P whose row j lists the row patterns of node pattern j 
+        (padded with U, the number of row patterns), and index 
+        of each node into P.
+        """
+        # Node signature: sorted row patterns of node
+        signature = [[] for _ in self.nodes]
+        for (i, x) in zip(self.node.tolist(), row_inv.tolist()):
+            signature[i].append(x)
+        signature_id = {}
+        node_inv = np.array([
+            signature_id.setdefault(tuple(sorted(x)), len(signature_id))
+            for x in signature
+        ],
+                            dtype=np.int64)
+        U = np.max(row_inv, initial=-1) + 1
+        width = max([len(x) for x in signature_id], default=0)
+        P = np.full((len(signature_id), width), U, dtype=np.int64)
+        for (x, j) in signature_id.items():
+            P[j, :len(x)] = x
+        return (P, node_inv)
+
+
+class _MarksView(Mapping):
+    """
+    Read-only mapping from subnodes of node i of a MarkMatrix 
+    to tuples of its Marks, unpacked on demand.
+    """
+    __slots__ = ('mm', 'i')
+
+    def __init__(self, mm, i):
+        self.mm = mm
+        self.i = i
+
+    def items(self):
+        mm = self.mm
+        for r in mm.node_rows(self.i):
+            subnode = mm.subnodes[mm.subnode[r]]
+            (start, stop) = mm.indptr[r:(r + 2)].tolist()
+            yield (subnode, tuple(Mark(mm.con[k], v, subnode) \
+                for (k, v) in zip(mm.col[start:stop].tolist(),
+                                  mm.val[start:stop].tolist())))
+
+    def __getitem__(self, subnode):
+        for (subnode1, marks) in self.items():
+            if subnode1 == subnode:
+                return marks
+        raise KeyError(subnode)
+
+    def __iter__(self):
+        return (subnode for (subnode, _) in self.items())
+
+    def __len__(self):
+        return len(self.mm.node_rows(self.i))
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def _min_dtype(n, signed=False):
+    """
+    Smallest integer dtype that holds 0..n (or -n..n if signed).
+    """
+    for dtype in ((np.int8, np.int16, np.int32) if signed \
+            else (np.uint8, np.uint16, np.uint32)):
+        if n <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class _MarkMatrixBuilder():
+    """
+    Accumulate marks node by node and pack them into a MarkMatrix.
+    Marks are buffered in typed arrays rather than lists of objects.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.con, self.con_id = [], {}
+        self.subnodes, self.subnode_id = [], {}
+        self.node, self.subnode = array('q'), array('q')
+        self.row, self.col, self.val = array('q'), array('q'), array('b')
+
+    def add(self, n, marks):
+        i = len(self.nodes)
+        self.nodes.append(n)
+        rows = {}  # subnode id -> row
+        for (c, v, subnode) in marks:
+            if v == 0:
+                continue
+            k = self.con_id.get(c)
+            if k is None:
+                k = self.con_id[c] = len(self.con)
+                self.con.append(c)
+            s = self.subnode_id.get(subnode)
+            if s is None:
+                s = self.subnode_id[subnode] = len(self.subnodes)
+                self.subnodes.append(subnode)
+            r = rows.get(s)
+            if r is None:
+                r = rows[s] = len(self.node)
+                self.node.append(i)
+                self.subnode.append(s)
+            self.row.append(r)
+            self.col.append(k)
+            try:
+                self.val.append(v)
+            except (TypeError, OverflowError):
+                # Non-integer or large mark value
+                self.val = array('d', self.val)
+                self.val.append(v)
+
+    def build(self):
+        row = np.frombuffer(self.row, dtype=np.int64)
+        order = np.argsort(row, kind='stable')
+        R, nnz = len(self.node), len(self.row)
+        indptr = np.zeros(R + 1, dtype=_min_dtype(nnz))
+        np.cumsum(np.bincount(row, minlength=R), out=indptr[1:])
+        node = np.frombuffer(self.node, dtype=np.int64)
+        subnode = np.frombuffer(self.subnode, dtype=np.int64)
+        col = np.frombuffer(self.col, dtype=np.int64)[order]
+        val = np.frombuffer(self.val, dtype=np.int8 \
+            if self.val.typecode == 'b' else np.float64)[order]
+        return MarkMatrix(self.nodes, self.con, self.subnodes,
+                          node.astype(_min_dtype(len(self.nodes))),
+                          subnode.astype(_min_dtype(len(self.subnodes))),
+                          indptr, col.astype(_min_dtype(len(self.con))),
+                          val)
+
+
+def EvalMatrix(M, Con, ignore_func=None):
+    """
+    Evaluate each node of structure M with constraints in Con,
+    compiling the marks directly into a MarkMatrix.
+    (Nodes for which function ignore evaluates to true are not marked.)
+    """
+    Con = instrumented(Con)
+    builder = _MarkMatrixBuilder()
+    ignore = (ignore_func is not None)
+    for node in M:
+        if ignore and ignore_func(node):
+            continue
+        builder.add(node, [constraint(node) for constraint in Con])
+    return builder.build()
+
+
+def weight_vector(mm, weights):
+    """
+    Weights (or ranks) dict as a vector aligned with the columns of mm.
+    """
+    return np.array([weights[c] for c in mm.con], dtype=np.float64)
+
+
+def _row_harmony_dense(X, w, stat_func):
+    """
+    Harmony of each row of dense mark matrix X under w.
+    """
+    if stat_func is HGStat:
+        return np.minimum(w @ X.T, 0.0)
+    if stat_func is OTStat:
+        r = w[..., np.newaxis, :]
+        pos = np.where(X > 0, r, -np.inf).max(axis=-1, initial=-np.inf)
+        neg = np.where(X < 0, r, -np.inf).max(axis=-1, initial=-np.inf)
+        return np.where(neg > pos, -1.0, 0.0)
+    raise ValueError(f'no compiled form of stat function {stat_func}')
+
+
+def _pad(harmony):
+    """
+    Append a column of zero harmony, indexed by the padding 
+    value of MarkMatrix.node_patterns.
+    """
+    pad = np.zeros(harmony.shape[:-1] + (1, ))
+    return np.concatenate([harmony, pad], axis=-1)
+
+
+def row_harmony(mm, w, stat_func=HGStat):
+    """
+    Harmony of each row (marked subnode) of mm under weight vector w 
+    (or rank vector for OTStat). If w is a K x |Con| matrix, returns 
+    a K x rows matrix with one row of harmonies per grammar.
+    """
+    w = np.asarray(w, dtype=np.float64)
+    if mm.num_rows() == 0:
+        return np.zeros(w.shape[:-1] + (0, ))
+    patterns = mm.patterns()
+    if patterns is not None:
+        # Score each distinct row once, then scatter
+        (X, row_inv, _, _) = patterns
+        return _row_harmony_dense(X, w, stat_func)[..., row_inv]
+    starts = mm.indptr[:-1]
+    if stat_func is HGStat:
+        # Sparse matrix-vector product, then min0
+        score = np.add.reduceat(w[..., mm.col] * mm.val, starts, axis=-1)
+        return np.minimum(score, 0.0)
+    if stat_func is OTStat:
+        # Ill-formed iff the highest-ranked negative mark outranks
+        # every positive mark (ties go to the positive mark)
+        r = w[..., mm.col]
+        pos = np.maximum.reduceat(np.where(mm.val > 0, r, -np.inf),
+                                  starts,
+                                  axis=-1)
+        neg = np.maximum.reduceat(np.where(mm.val < 0, r, -np.inf),
+                                  starts,
+                                  axis=-1)
+        return np.where(neg > pos, -1.0, 0.0)
+    raise ValueError(f'no compiled form of stat function {stat_func}')
+
+
+def node_harmony(mm, w, stat_func=HGStat):
+    """
+    Harmony of each node of mm under weight vector w 
+    (or K x N harmonies under K x |Con| weight matrix w).
+    """
+    w = np.asarray(w, dtype=np.float64)
+    patterns = mm.patterns()
+    if patterns is not None:
+        # Score each distinct node once, then scatter
+        (X, _, P, node_inv) = patterns
+        harmony = _pad(_row_harmony_dense(X, w, stat_func))[..., P]
+        harmony = harmony.sum(axis=-1)
+        return harmony[..., node_inv]
+    harmony = row_harmony(mm, w, stat_func)
+    node_harmony = np.zeros(harmony.shape[:-1] + (mm.num_nodes(), ))
+    if mm.num_rows() > 0:
+        # Rows are grouped by node
+        starts = np.flatnonzero(np.diff(mm.node, prepend=-1))
+        node_harmony[..., mm.node[starts]] = \
+            np.add.reduceat(harmony, starts, axis=-1)
+    return node_harmony
+
+
+def StatMatrix(mm, weights, stat_func=HGStat):
+    """
+    Apply static HG or OT harmony function to each node of 
+    compiled markup mm; returns total harmony and boolean mask 
+    of ill-formed nodes (harmony < 0).
+    (For OTStat pass in ranks instead of weights; weights may be 
+    a dict or a vector aligned with mm.con.)
+    """
+    if isinstance(weights, dict):
+        weights = weight_vector(mm, weights)
+    harmony = node_harmony(mm, weights, stat_func)
+    ill = (harmony < 0.0)
+    harmony_total = float(harmony[ill].sum())
+    return (harmony_total, ill)
+
+
+def weight_matrix(mm, weights_list):
+    """
+    Sequence of weights (or ranks) dicts as a K x |Con| matrix 
+    aligned with the columns of mm.
+    """
+    return np.array([[weights[c] for c in mm.con] \
+        for weights in weights_list], dtype=np.float64)
+
+
+def StatBatch(mm, W, stat_func=HGStat, block_size=None):
+    """
+    Apply static HG or OT harmony function under each of K grammars 
+    to compiled markup mm; W is a K x |Con| weight (or rank) matrix 
+    aligned with mm.con, or a list of K weights (ranks) dicts.
+    Returns K x N matrix of node harmonies and K x N boolean mask 
+    of ill-formed nodes. Grammars are scored block_size at a time 
+    (default: bounded by the number of marks).
+    """
+    if stat_func is OTStat:
+        return CompiledOT(mm).stat_batch(W, block_size)
+    if not isinstance(W, np.ndarray):
+        W = weight_matrix(mm, W)
+    K = W.shape[0]
+    if block_size is None:
+        block_size = max(1, (1 << 22) // max(1, mm.num_marks()))
+    harmony = np.zeros((K, mm.num_nodes()))
+    for k in range(0, K, block_size):
+        harmony[k:(k + block_size)] = \
+            node_harmony(mm, W[k:(k + block_size)], stat_func)
+    ill = (harmony < 0.0)
+    return (harmony, ill)
+
+
+class CompiledOT():
+    """
+    OTStat compiled over a MarkMatrix. Each row (subnode) is encoded 
+    as a pair of bitsets over constraint indices: the constraints 
+    that assign it positive and negative marks. Under a ranking, 
+    the subnode is ill-formed iff the highest-ranked member of its 
+    negative set outranks that of its positive set, i.e. iff the 
+    highest set bit of neg exceeds that of pos once bits are 
+    permuted into rank order. Distinct (pos, neg) pairs and 
+    distinct nodes are scored once per ranking. For up to 
+    table_max constraints, each ranking is first compiled into a 
+    table of the highest-ranked member of every constraint subset, 
+    so that scoring a subnode is two table lookups.
+    (Ties in rank go to the positive mark, as in StatMatrix.)
+    """
+
+    def __init__(self, mm, table_max=16):
+        self.mm = mm
+        C = len(mm.con)
+        self.table = (C <= table_max)
+        n_words = max(1, -(-C // 64))
+        R = mm.num_rows()
+        row = np.repeat(np.arange(R), np.diff(mm.indptr))
+        col = mm.col.astype(np.uint64)
+        word = (col // np.uint64(64)).astype(np.int64)
+        bit = np.left_shift(np.uint64(1), col % np.uint64(64))
+        bits = np.zeros((R, 2 * n_words), dtype=np.uint64)
+        pos = (mm.val > 0)
+        np.bitwise_or.at(bits, (row[pos], word[pos]), bit[pos])
+        np.bitwise_or.at(bits, (row[~pos], n_words + word[~pos]), bit[~pos])
+        bits, row_inv = np.unique(bits, axis=0, return_inverse=True)
+        self.pos, self.neg = bits[:, :n_words], bits[:, n_words:]
+        (self.P, self.node_inv) = mm.node_patterns(row_inv.reshape(-1))
+
+    def _highest(self, bits, r):
+        """
+        Highest rank (K x U) among constraints in each bitset 
+        under each of the K rank vectors r; -inf for empty sets.
+        """
+        K, C = r.shape
+        if self.table:
+            # Highest-ranked member of every subset of constraints
+            top = np.full((K, 1 << C), -np.inf)
+            for c in range(C):
+                top[:, (1 << c):(1 << (c + 1))] = \
+                    np.maximum(top[:, :(1 << c)], r[:, c:(c + 1)])
+            return top[:, bits[:, 0].astype(np.int64)]
+        top = np.full((K, len(bits)), -np.inf)
+        for c in range(C):
+            has = (bits[:, c // 64] >> np.uint64(c % 64)) & np.uint64(1)
+            top = np.where(has.astype(bool), np.maximum(top, r[:, c:(c + 1)]),
+                           top)
+        return top
+
+    def pattern_harmony(self, R):
+        """
+        K x |P| harmonies of distinct nodes under K x |Con| 
+        rank matrix R.
+        """
+        R = np.asarray(R, dtype=np.float64)
+        ill = self._highest(self.neg, R) > self._highest(self.pos, R)
+        return 0.0 - _pad(ill.astype(np.float64))[..., self.P].sum(axis=-1)
+
+    def node_harmony(self, R):
+        """
+        K x N node harmonies under K x |Con| rank matrix R.
+        """
+        return self.pattern_harmony(R)[:, self.node_inv]
+
+    def stat(self, ranks):
+        """
+        Total harmony and ill-formed node mask under one ranking 
+        (dict or vector aligned with mm.con), as in StatMatrix.
+        """
+        if isinstance(ranks, dict):
+            ranks = weight_vector(self.mm, ranks)
+        harmony = self.node_harmony(np.asarray(ranks)[np.newaxis, :])[0]
+        ill = (harmony < 0.0)
+        return (float(harmony[ill].sum()), ill)
+
+    def stat_batch(self, R, block_size=None):
+        """
+        K x N node harmonies and ill-formed masks under K rankings, 
+        as in StatBatch.
+        """
+        if not isinstance(R, np.ndarray):
+            R = weight_matrix(self.mm, R)
+        K = R.shape[0]
+        if block_size is None:
+            width = (1 << R.shape[1]) if self.table else len(self.pos)
+            block_size = max(1, (1 << 22) // max(1, width, len(self.P)))
+        harmony = np.zeros((K, self.mm.num_nodes()))
+        for k in range(0, K, block_size):
+            harmony[k:(k + block_size)] = \
+                self.node_harmony(R[k:(k + block_size)])
+        return (harmony, harmony < 0.0)
+
+    def num_ill(self, R, block_size=None):
+        """
+        Number of ill-formed nodes under each of K rankings, 
+        without expanding to a K x N matrix.
+        """
+        if not isinstance(R, np.ndarray):
+            R = weight_matrix(self.mm, R)
+        K = R.shape[0]
+        if block_size is None:
+            width = (1 << R.shape[1]) if self.table else len(self.pos)
+            block_size = max(1, (1 << 22) // max(1, width, len(self.P)))
+        count = np.bincount(self.node_inv, minlength=len(self.P))
+        num_ill = np.zeros(K, dtype=np.int64)
+        for k in range(0, K, block_size):
+            ill = self.pattern_harmony(R[k:(k + block_size)]) < 0.0
+            num_ill[k:(k + block_size)] = ill @ count
+        return num_ill
+
+
+def _ranges(indptr, idx):
+    """
+    Concatenated ranges indptr[i]:indptr[i+1] for i in idx, 
+    with the offset of each range in the result.
+    """
+    start = indptr[idx].astype(np.int64)
+    length = indptr[idx + 1].astype(np.int64) - start
+    offset = np.zeros(len(idx), dtype=np.int64)
+    np.cumsum(length[:-1], out=offset[1:])
+    ranges = np.arange(length.sum()) - np.repeat(offset - start, length)
+    return (ranges, offset)
+
+
+class IncrementalStat():
+    """
+    HGStat over a MarkMatrix that is kept up to date as individual 
+    constraint weights change. An inverted index from constraints 
+    to the rows they mark means that changing the weight of c only 
+    rescores the rows (and nodes) that c marks. Affected rows and 
+    nodes are recomputed from their marks rather than adjusted by 
+    the weight difference, so well-formedness at exactly zero 
+    harmony does not drift. Constraints that mark no node keep 
+    their weights but have no effect.
+    """
+
+    def __init__(self, mm, weights):
+        self.mm = mm
+        self.w = weight_vector(mm, weights) if isinstance(weights, dict) \
+            else np.array(weights, dtype=np.float64)
+        self.con_id = {c: k for (k, c) in enumerate(mm.con)}
+        # Weights of constraints without marks
+        self.unmarked = {c: w for (c, w) in weights.items() \
+            if c not in self.con_id} if isinstance(weights, dict) else {}
+        # Inverted index: rows marked by constraint k are
+        # con_row[con_ptr[k]:con_ptr[k+1]]
+        row = np.repeat(np.arange(mm.num_rows()), np.diff(mm.indptr))
+        order = np.lexsort((row, mm.col))
+        con_row = row[order]
+        keep = np.ones(len(con_row), dtype=bool)
+        keep[1:] = (con_row[1:] != con_row[:-1]) \
+            | (mm.col[order][1:] != mm.col[order][:-1])
+        self.con_row = con_row[keep]
+        self.con_ptr = np.zeros(len(mm.con) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(mm.col[order][keep], minlength=len(mm.con)),
+                  out=self.con_ptr[1:])
+        # Rows of node i are node_ptr[i]:node_ptr[i+1]
+        self.node_ptr = np.searchsorted(mm.node,
+                                        np.arange(mm.num_nodes() + 1))
+        self.row_h = row_harmony(mm, self.w)
+        self.node_h = node_harmony(mm, self.w)
+        self.ill = (self.node_h < 0.0)
+        self.harmony_total = float(self.node_h.sum())
+
+    def set_weight(self, c, weight):
+        """
+        Change the weight of constraint c. Returns the updated total 
+        harmony and the indices of nodes that became ill-formed and 
+        well-formed.
+        """
+        k = self.con_id.get(c)
+        if k is None:
+            self.unmarked[c] = weight
+            empty = np.zeros(0, dtype=np.int64)
+            return (self.harmony_total, empty, empty)
+        self.w[k] = weight
+        mm = self.mm
+        rows = self.con_row[self.con_ptr[k]:self.con_ptr[k + 1]]
+        if len(rows) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return (self.harmony_total, empty, empty)
+        # Rescore affected rows
+        (marks, offset) = _ranges(mm.indptr, rows)
+        score = np.add.reduceat(self.w[mm.col[marks]] * mm.val[marks],
+                                offset)
+        self.row_h[rows] = np.minimum(score, 0.0)
+        # Rescore affected nodes
+        nodes = np.unique(mm.node[rows])
+        (rows1, offset) = _ranges(self.node_ptr, nodes)
+        node_h = np.add.reduceat(self.row_h[rows1], offset)
+        self.harmony_total += float(node_h.sum() - self.node_h[nodes].sum())
+        self.node_h[nodes] = node_h
+        ill = (node_h < 0.0)
+        newly_ill = nodes[ill & ~self.ill[nodes]]
+        newly_wellformed = nodes[~ill & self.ill[nodes]]
+        self.ill[nodes] = ill
+        return (self.harmony_total, newly_ill, newly_wellformed)
+
+    def weights(self):
+        weights = dict(zip(self.mm.con, self.w.tolist()))
+        weights.update(self.unmarked)
+        return weights
+
+    def ill_nodes(self):
+        return np.flatnonzero(self.ill)
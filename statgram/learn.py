@@ -0,0 +1,362 @@
+import math
+from collections import namedtuple
+from fractions import Fraction
+import numpy as np
+
+from statgram.harmony import MarkMatrix
+
+# Learned weights (dict, or None if none were found), feasibility
+# (True, False, or None if undetermined), and certificate of
+# infeasibility: list of (sign, node, subnode, multiplier) such that
+# the multiplier-weighted sum of the row inequalities is contradictory
+LearnedWeights = namedtuple('LearnedWeights',
+                            ['weights', 'feasible', 'certificate'])
+
+
+def _compile(markup):
+    return markup if isinstance(markup, MarkMatrix) \
+        else MarkMatrix.from_markup(markup)
+
+
+def _rows(mm):
+    """
+    Row index of each mark of mm.
+    """
+    return np.repeat(np.arange(mm.num_rows()), np.diff(mm.indptr))
+
+
+def _exact(w, max_denominator=(1 << 20)):
+    """
+    Weights w rounded to nearby rationals and, unless all their
+    denominators are powers of two, rescaled to integers, so that
+    weighted sums of integer marks are exact in any order (as
+    computed by Stat) and scores of zero stay zero.
+    """
+    w = [Fraction(x).limit_denominator(max_denominator) \
+        if x > 0.0 else Fraction(0) for x in w.tolist()]
+    den = 1
+    for x in w:
+        den = math.lcm(den, x.denominator)
+    if den & (den - 1) == 0 or den > (1 << 32):
+        den = 1
+    return np.array([float(x * den) for x in w])
+
+
+def _consistent(mm, n_pos, w):
+    """
+    True if every positive node (index < n_pos) of mm is well-formed
+    and every negative node ill-formed under HGStat weights w.
+    """
+    score = np.bincount(_rows(mm),
+                        weights=w[mm.col] * mm.val.astype(np.float64),
+                        minlength=mm.num_rows())
+    is_neg = (mm.node >= n_pos)
+    ill = np.zeros(mm.num_nodes(), dtype=bool)
+    np.logical_or.at(ill, mm.node[is_neg], score[is_neg] < 0.0)
+    return bool((score[~is_neg] >= 0.0).all() and ill[n_pos:].all())
+
+
+def _verified(mm, n_pos, w):
+    """
+    LearnedWeights for solution w after rounding with _exact,
+    feasible only if the rounded weights classify every node.
+    """
+    w = _exact(w)
+    feasible = True if _consistent(mm, n_pos, w) else None
+    return LearnedWeights(dict(zip(mm.con, w.tolist())), feasible, None)
+
+
+def learn_weights(pos,
+                  neg,
+                  method='lp',
+                  margin=1.0,
+                  max_weight=1.0e3,
+                  max_iter=10000,
+                  rate=0.1):
+    """
+    Find non-negative HGStat weights under which every node of
+    markup pos is well-formed (each of its subnodes has weighted
+    sum >= 0) and every node of markup neg is ill-formed (some
+    subnode has weighted sum <= -margin; margin only fixes the
+    scale). Markups may be MarkMatrices or lists of MarkedNodes.
+
+    method='lp' solves the problem exactly with scipy (HiGHS). If
+    every negative node is marked on a single subnode, the problem
+    is a linear program; when it is infeasible, a Farkas certificate
+    is returned. Otherwise the choice of ill-formed subnode is a
+    binary variable, weights are bounded by max_weight, and no
+    certificate is given.
+
+    method='perceptron' runs batch projected subgradient descent
+    on the hinge loss of the same inequalities using only NumPy;
+    it returns feasible=True on convergence and None otherwise.
+
+    Solutions are rounded to nearby rationals and, if needed, scaled
+    to integers (see _exact), and feasible=True is only reported
+    once the rounded weights are checked to classify every node;
+    otherwise they are returned with feasible=None.
+    """
+    (pos, neg) = (_compile(pos), _compile(neg))
+    mm = MarkMatrix.concat([pos, neg])
+    n_pos = pos.num_nodes()
+    neg_rows = np.flatnonzero(mm.node >= n_pos)
+    # Negative nodes without marks can never be ill-formed
+    unmarked = np.setdiff1d(np.arange(n_pos, mm.num_nodes()),
+                            mm.node[neg_rows])
+    if len(unmarked) > 0:
+        certificate = [('-', int(i - n_pos), None, 1.0) for i in unmarked]
+        return LearnedWeights(None, False, certificate)
+    if method == 'lp':
+        return _learn_lp(mm, n_pos, margin, max_weight)
+    if method == 'perceptron':
+        return _learn_perceptron(mm, n_pos, margin, max_iter, rate)
+    raise ValueError(f'unknown learning method {method}')
+
+
+def _learn_lp(mm, n_pos, margin, max_weight):
+    try:
+        from scipy import sparse
+        from scipy.optimize import Bounds, LinearConstraint, linprog, milp
+    except ImportError as e:
+        raise ImportError("learn_weights(method='lp') requires scipy") \
+            from e
+    C, R = len(mm.con), mm.num_rows()
+    A = sparse.csr_matrix((mm.val.astype(np.float64), mm.col.astype(
+        np.int64), mm.indptr.astype(np.int64)),
+                          shape=(R, C))
+    is_neg = (mm.node >= n_pos)
+    # Positive rows: -x.w <= 0; negative rows: x.w <= -margin
+    sign = np.where(is_neg, 1.0, -1.0)
+    A_ub = sparse.diags(sign) @ A
+    b_ub = np.where(is_neg, -margin, 0.0)
+
+    neg_nodes = mm.node[is_neg]
+    if len(neg_nodes) == len(np.unique(neg_nodes)):
+        result = _solve(linprog,
+                        np.ones(C),
+                        A_ub=A_ub,
+                        b_ub=b_ub,
+                        bounds=(0, None),
+                        method='highs')
+        if result.status == 0:
+            return _verified(mm, n_pos, result.x)
+        if result.status != 2:
+            # Iteration limit or numerical failure: undetermined
+            return LearnedWeights(None, None, None)
+        # Farkas: y >= 0, A_ub^T y >= 0, b_ub^T y < 0
+        farkas = linprog(b_ub,
+                         A_ub=-A_ub.T,
+                         b_ub=np.zeros(C),
+                         A_eq=np.ones((1, R)),
+                         b_eq=np.ones(1),
+                         bounds=(0, None),
+                         method='highs')
+        certificate = None
+        if farkas.status == 0 and farkas.fun < 0.0:
+            certificate = [('-' if is_neg[r] else '+',
+                            int(mm.node[r] - (n_pos if is_neg[r] else 0)),
+                            mm.subnodes[mm.subnode[r]], float(farkas.x[r]))
+                           for r in np.flatnonzero(farkas.x > 1.0e-9)]
+        return LearnedWeights(None, False, certificate)
+
+    # Some negative node has several subnodes: z_r = 1 selects row r
+    # as ill-formed, x.w <= -margin + big_m (1 - z_r)
+    neg_rows = np.flatnonzero(is_neg)
+    Z = len(neg_rows)
+    big_m = margin + max_weight * np.asarray(abs(A).sum(axis=1)).ravel()
+    select = sparse.csr_matrix(
+        (np.ones(Z), (neg_rows, np.arange(Z))), shape=(R, Z))
+    A_z = sparse.hstack([A_ub, sparse.diags(big_m) @ select])
+    b_z = np.where(is_neg, big_m - margin, 0.0)
+    # Each negative node selects at least one of its rows
+    (node_ids, group) = np.unique(mm.node[neg_rows], return_inverse=True)
+    cover = sparse.csr_matrix(
+        (np.ones(Z), (group.ravel(), C + np.arange(Z))),
+        shape=(len(node_ids), C + Z))
+    result = _solve(milp,
+                    np.concatenate([np.ones(C), np.zeros(Z)]),
+                    constraints=[
+                        LinearConstraint(A_z, -np.inf, b_z),
+                        LinearConstraint(cover, 1, np.inf)
+                    ],
+                    integrality=np.concatenate([np.zeros(C), np.ones(Z)]),
+                    bounds=Bounds(np.zeros(C + Z),
+                                  np.concatenate([np.full(C, max_weight),
+                                                  np.ones(Z)])))
+    if result.status == 0:
+        return _verified(mm, n_pos, result.x[:C])
+    return LearnedWeights(None, False if result.status == 2 else None, None)
+
+
+def _solve(solver, c, **kwargs):
+    """
+    Call scipy linprog or milp, retrying without presolve if HiGHS
+    reports a solver error (status 4), which its presolve can raise
+    on feasible big-M problems.
+    """
+    result = solver(c, **kwargs)
+    if result.status == 4:
+        result = solver(c, options={'presolve': False}, **kwargs)
+    return result
+
+
+def _learn_perceptron(mm, n_pos, margin, max_iter, rate):
+    C = len(mm.con)
+    row = _rows(mm)
+    val = mm.val.astype(np.float64)
+    is_neg = (mm.node >= n_pos)
+    pos_rows = np.flatnonzero(~is_neg)
+    neg_rows = np.flatnonzero(is_neg)
+    # Negative rows grouped by node
+    starts = np.flatnonzero(np.diff(mm.node[neg_rows], prepend=-1))
+    w = np.zeros(C)
+    for _ in range(max_iter):
+        score = np.bincount(row, weights=w[mm.col] * val,
+                            minlength=mm.num_rows())
+        # Positive rows with negative score
+        coef = np.zeros(mm.num_rows())
+        coef[pos_rows[score[pos_rows] < 0.0]] = -1.0
+        # Negative nodes whose lowest-scoring row is above -margin
+        if len(neg_rows) > 0:
+            neg_score = score[neg_rows]
+            low = np.minimum.reduceat(neg_score, starts)
+            argmin = neg_rows[starts + _argmin_reduceat(neg_score, starts)]
+            coef[argmin[low > -margin]] = 1.0
+        if not coef.any():
+            return _verified(mm, n_pos, w)
+        grad = np.bincount(mm.col, weights=coef[row] * val, minlength=C)
+        w = np.maximum(w - rate * grad, 0.0)
+    return LearnedWeights(dict(zip(mm.con, w.tolist())), None, None)
+
+
+def _argmin_reduceat(x, starts):
+    """
+    Offset of the minimum of each segment x[starts[i]:starts[i+1]].
+    """
+    seg = np.repeat(np.arange(len(starts)),
+                    np.diff(np.append(starts, len(x))))
+    order = np.lexsort((x, seg))
+    first = np.flatnonzero(np.diff(seg[order], prepend=-1))
+    return order[first] - starts
+
+
+# Stratified ranking (list of strata, highest first, each a list of
+# constraint names), consistency, and ERCs left unresolved: list of
+# (sign, node, subnode) for the rows of good (+) or bad (-) markup
+# that no ranking consistent with the strata can satisfy
+Stratification = namedtuple('Stratification',
+                            ['strata', 'consistent', 'unresolved'])
+
+
+def _bitsets(mm, sign):
+    """
+    Packed bitsets (rows x bytes) of the constraints that assign
+    marks of the given sign to each row of mm.
+    """
+    C = len(mm.con)
+    bits = np.zeros((mm.num_rows(), max(1, -(-C // 8))), dtype=np.uint8)
+    keep = (np.sign(mm.val) == sign)
+    col = mm.col[keep].astype(np.int64)
+    np.bitwise_or.at(bits, (_rows(mm)[keep], col // 8),
+                     np.left_shift(1, 7 - col % 8).astype(np.uint8))
+    return bits
+
+
+def learn_ranking(good, bad=None, low=(), biased=False):
+    """
+    Recursive Constraint Demotion for OTStat. Every marked subnode
+    of markup good must be well-formed (its highest-ranked mark is
+    positive) and every marked subnode of markup bad ill-formed
+    (its highest-ranked mark is negative). Each such row is an ERC
+    whose winner-preferring constraints W must contain one that
+    dominates all of its loser-preferring constraints L.
+
+    Bad nodes are held to more than in Stat and learn_weights, where
+    some ill-formed subnode suffices: RCD cannot choose among
+    subnodes, so all of them must be ill-formed, unless one has only
+    negative marks (ill-formed under any ranking). A consistent
+    result is always correct for Stat, but data with multi-subnode
+    bad nodes may be reported inconsistent although some ranking
+    classifies it.
+
+    Strata are built top-down, each holding the constraints that
+    prefer no loser in the unresolved ERCs. With biased=True
+    (Biased Constraint Demotion) constraints in low, such as
+    faithfulness or licensing constraints, are held back while any
+    other constraint can be placed, and then placed one at a time,
+    choosing the one that resolves the most ERCs.
+
+    ERCs are deduplicated and stored as packed bitsets, so each
+    stratum costs a few vectorized bitwise reductions.
+    """
+    markups = [(+1, _compile(good))]
+    if bad is not None:
+        markups.append((-1, _compile(bad)))
+    mm = MarkMatrix.concat([x for (_, x) in markups])
+    con = mm.con
+    C = len(con)
+    # W and L bitsets of every row; bad rows swap roles
+    sign = np.concatenate([np.full(x.num_rows(), s) \
+        for (s, x) in markups]).astype(np.int64)
+    pos, neg = _bitsets(mm, +1), _bitsets(mm, -1)
+    is_good = (sign > 0)[:, np.newaxis]
+    W = np.where(is_good, pos, neg)
+    L = np.where(is_good, neg, pos)
+    # Rows without loser-preferring constraints are satisfied
+    # by every ranking; such a bad row also settles its node
+    keep = L.any(axis=1)
+    is_bad = (sign < 0)
+    keep &= ~(is_bad & np.isin(mm.node, mm.node[is_bad & ~keep]))
+    ercs, erc_inv = np.unique(np.hstack([W[keep], L[keep]]),
+                              axis=0,
+                              return_inverse=True)
+    n_bytes = W.shape[1]
+    W, L = ercs[:, :n_bytes], ercs[:, n_bytes:]
+    unpack = lambda x: np.unpackbits(x, count=C).astype(bool)
+
+    low = np.isin(con, list(low))
+    unranked = np.ones(C, dtype=bool)
+    active = np.ones(len(ercs), dtype=bool)
+    strata = []
+    while unranked.any():
+        L_any = unpack(np.bitwise_or.reduce(L[active], axis=0))
+        placeable = unranked & ~L_any
+        if not placeable.any():
+            break
+        if biased and (placeable & ~low).any():
+            placeable &= ~low
+        elif biased and active.any():
+            # Place the low constraint that resolves the most ERCs
+            frees = np.unpackbits(W[active], axis=1, count=C) \
+                .sum(axis=0, dtype=np.int64)
+            frees = np.where(placeable, frees, -1)
+            if frees.max() > 0:
+                placeable = (np.arange(C) == np.argmax(frees))
+        strata.append([con[k] for k in np.flatnonzero(placeable)])
+        unranked &= ~placeable
+        resolved = (W[active] & np.packbits(placeable)).any(axis=1)
+        active[np.flatnonzero(active)[resolved]] = False
+    consistent = not active.any()
+    if unranked.any():
+        strata.append([con[k] for k in np.flatnonzero(unranked)])
+
+    unresolved = []
+    if not consistent:
+        rows = np.flatnonzero(keep)[active[erc_inv.ravel()]]
+        n_good = markups[0][1].num_nodes()
+        for r in rows:
+            i = int(mm.node[r])
+            unresolved.append(('+', i, mm.subnodes[mm.subnode[r]]) \
+                if i < n_good else \
+                ('-', i - n_good, mm.subnodes[mm.subnode[r]]))
+    return Stratification(strata, consistent, unresolved)
+
+
+def stratified_ranks(strata):
+    """
+    Ranks dict for OTStat from a stratified ranking (highest stratum
+    first), refining each stratum in the order listed. Any refinement
+    of a consistent RCD stratification is consistent.
+    """
+    constraints = [c for stratum in strata for c in stratum]
+    return {c: len(constraints) - k for (k, c) in enumerate(constraints)}
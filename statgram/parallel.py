@@ -0,0 +1,129 @@
+import multiprocessing, os, time
+from collections import namedtuple
+
+from statgram import harmony
+from statgram.harmony import Mark, MarkedNode, MarkMatrix, Eval1, \
+    Profile, instrumented, _MarkMatrixBuilder
+
+# Throughput of one worker process over the chunks it evaluated
+WorkerStats = namedtuple('WorkerStats',
+                         ['pid', 'chunks', 'nodes', 'seconds', 'rate'])
+
+# Nodes, constraints, ignore function and output format
+# of the current worker process
+_M, _Con, _ignore_func, _matrix = None, None, None, False
+
+
+def _init_worker(M, Con, ignore_func, matrix, profiling):
+    global _M, _Con, _ignore_func, _matrix
+    _M, _Con, _ignore_func, _matrix = M, Con, ignore_func, matrix
+    harmony._profile = Profile() if profiling else None
+
+
+def _eval_chunk(chunk):
+    """
+    Evaluate nodes start:stop of M in a worker. Returns the indices 
+    and marks of unignored nodes, or a MarkMatrix whose nodes are 
+    indices into M. Marks go back as plain tuples, which pickle 
+    much faster than Mark namedtuples. If profiling, also returns 
+    the constraint records of the chunk (else None).
+    """
+    (start, stop) = chunk
+    t0 = time.perf_counter()
+    if harmony._profile is not None:
+        harmony._profile = Profile()
+    ignore = (_ignore_func is not None)
+    if _matrix:
+        Con = instrumented(_Con)
+        builder = _MarkMatrixBuilder()
+        for i in range(start, stop):
+            node = _M[i]
+            if ignore and _ignore_func(node):
+                continue
+            builder.add(i, [constraint(node) for constraint in Con])
+        marks = builder.build()
+    else:
+        marks = []
+        for i in range(start, stop):
+            node = _M[i]
+            if ignore and _ignore_func(node):
+                continue
+            marks.append((i, [tuple(x) for marks1 in \
+                Eval1(node, _Con).values() for x in marks1]))
+    seconds = time.perf_counter() - t0
+    records = harmony._profile.constraints \
+        if harmony._profile is not None else None
+    return (os.getpid(), stop - start, seconds, marks, records)
+
+
+def _marks(marks):
+    """
+    Mapping from subnodes to sets of marks (as in Eval1).
+    """
+    marks1 = dict()
+    for mark in marks:
+        mark = Mark._make(mark)
+        if not mark.subnode in marks1:
+            marks1[mark.subnode] = set()
+        marks1[mark.subnode].add(mark)
+    return marks1
+
+
+def ParallelEval(M,
+                 Con,
+                 ignore_func=None,
+                 processes=None,
+                 chunksize=None,
+                 matrix=False):
+    """
+    Evaluate each node of structure M with constraints in Con, 
+    sharding the nodes over a pool of worker processes. 
+    Returns the same markup as Eval(M, Con, ignore_func) 
+    (or EvalMatrix if matrix is true), along with per-worker 
+    throughput statistics. Nodes, Con and ignore_func are 
+    inherited by forked workers and pickled otherwise; 
+    only marks are sent back. Within profile(), constraint 
+    calls made by the workers are added to the active profile.
+    """
+    M = list(M)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, -(-len(M) // (4 * processes)))
+    chunks = [(i, min(i + chunksize, len(M))) \
+        for i in range(0, len(M), chunksize)]
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+    markup = []
+    stats = {}
+    profile = harmony._profile
+    with context.Pool(processes, _init_worker,
+                      (M, Con, ignore_func, matrix,
+                       profile is not None)) as pool:
+        # imap returns chunks in submission order, so markup
+        # follows the order of M regardless of scheduling
+        for (pid, n, seconds, marks, records) in \
+                pool.imap(_eval_chunk, chunks):
+            if profile is not None:
+                profile.add(records)
+            if matrix:
+                markup.append(marks)
+            else:
+                markup += [MarkedNode(M[i], _marks(marks1)) \
+                    for (i, marks1) in marks]
+            (chunks1, nodes1, seconds1) = stats.get(pid, (0, 0, 0.0))
+            stats[pid] = (chunks1 + 1, nodes1 + n, seconds1 + seconds)
+
+    if matrix:
+        markup = MarkMatrix.concat(markup)
+        markup.nodes = [M[i] for i in markup.nodes]
+
+    stats = [
+        WorkerStats(pid, chunks1, nodes1, seconds1,
+                    nodes1 / seconds1 if seconds1 > 0.0 else float('inf'))
+        for (pid, (chunks1, nodes1, seconds1)) in sorted(stats.items())
+    ]
+    return (markup, stats)
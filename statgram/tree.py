@@ -0,0 +1,504 @@
+from array import array
+
+from statgram.harmony import MarkedNode, Eval1
+
+
+class Labels():
+    """
+    Table interning tree labels (and leaves) as consecutive ids.
+    Trees built with the same table have comparable label ids.
+    """
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.ids = {}
+        for x in labels:
+            self(x)
+
+    def __call__(self, x):
+        i = self.ids.get(x)
+        if i is None:
+            i = self.ids[x] = len(self.labels)
+            self.labels.append(x)
+        return i
+
+    def __len__(self):
+        return len(self.labels)
+
+
+# Label table shared by trees built without one
+default_labels = Labels()
+
+
+class ArrayTree():
+    """
+    Tree stored as flat arrays over its nodes (internal nodes and
+    leaves) in preorder, with node 0 the root: interned label id,
+    parent, first and last child, next and previous sibling, index
+    among siblings, number of children and depth, with -1 for none.
+    Label strings are also kept per node (as references to the
+    interned labels) for fast label() calls. Positional indexes for
+    alignment-style constraints (sibling counts and gaps by label,
+    leaf spans) are built on first use and cached with the tree.
+    Constraints see nodes through NodeRef, which mirrors the parts of
+    the nltk ParentedTree API used by constraints. subtrees(), and
+    iteration over the tree itself (e.g. Eval(tree, Con)), visit the
+    internal nodes by index.
+    """
+
+    def __init__(self, labels=None):
+        self.labels = labels if labels is not None else default_labels
+        self.names = self.labels.labels
+        self.label = array('i')
+        self.label_str = []
+        self.parent = array('i')
+        self.first_child = array('i')
+        self.last_child = array('i')
+        self.next_sibling = array('i')
+        self.prev_sibling = array('i')
+        self.index = array('i')
+        self.num_children = array('i')
+        self.depth = array('i')
+        self.leaf = bytearray()
+        self.siblings = {}  # label ids -> _SiblingIndex
+        self.spans = None  # (leaf_start, leaf_end, leaf labels)
+
+    @classmethod
+    def build(cls, root, expand, labels=None):
+        """
+        Tree from any nested structure; expand(x) returns the label
+        and children of internal node x, or None if x is a leaf
+        (whose label is x itself).
+        """
+        tree = cls(labels)
+        intern = tree.labels
+        (label, label_str, parent, first_child, last_child, next_sibling,
+         prev_sibling, index, num_children, depth, leaf) = \
+            (tree.label, tree.label_str, tree.parent, tree.first_child,
+             tree.last_child, tree.next_sibling, tree.prev_sibling,
+             tree.index, tree.num_children, tree.depth, tree.leaf)
+        names = intern.labels
+        stack = [(root, -1, 0, -1)]
+        while stack:
+            (x, p, k, d) = stack.pop()
+            i = len(label)
+            node = expand(x)
+            if node is None:
+                (x_label, children) = (x, ())
+            else:
+                (x_label, children) = node
+            x_id = intern(x_label)
+            label.append(x_id)
+            label_str.append(names[x_id])
+            parent.append(p)
+            first_child.append(-1)
+            last_child.append(-1)
+            next_sibling.append(-1)
+            prev_sibling.append(-1)
+            index.append(k)
+            num_children.append(len(children))
+            depth.append(d + 1)
+            leaf.append(node is None)
+            if p >= 0:
+                if k == 0:
+                    first_child[p] = i
+                else:
+                    prev = last_child[p]
+                    next_sibling[prev] = i
+                    prev_sibling[i] = prev
+                last_child[p] = i
+            for j in range(len(children) - 1, -1, -1):
+                stack.append((children[j], i, j, d + 1))
+        return tree
+
+    @classmethod
+    def from_nltk(cls, tree, labels=None):
+        """
+        Tree from an nltk Tree (or ParentedTree).
+        """
+        from nltk.tree import Tree
+        return cls.build(tree, lambda x: (x.label(), x) \
+            if isinstance(x, Tree) else None, labels)
+
+    def to_nltk(self, i=0):
+        """
+        Subtree rooted at node i as an nltk ParentedTree.
+        """
+        from nltk.tree import ParentedTree, Tree
+
+        def convert(i):
+            if self.leaf[i]:
+                return self.names[self.label[i]]
+            children = []
+            j = self.first_child[i]
+            while j >= 0:
+                children.append(convert(j))
+                j = self.next_sibling[j]
+            return Tree(self.names[self.label[i]], children)
+
+        return ParentedTree.convert(convert(i))
+
+    def __len__(self):
+        """
+        Number of nodes, including leaves.
+        """
+        return len(self.label)
+
+    def __getitem__(self, i):
+        return NodeRef(self, i)
+
+    def __iter__(self):
+        leaf = self.leaf
+        for i in range(len(leaf)):
+            if not leaf[i]:
+                yield NodeRef(self, i)
+
+    def root(self):
+        return NodeRef(self, 0)
+
+    def subtrees(self):
+        """
+        Internal nodes in preorder (as nltk Tree.subtrees()).
+        """
+        leaf = self.leaf
+        return [NodeRef(self, i) for i in range(len(leaf)) if not leaf[i]]
+
+    def leaves(self):
+        return [self.names[self.label[i]] \
+            for i in range(len(self.leaf)) if self.leaf[i]]
+
+    def pos(self):
+        """
+        List of (leaf, preterminal label) pairs (as nltk Tree.pos()).
+        """
+        (names, label, parent) = (self.names, self.label, self.parent)
+        return [(names[label[i]], names[label[parent[i]]]) \
+            for i in range(len(self.leaf)) if self.leaf[i]]
+
+    def local_keys(self):
+        """
+        List of (index, key) for each internal node, where key holds
+        the label ids of the node, its parent, its immediate siblings
+        and its children (-1 for none).
+        """
+        (label, parent, prev_sibling, next_sibling, first_child, leaf) = \
+            (self.label, self.parent, self.prev_sibling, self.next_sibling,
+             self.first_child, self.leaf)
+        get = lambda j: label[j] if j >= 0 else -1
+        keys = []
+        for i in range(len(leaf)):
+            if leaf[i]:
+                continue
+            children = []
+            j = first_child[i]
+            while j >= 0:
+                children.append(label[j])
+                j = next_sibling[j]
+            keys.append((i, (label[i], get(parent[i]), get(prev_sibling[i]),
+                             get(next_sibling[i]), tuple(children))))
+        return keys
+
+    def label_ids(self, labels):
+        """
+        Frozenset of the interned ids of a label or a tuple or
+        frozenset of labels (labels never interned are ignored).
+        """
+        if not isinstance(labels, (tuple, frozenset)):
+            labels = (labels, )
+        ids = self.labels.ids
+        return frozenset(ids[x] for x in labels if x in ids)
+
+    def sibling_index(self, labels):
+        """
+        _SiblingIndex of the nodes labeled with labels (a label or
+        a tuple or frozenset of labels) among their siblings, built
+        in two passes over the tree and cached.
+        """
+        index = self.siblings.get(labels)
+        if index is None:
+            key = self.label_ids(labels)
+            for index in self.siblings.values():
+                if index.key == key:
+                    break
+            else:
+                index = _SiblingIndex(self, key)
+            self.siblings[labels] = index
+        return index
+
+    def leaf_spans(self):
+        """
+        Arrays of the first leaf offset and one past the last leaf
+        offset of each node, and the list of leaf labels, built in
+        one pass and cached.
+        """
+        if self.spans is None:
+            (leaf, parent) = (self.leaf, self.parent)
+            N = len(leaf)
+            start = array('i', [0]) * N
+            end = array('i', [0]) * N
+            offset = 0
+            for i in range(N):
+                start[i] = offset
+                if leaf[i]:
+                    offset += 1
+                    end[i] = offset
+            # Ends propagate up: a node ends where its last leaf does
+            for i in range(N - 1, -1, -1):
+                if not leaf[i]:
+                    j = self.last_child[i]
+                    end[i] = end[j] if j >= 0 else start[i]
+            self.spans = (start, end, self.leaves())
+        return self.spans
+
+    def label_id(self, x):
+        """
+        Interned id of label x, or None if no node has it.
+        """
+        return self.labels.ids.get(x)
+
+    def __str__(self):
+        return str(self.to_nltk())
+
+    def __repr__(self):
+        return f'ArrayTree({self})'
+
+    def pretty_print(self, **kwargs):
+        self.to_nltk().pretty_print(**kwargs)
+
+
+class _SiblingIndex():
+    """
+    For the nodes with label ids in key: the number of earlier and
+    later siblings with those labels (before and after), and the
+    sibling positions of the nearest earlier and later such siblings
+    (prev and next; -1 and the number of siblings if there are none).
+    """
+
+    def __init__(self, tree, key):
+        (label, parent, index, num_children) = \
+            (tree.label, tree.parent, tree.index, tree.num_children)
+        N = len(label)
+        self.key = key
+        self.before = before = array('i', [0]) * N
+        self.after = after = array('i', [0]) * N
+        self.prev = prev = array('i', [-1]) * N
+        self.next = next_ = array('i', [0]) * N
+        (count, last) = (array('i', [0]) * N, array('i', [-1]) * N)
+        # Preorder visits siblings left to right
+        for i in range(N):
+            p = parent[i]
+            if p < 0:
+                continue
+            (before[i], prev[i]) = (count[p], last[p])
+            if label[i] in key:
+                (count[p], last[p]) = (count[p] + 1, index[i])
+        # Reverse preorder visits siblings right to left
+        (count, last) = (array('i', [0]) * N, array('i', num_children))
+        for i in range(N - 1, -1, -1):
+            p = parent[i]
+            if p < 0:
+                continue
+            (after[i], next_[i]) = (count[p], last[p])
+            if label[i] in key:
+                (count[p], last[p]) = (count[p] + 1, index[i])
+
+
+class NodeRef():
+    """
+    Internal node or leaf i of an ArrayTree, with the accessors of
+    nltk ParentedTree: label(), parent(), left_sibling(),
+    right_sibling(), len() and indexing of children (leaves are
+    returned as their labels, as in nltk).
+    """
+    __slots__ = ('tree', 'i')
+
+    def __init__(self, tree, i):
+        self.tree = tree
+        self.i = i
+
+    def _node(self, j):
+        tree = self.tree
+        if j < 0:
+            return None
+        if tree.leaf[j]:
+            return tree.label_str[j]
+        return NodeRef(tree, j)
+
+    def label(self):
+        return self.tree.label_str[self.i]
+
+    def label_id(self):
+        return self.tree.label[self.i]
+
+    def parent(self):
+        j = self.tree.parent[self.i]
+        return NodeRef(self.tree, j) if j >= 0 else None
+
+    def left_sibling(self):
+        return self._node(self.tree.prev_sibling[self.i])
+
+    def right_sibling(self):
+        return self._node(self.tree.next_sibling[self.i])
+
+    def parent_index(self):
+        return self.tree.index[self.i] if self.tree.parent[self.i] >= 0 \
+            else None
+
+    def depth(self):
+        return self.tree.depth[self.i]
+
+    def __len__(self):
+        return self.tree.num_children[self.i]
+
+    def siblings_before(self):
+        """
+        Number of left siblings (distance to the left edge).
+        """
+        return self.tree.index[self.i] if self.tree.parent[self.i] >= 0 \
+            else 0
+
+    def siblings_after(self):
+        """
+        Number of right siblings (distance to the right edge).
+        """
+        (tree, i) = (self.tree, self.i)
+        p = tree.parent[i]
+        return (tree.num_children[p] - 1 - tree.index[i]) if p >= 0 else 0
+
+    def count_before(self, labels):
+        """
+        Number of left siblings labeled with labels (a label or a
+        tuple or frozenset of labels), in O(1) once the tree's index
+        for labels is built.
+        """
+        return self.tree.sibling_index(labels).before[self.i]
+
+    def count_after(self, labels):
+        """
+        Number of right siblings labeled with labels.
+        """
+        return self.tree.sibling_index(labels).after[self.i]
+
+    def gap_before(self, labels):
+        """
+        Number of siblings between this node and the nearest left
+        sibling labeled with labels, or the left edge if none.
+        """
+        (tree, i) = (self.tree, self.i)
+        if tree.parent[i] < 0:
+            return 0
+        return tree.index[i] - tree.sibling_index(labels).prev[i] - 1
+
+    def gap_after(self, labels):
+        """
+        Number of siblings between this node and the nearest right
+        sibling labeled with labels, or the right edge if none.
+        """
+        (tree, i) = (self.tree, self.i)
+        if tree.parent[i] < 0:
+            return 0
+        return tree.sibling_index(labels).next[i] - tree.index[i] - 1
+
+    def leaf_span(self):
+        """
+        Offsets (start, end) of the leaves under this node, e.g. for
+        gradient alignment with the edges of an ancestor.
+        """
+        (start, end, _) = self.tree.leaf_spans()
+        return (start[self.i], end[self.i])
+
+    def __getitem__(self, k):
+        tree = self.tree
+        if not isinstance(k, int):
+            raise TypeError(f'child index must be an int, not {k!r}')
+        if k >= 0:
+            j = tree.first_child[self.i]
+            while k > 0 and j >= 0:
+                (j, k) = (tree.next_sibling[j], k - 1)
+        else:
+            j = tree.last_child[self.i]
+            while k < -1 and j >= 0:
+                (j, k) = (tree.prev_sibling[j], k + 1)
+        if j < 0:
+            raise IndexError('child index out of range')
+        return self._node(j)
+
+    def __iter__(self):
+        tree = self.tree
+        j = tree.first_child[self.i]
+        while j >= 0:
+            yield self._node(j)
+            j = tree.next_sibling[j]
+
+    def subtrees(self):
+        """
+        Internal nodes of the subtree rooted here, in preorder.
+        """
+        (tree, i) = (self.tree, self.i)
+        # Preorder: the subtree spans nodes until depth returns
+        (depth, leaf) = (tree.depth, tree.leaf)
+        j = i + 1
+        while j < len(depth) and depth[j] > depth[i]:
+            j += 1
+        return [NodeRef(tree, k) for k in range(i, j) if not leaf[k]]
+
+    def leaves(self):
+        (start, end, leaves) = self.tree.leaf_spans()
+        return leaves[start[self.i]:end[self.i]]
+
+    def treeposition(self):
+        (tree, i, position) = (self.tree, self.i, [])
+        while tree.parent[i] >= 0:
+            position.append(tree.index[i])
+            i = tree.parent[i]
+        return tuple(reversed(position))
+
+    def __eq__(self, other):
+        return isinstance(other, NodeRef) and self.i == other.i \
+            and self.tree is other.tree
+
+    def __hash__(self):
+        return hash((id(self.tree), self.i))
+
+    def __str__(self):
+        return str(self.tree.to_nltk(self.i))
+
+    def __repr__(self):
+        return f'NodeRef({self.i}, {self.label()!r})'
+
+
+def EvalTrees(trees, Con, local=False, ignore_func=None):
+    """
+    Evaluate every internal node of each ArrayTree in trees with
+    constraints in Con, returning one markup (list of MarkedNodes)
+    per tree. With local=True, constraints are called once per
+    distinct local configuration (see ArrayTree.local_keys) across
+    all trees with the same label table and nodes share its marks;
+    this is only correct if every constraint reads no more than the
+    labels of a node, its parent, its immediate siblings and its
+    children.
+    (Nodes for which ignore_func evaluates to true are not marked.)
+    """
+    markups = []
+    caches = {}  # label table -> local key -> marks
+    ignore = (ignore_func is not None)
+    for tree in trees:
+        markup = []
+        if local:
+            # Label ids are only comparable within one table
+            cache = caches.setdefault(tree.labels, {})
+            for (i, key) in tree.local_keys():
+                node = NodeRef(tree, i)
+                if ignore and ignore_func(node):
+                    continue
+                marks = cache.get(key)
+                if marks is None:
+                    marks = cache[key] = Eval1(node, Con)
+                markup.append(MarkedNode(node, marks))
+        else:
+            for node in tree:
+                if ignore and ignore_func(node):
+                    continue
+                markup.append(MarkedNode(node, Eval1(node, Con)))
+        markups.append(markup)
+    return markups
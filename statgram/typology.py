@@ -0,0 +1,268 @@
+import itertools, multiprocessing, os, re
+from collections import namedtuple, OrderedDict
+import numpy as np
+
+from statgram.harmony import MarkedNode, MarkMatrix, Eval1, HGStat, \
+    OTStat, StatBatch, CompiledOT, weight_matrix
+
+
+def load_patterns(path):
+    """
+    Stress patterns of each language in a file of lines
+    'Language;pattern, pattern, ...' (as in Hayes & Wilson 2008,
+    Appendix C), where each pattern is a string over 1 (primary
+    stress), 2 (secondary stress) and 0 (unstressed) with one digit
+    per syllable. Returns an OrderedDict mapping each language to a
+    dict from number of syllables to the set of its patterns.
+    """
+    languages = OrderedDict()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            (name, patterns) = line.split(';', 1)
+            language = languages.setdefault(name.strip(), {})
+            for pattern in re.split(r'\s*,\s*', patterns.strip()):
+                language.setdefault(len(pattern), set()).add(pattern)
+    return languages
+
+
+def stress_pattern(tree, symbols=None):
+    """
+    Stress pattern of a parse as the string of its preterminal
+    labels mapped through symbols (by default FootGen's s1/s2/s0
+    and GridGen's x/o).
+    """
+    if symbols is None:
+        symbols = {'s1': '1', 's2': '2', 's0': '0', 'x': '1', 'o': '0'}
+    return ''.join(symbols[tag] for (_, tag) in tree.pos())
+
+
+def weight_grid(con, values):
+    """
+    K x |con| matrix of all weightings with each weight in values.
+    """
+    return np.array(list(itertools.product(values, repeat=len(con))),
+                    dtype=np.float64).reshape(-1, len(con))
+
+
+def weight_sample(con, k, low=0.0, high=10.0, seed=None):
+    """
+    K x |con| matrix of k weightings drawn uniformly from [low, high).
+    """
+    rng = np.random.default_rng(seed)
+    return rng.uniform(low, high, size=(k, len(con)))
+
+
+def rankings(con):
+    """
+    |con|! x |con| matrix of the ranks (for OTStat) of all total
+    rankings of con.
+    """
+    C = len(con)
+    return np.array(list(itertools.permutations(range(1, C + 1))),
+                    dtype=np.float64).reshape(-1, C)
+
+
+# Predicted typology: the distinct languages generated by the grammars
+# (each a dict from input length to the frozenset of patterns
+# generated), the number of grammars generating each, the index of
+# the language generated by each grammar, and for each attested
+# language the index of the predicted language identical to it on
+# the evaluated lengths (None if no grammar generates it)
+TypologyReport = namedtuple(
+    'TypologyReport', ['languages', 'counts', 'grammar_language', 'matches'])
+
+# Typology whose grammars are scored by the current worker process
+_typology = None
+
+
+def _init_worker(typology):
+    global _typology
+    _typology = typology
+
+
+def _signature_chunk(W):
+    return _typology.signatures(W)
+
+
+class Typology():
+    """
+    Factorial typology of constraint set Con over the candidates
+    gen(n) (e.g. all parses of n syllables) for each input length
+    n in lengths. A grammar generates the patterns of its well-formed
+    candidates (those without ill-formed nodes under stat_func).
+
+    Candidates are evaluated once per input length, and nodes with
+    identical marks are merged, so each grammar is scored only on the
+    distinct markings of all candidates. Well-formedness of
+    candidates and patterns then follows by two matrix products.
+    """
+
+    def __init__(self,
+                 gen,
+                 Con,
+                 lengths,
+                 stat_func=HGStat,
+                 pattern=stress_pattern):
+        self.gen = gen
+        self.Con = Con
+        self.stat_func = stat_func
+        self.pattern = pattern
+        self.markings = OrderedDict()  # marks -> marking index
+        self.outputs = OrderedDict()  # (length, pattern) -> output index
+        self.cache = {}  # length -> (markings of each candidate, outputs)
+        for n in lengths:
+            self._evaluate(n)
+        self._compile()
+
+    def _evaluate(self, n):
+        """
+        Markings and output of each candidate for input length n
+        (cached).
+        """
+        if n in self.cache:
+            return self.cache[n]
+        (cand_markings, cand_outputs) = ([], [])
+        for tree in self.gen(n):
+            markings = set()
+            for node in tree.subtrees():
+                marks = Eval1(node, self.Con)
+                key = frozenset(
+                    (subnode, frozenset(marks1)) \
+                        for (subnode, marks1) in marks.items())
+                markings.add(
+                    self.markings.setdefault(key, len(self.markings)))
+            output = (n, self.pattern(tree))
+            cand_markings.append(sorted(markings))
+            cand_outputs.append(
+                self.outputs.setdefault(output, len(self.outputs)))
+        self.cache[n] = (cand_markings, cand_outputs)
+        return self.cache[n]
+
+    def _compile(self):
+        markup = [MarkedNode(u, {subnode: set(marks) for \
+            (subnode, marks) in key}) for (u, key) in \
+                enumerate(self.markings)]
+        self.mm = MarkMatrix.from_markup(markup)
+        self.con = self.mm.con
+        self.compiled = CompiledOT(self.mm) \
+            if self.stat_func is OTStat else None
+        # Incidence of markings in candidates and candidates in outputs
+        (U, P) = (len(self.markings), len(self.outputs))
+        cands = [
+            cand for n in sorted(self.cache)
+            for cand in zip(*self.cache[n])
+        ]
+        self.uses = np.zeros((U, len(cands)), dtype=np.float32)
+        self.yields = np.zeros((len(cands), P), dtype=np.float32)
+        for (j, (markings, output)) in enumerate(cands):
+            self.uses[markings, j] = 1.0
+            self.yields[j, output] = 1.0
+
+    def generated(self, W):
+        """
+        K x |outputs| boolean matrix of the outputs generated by each
+        of K grammars; W is a K x |con| weight (or rank) matrix aligned
+        with self.con, or a list of K weights (ranks) dicts.
+        """
+        if not isinstance(W, np.ndarray):
+            W = weight_matrix(self.mm, W)
+        if self.compiled is not None:
+            (_, ill) = self.compiled.stat_batch(W)
+        else:
+            (_, ill) = StatBatch(self.mm, W, self.stat_func)
+        cand_ok = (ill.astype(np.float32) @ self.uses) == 0.0
+        return (cand_ok.astype(np.float32) @ self.yields) > 0.0
+
+    def signatures(self, W):
+        """
+        Outputs generated by each of K grammars, packed into bytes.
+        """
+        return np.packbits(self.generated(W), axis=1)
+
+    def language(self, generated):
+        """
+        Language (dict from input length to frozenset of patterns)
+        from a row of generated().
+        """
+        language = {n: set() for n in self.cache}
+        for ((n, pattern), p) in self.outputs.items():
+            if generated[p]:
+                language[n].add(pattern)
+        return {n: frozenset(x) for (n, x) in language.items()}
+
+    def report(self,
+               W,
+               attested=None,
+               project=None,
+               processes=1,
+               chunksize=4096):
+        """
+        Predicted typology of the K grammars in W (see generated),
+        matched against attested languages (as from load_patterns)
+        restricted to the evaluated lengths; project optionally maps
+        attested patterns onto candidate patterns (e.g. removing the
+        primary/secondary distinction for GridGen). Grammars are
+        scored chunksize at a time over a pool of processes.
+        """
+        if not isinstance(W, np.ndarray):
+            W = weight_matrix(self.mm, W)
+        chunks = [W[k:(k + chunksize)] for k in range(0, len(W), chunksize)]
+        if processes == 1 or len(chunks) <= 1:
+            signatures = [self.signatures(chunk) for chunk in chunks]
+        else:
+            if processes is None:
+                processes = os.cpu_count() or 1
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context()
+            with context.Pool(processes, _init_worker, (self, )) as pool:
+                signatures = pool.map(_signature_chunk, chunks)
+        signatures = np.concatenate(signatures) if signatures else \
+            np.zeros((0, -(-len(self.outputs) // 8)), dtype=np.uint8)
+        (distinct, grammar_language, counts) = np.unique(
+            signatures, axis=0, return_inverse=True, return_counts=True)
+        P = len(self.outputs)
+        languages = [
+            self.language(np.unpackbits(x, count=P).astype(bool))
+            for x in distinct
+        ]
+
+        matches = OrderedDict()
+        index = {tuple(sorted(x.items())): i \
+            for (i, x) in enumerate(languages)}
+        for (name, language) in (attested or {}).items():
+            target = {
+                n: frozenset(project(x) if project else x \
+                    for x in language.get(n, ()))
+                for n in self.cache
+            }
+            matches[name] = index.get(tuple(sorted(target.items())))
+        return TypologyReport(languages, counts.tolist(),
+                              grammar_language.ravel(), matches)
+
+
+def format_report(report):
+    """
+    Text summary of a TypologyReport: attested languages with the
+    number of grammars generating them, then unattested predicted
+    languages.
+    """
+    lines = []
+    matched = set()
+    for (name, i) in report.matches.items():
+        if i is None:
+            lines.append(f'{name}: not generated')
+        else:
+            matched.add(i)
+            lines.append(f'{name}: {report.counts[i]} grammars')
+    for (i, language) in enumerate(report.languages):
+        if i in matched:
+            continue
+        patterns = ', '.join(
+            '/'.join(sorted(language[n])) or '-' for n in sorted(language))
+        lines.append(f'unattested ({report.counts[i]} grammars): {patterns}')
+    return '\n'.join(lines)
@@ -0,0 +1,213 @@
+"""
+Grammars and constraints shared by the tests: nasal spreading,
+FootGen and GridGen from the demos, and gradient foot alignment.
+"""
+from statgram.harmony import Mark
+from statgram.forest import Forest
+
+bos, eos = '⋊', '⋉'
+
+# # # # # # # # # #
+# Nasal spreading (demo/nasal_spreading)
+# Symbols are segment + head (1/0) + span bracket, e.g. 'N1(';
+# alphabets are scaled by appending a copy index, which the
+# constraints do not read.
+
+
+def nasal_sigma(copies=1):
+    """
+    Alphabet of 50 x copies symbols.
+    """
+    return [s + h + b + (str(k) if copies > 1 else '') \
+        for s in 'TSNGV' for h in '10' for b in '(+)|-' \
+            for k in range(copies)]
+
+
+def NasN(t):
+    v = 0
+    if t.x[0] == 'N':
+        v = +1 if t.x[1] == '1' else -1
+    return Mark('NasN', v, subnode='nasal')
+
+
+def NoNasObs(t):
+    v = 0
+    if t.x[0] in 'TS':
+        v = +1 if t.x[2] == '-' else -1
+    return Mark('NoNasObs', v, subnode='nasal')
+
+
+def NoNasVoc(t):
+    v = 0
+    if t.x[0] in 'GV':
+        v = +1 if t.x[2] == '-' else -1
+    return Mark('NoNasVoc', v, subnode='nasal')
+
+
+def SpreadNasR(t):
+    v = 0
+    if t.prec[2:3] in (')', '|'):
+        v = -1
+    elif t.prec[2:3] in ('(', '+') and t.x[1:3] in ('0+', '0)'):
+        v = +1
+    return Mark('SpreadNasR', v, subnode='nasal')
+
+
+def SyllStrucR(t):
+    v = 0
+    if t.prec[0] in 'TSNG' and t.x[0] in 'TSNG':
+        v = -1
+    elif t.prec[0] == 'V' and t.x[0] == 'V':
+        v = -1
+    return Mark('SyllStrucR', v)
+
+
+nasal_Con = [NasN, NoNasObs, NoNasVoc, SpreadNasR, SyllStrucR]
+nasal_ignore = lambda t: t.x in (bos, eos)
+
+# # # # # # # # # #
+# FootGen (demo/stress/foot_grammars.py) with unbounded words
+foot_grammar = """
+Constituent = Ft | Syll
+PrWd -> Constituent* MainFt Constituent*
+MainFt -> MainStressSyll Syll? | Syll MainStressSyll
+Ft -> StressSyll Syll? | Syll StressSyll
+MainStressSyll -> s1
+StressSyll -> s2
+Syll -> s0
+s0 | s1 | s2 -> "σ"
+"""
+
+is_foot = lambda s: 'Ft' in s.label()
+
+
+def Iambic(s):
+    v = 0
+    if is_foot(s) and len(s) > 1:
+        v = +1 if 'StressSyll' in s[1].label() else -1
+    return Mark('Iambic', v, subnode='lower')
+
+
+def Trochaic(s):
+    v = 0
+    if is_foot(s) and len(s) > 1:
+        v = +1 if 'StressSyll' in s[0].label() else -1
+    return Mark('Trochaic', v, subnode='lower')
+
+
+def ParseSyll(s):
+    v = -1 if s.label() == 'Syll' else 0
+    return Mark('ParseSyll', v)
+
+
+def FootBinarity(s):
+    v = 0
+    if is_foot(s):
+        v = +1 if len(s) == 2 else -1
+    return Mark('FootBinarity', v, subnode='lower')
+
+
+def AllFeetLeft(s):
+    v = 0
+    if is_foot(s) and s.left_sibling() is not None \
+        and s.left_sibling().label() == 'Syll':
+        v = -1
+    return Mark('AllFeetLeft', v, subnode='upper')
+
+
+def AllFeetRight(s):
+    v = 0
+    if is_foot(s) and s.right_sibling() is not None \
+        and s.right_sibling().label() == 'Syll':
+        v = -1
+    return Mark('AllFeetRight', v, subnode='upper')
+
+
+foot_Con = [
+    Iambic, Trochaic, ParseSyll, FootBinarity, AllFeetLeft, AllFeetRight
+]
+
+# # # # # # # # # #
+# GridGen (demo/stress/grid_grammars.py) with unbounded words
+grid_grammar = """
+PrWd -> (x | o)* x (x | o)*
+x | o -> "σ"
+"""
+
+
+def AlternateR(t):
+    v = 0
+    s = t.left_sibling()
+    if s is not None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == s.label() else +1
+    return Mark('AlternateR', v)
+
+
+def AlternateL(t):
+    v = 0
+    s = t.right_sibling()
+    if s is not None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == s.label() else +1
+    return Mark('AlternateL', v)
+
+
+def StressInitial(t):
+    v = 0
+    if t.left_sibling() is None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == 'o' else +1
+    return Mark('StressInitial', v)
+
+
+def StressFinal(t):
+    v = 0
+    if t.right_sibling() is None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == 'o' else +1
+    return Mark('StressFinal', v)
+
+
+def NonFinality(t):
+    v = 0
+    if t.right_sibling() is None and t.label() in ('x', 'o'):
+        v = -1 if t.label() == 'x' else +1
+    return Mark('NonFinality', v)
+
+
+grid_Con = [AlternateR, AlternateL, StressInitial, StressFinal, NonFinality]
+
+
+def parses(grammar, n):
+    """
+    All parses of n syllables under grammar, as nltk ParentedTrees.
+    """
+    return list(Forest(grammar, ['σ'] * n).parses([], {}))
+
+
+# # # # # # # # # #
+# Gradient alignment over footed words
+def AlignFeetLeft(s):
+    # Gradient: one mark per syllable between a foot and the left
+    # edge of PrWd, walking left siblings (quadratic in the word)
+    v = 0
+    if is_foot(s):
+        t = s.left_sibling()
+        while t is not None:
+            v -= len(t.leaves())
+            t = t.left_sibling()
+    return Mark('AlignFeetLeft', v)
+
+
+def AlignFeetLeftIndexed(s):
+    # As AlignFeetLeft, from the leaf spans of an ArrayTree
+    v = 0
+    if is_foot(s):
+        v = s.parent().leaf_span()[0] - s.leaf_span()[0]
+    return Mark('AlignFeetLeft', v)
+
+
+def footed_word(n):
+    """
+    PrWd of n constituents, two feet after every unfooted syllable.
+    """
+    return '(PrWd ' + ' '.join('(Syll (s0 σ))' if k % 3 == 0 else \
+        '(Ft (StressSyll (s2 σ)) (Syll (s0 σ)))' for k in range(n)) + ')'
+
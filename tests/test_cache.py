@@ -0,0 +1,110 @@
+import inspect, re
+
+import numpy as np
+from nltk.tree import Tree
+
+from statgram import cache
+from statgram.cache import DiskCache, fingerprint
+from statgram.harmony import Mark
+from statgram.tree import ArrayTree, EvalTrees
+
+from test_fst import ab_machine, NoAB
+
+# Module-level data read by constraints
+legal_parent = {'NP': {'S'}, 'VP': {'S'}}
+head = re.compile('^(N|V)$')
+
+
+def Parent(t):
+    parent = t.parent()
+    legal = parent is None or parent.label() in legal_parent.get(
+        t.label(), {parent.label()})
+    return Mark('Parent', 0 if legal else -1)
+
+
+def Head(t):
+    return Mark('Head', 0 if any(
+        isinstance(x, str) or head.match(x.label()) for x in t) else -1)
+
+
+def test_key_tracks_global_data():
+    global head
+    key = fingerprint(Parent, Head)
+    legal_parent['NP'].add('VP')
+    try:
+        assert fingerprint(Parent, Head) != key
+    finally:
+        legal_parent['NP'].discard('VP')
+    assert fingerprint(Parent, Head) == key
+    (old, head) = (head, re.compile('^N$'))
+    try:
+        assert fingerprint(Parent, Head) != key
+    finally:
+        head = old
+    assert fingerprint(Parent, Head) == key
+
+
+def test_eval_arcs_round_trip(tmp_path):
+    M = ab_machine()
+    cache = DiskCache(tmp_path)
+    (mm, inv) = cache.eval_arcs(cache.machine('ab', ab_machine), [NoAB])
+    M2 = DiskCache(tmp_path).machine('ab', ab_machine)
+    assert isinstance(M2.src, np.memmap)
+    for field in ('src', 'ilabel', 'olabel', 'dest'):
+        assert np.array_equal(getattr(M2, field), getattr(M, field))
+    cache2 = DiskCache(tmp_path)
+    (mm2, inv2) = cache2.eval_arcs(M2, [NoAB])
+    assert cache2.hits == 1
+    assert np.array_equal(inv2, inv)
+    assert list(mm2.nodes) == list(mm.nodes)
+    assert [node.marks for node in mm2] == [node.marks for node in mm]
+
+
+def test_eval_trees_round_trip(tmp_path):
+    parses = [
+        Tree.fromstring('(S (NP (N a)) (VP (V b) (NP (N c))))'),
+        Tree.fromstring('(S (VP (NP (N a)) (V b)))'),
+    ]
+    build = lambda: [ArrayTree.from_nltk(t) for t in parses]
+    trees = DiskCache(tmp_path).trees('parses', build)
+    expected = EvalTrees(trees, [Parent, Head])
+    DiskCache(tmp_path).eval_trees(trees, [Parent, Head])
+    cache = DiskCache(tmp_path)
+    trees2 = cache.trees('parses', build)
+    markups = cache.eval_trees(trees2, [Parent, Head])
+    assert cache.hits == 2
+    assert [str(t.to_nltk()) for t in trees2] == [str(t) for t in parses]
+    for (markup, ref) in zip(markups, expected):
+        assert [node.n.i for node in markup] == [node.n.i for node in ref]
+        assert [{s: set(marks) for (s, marks) in node.marks.items()}
+                for node in markup] == [node.marks for node in ref]
+
+
+def test_key_reads_source_once(monkeypatch):
+    calls = []
+    getsource = inspect.getsource
+    monkeypatch.setattr(inspect, 'getsource',
+                        lambda x: calls.append(x) or getsource(x))
+
+    def Local(t):
+        return Mark('Local', 0 if t.label() in legal_parent else -1)
+
+    key = DiskCache().key('eval_trees', [Local, Parent], EvalTrees)
+    # Only constraints outside statgram are read, once per process
+    assert Local.__code__ in calls
+    assert EvalTrees.__code__ not in calls and EvalTrees not in calls
+    calls.clear()
+    assert DiskCache().key('eval_trees', [Local, Parent], EvalTrees) == key
+    assert calls == []
+
+
+def test_package_digest_skips_benchmarks(monkeypatch):
+    read = []
+    monkeypatch.setattr(cache.Path, 'read_bytes',
+                        lambda path: read.append(path.name) or b'')
+    cache.package_digest.cache_clear()
+    try:
+        cache.package_digest()
+    finally:
+        cache.package_digest.cache_clear()
+    assert 'harmony.py' in read and 'bench.py' not in read
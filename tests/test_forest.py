@@ -0,0 +1,183 @@
+import itertools, math, random
+
+from nltk import CFG
+from nltk.parse import ChartParser
+from nltk.tree import ParentedTree
+
+from statgram.forest import Grammar, Forest, ForestGen, Counting
+from statgram.harmony import Mark, Eval, Stat, HGStat, OTStat
+
+from fixtures import foot_grammar, foot_Con, is_foot, grid_grammar, \
+    grid_Con
+
+
+def MainFootLeft(s):
+    # Reads all left siblings of the main foot
+    v = 0
+    if s.label() == 'MainFt':
+        t = s.left_sibling()
+        while t is not None:
+            if is_foot(t):
+                v = -1
+            t = t.left_sibling()
+    return Mark('MainFootLeft', v, subnode='upper')
+
+
+def bounded_grammar(n):
+    return Grammar.fromstring(
+        foot_grammar.replace('Constituent* MainFt Constituent*',
+                             f'Constituent{{0,{n}}} MainFt '
+                             f'Constituent{{0,{n}}}'))
+
+
+def brute_force(n):
+    """
+    All parses of n syllables as nltk ParentedTrees, parsed with
+    the flat expansions of PrWd up to n daughters.
+    """
+    lines = [
+        'MainFt -> MainStressSyll | MainStressSyll Syll '
+        '| Syll MainStressSyll',
+        'Ft -> StressSyll | StressSyll Syll | Syll StressSyll',
+        'MainStressSyll -> s1', 'StressSyll -> s2', 'Syll -> s0',
+        's0 -> "σ"', 's1 -> "σ"', 's2 -> "σ"'
+    ]
+    for k in range(n):
+        for left in itertools.product(['Ft', 'Syll'], repeat=k):
+            for m in range(n - k):
+                for right in itertools.product(['Ft', 'Syll'], repeat=m):
+                    lines.append(' '.join(('PrWd ->', ) + left +
+                                          ('MainFt', ) + right))
+    lines.sort(key=lambda x: not x.startswith('PrWd'))
+    cfg = CFG.fromstring('\n'.join(lines))
+    return [
+        ParentedTree.convert(t) for t in ChartParser(cfg).parse(['σ'] * n)
+    ]
+
+
+def test_bounded_rules_match_brute_force():
+    Con = foot_Con + [MainFootLeft]
+    rng = random.Random(0)
+    for n in range(1, 6):
+        forest = Forest(bounded_grammar(4), ['σ'] * n)
+        unbounded = Forest(Grammar.fromstring(foot_grammar), ['σ'] * n)
+        trees = brute_force(n)
+        assert forest.num_parses() == unbounded.num_parses() == len(trees)
+        for _ in range(3):
+            weights = {c.__name__: float(rng.choice([0, 1, 2, 10])) \
+                for c in Con}
+            for stat_func in (HGStat, OTStat):
+                harmony = [
+                    Stat(Eval(t.subtrees(), Con), weights, stat_func)[0]
+                    for t in trees
+                ]
+                assert forest.count(Con, weights, stat_func) == \
+                    sum(h == 0 for h in harmony)
+                assert forest.best(Con, weights, stat_func) == max(harmony)
+                assert sorted(map(str, forest.parses(Con, weights,
+                                                     stat_func))) == \
+                    sorted(str(t) for (t, h) in zip(trees, harmony) if h == 0)
+
+
+def test_bounded_rules_parse_in_polynomial_size():
+    # Chains of C{0,n} MainFt C{0,n} record the last daughter only,
+    # so their states grow quadratically rather than exponentially
+    sizes = {}
+    for n in (8, 16):
+        inside = Forest(bounded_grammar(n), ['σ'] * n)._inside(Counting)
+        inside.root()
+        sizes[n] = sum(len(value) for (value, _, _) in \
+            inside.chains.values())
+        assert sizes[n] < 20 * n * n
+    assert sizes[16] < 8 * sizes[8]
+    forest = Forest(bounded_grammar(13), ['σ'] * 13)
+    weights = {c.__name__: 1.0 for c in foot_Con}
+    assert forest.num_parses() == \
+        Forest(Grammar.fromstring(foot_grammar), ['σ'] * 13).num_parses()
+    assert math.isfinite(forest.log_Z(foot_Con, weights))
+
+
+def grid_parses(n):
+    # PrWd over any sequence of x and o with at least one x
+    return [
+        ParentedTree('PrWd', [ParentedTree(x, ['σ']) for x in labels])
+        for labels in itertools.product(['x', 'o'], repeat=n)
+        if 'x' in labels
+    ]
+
+
+def test_grid_forest_matches_enumeration():
+    grammar = Grammar.fromstring(grid_grammar)
+    rng = random.Random(1)
+    for n in range(1, 7):
+        forest = Forest(grammar, ['σ'] * n)
+        trees = grid_parses(n)
+        assert forest.num_parses() == len(trees)
+        for _ in range(5):
+            weights = {c.__name__: float(rng.choice([0, 1, 2, 3])) \
+                for c in grid_Con}
+            harmony = [
+                Stat(Eval(t.subtrees(), grid_Con), weights)[0]
+                for t in trees
+            ]
+            assert forest.count(grid_Con, weights) == \
+                sum(h == 0 for h in harmony)
+            assert forest.best(grid_Con, weights) == max(harmony)
+            good = sorted(str(t) for (t, h) in zip(trees, harmony) \
+                if h == 0)
+            assert sorted(map(str, forest.parses(grid_Con, weights))) == good
+
+
+def test_forest_gen_from_cfg():
+    cfg = CFG.fromstring('''
+    S -> NP VP
+    NP -> D N | NP PP
+    VP -> V NP | VP PP
+    PP -> P NP
+    D -> "the"
+    N -> "dog" | "cat" | "park"
+    V -> "saw"
+    P -> "in"
+    ''')
+    inpt = 'the dog saw the cat in the park'
+    forest = ForestGen(cfg).forest(inpt)
+    trees = list(ChartParser(cfg).parse(inpt.split()))
+    assert forest.num_parses() == len(trees) == 2
+    assert sorted(map(str, forest.parses([], {}))) == \
+        sorted(map(str, trees))
+
+
+def features(tree, Con, weights):
+    # Marks on subnodes with negative weighted sum, as in Expectation
+    e = dict.fromkeys(weights, 0.0)
+    for node in Eval(tree.subtrees(), Con):
+        for marks in node.marks.values():
+            if sum(weights[c] * v for (c, v, _) in marks) < 0.0:
+                for (c, v, _) in marks:
+                    e[c] += v
+    return e
+
+
+def test_maxent_matches_enumeration():
+    rng = random.Random(2)
+    grammar = Grammar.fromstring(foot_grammar)
+    for n in range(1, 6):
+        forest = Forest(grammar, ['σ'] * n)
+        trees = brute_force(n)
+        for _ in range(3):
+            weights = {c.__name__: rng.uniform(0, 3) for c in foot_Con}
+            harmony = [
+                Stat(Eval(t.subtrees(), foot_Con), weights)[0]
+                for t in trees
+            ]
+            log_Z = math.log(sum(math.exp(h) for h in harmony))
+            assert math.isclose(forest.log_Z(foot_Con, weights), log_Z)
+            (log_Z1, expected) = forest.expected_counts(foot_Con, weights)
+            assert math.isclose(log_Z1, log_Z)
+            for c in weights:
+                assert math.isclose(
+                    expected[c],
+                    sum(math.exp(h - log_Z) * features(t, foot_Con,
+                                                       weights)[c]
+                        for (t, h) in zip(trees, harmony)),
+                    abs_tol=1e-9)
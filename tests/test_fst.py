@@ -0,0 +1,252 @@
+import itertools, math, random
+import numpy as np
+import pytest
+
+from statgram.fst import ArcContext, from_arcs, from_wyfst, arc_contexts, \
+    EvalArcs, DeadArcs, ArcCosts, delete_arcs, trim, prune_arcs, ngram, \
+    ComposePrune, count_words, sample_words, iter_words, best_words, MaxEnt
+from statgram.harmony import Mark, HGStat, OTStat, Eval1, Stat1, MarkedNode, \
+    symbolic
+
+bos, eos = '⋊', '⋉'
+
+
+def ab_machine():
+    # ⋊ (a | b)* ⋉ with the last symbol as state label
+    arcs = [('start', bos, bos, bos), (bos, eos, eos, 'end')]
+    for q in (bos, 'a', 'b'):
+        for x in ('a', 'b'):
+            arcs.append((q, x, x, x))
+        if q != bos:
+            arcs.append((q, eos, eos, 'end'))
+    return from_arcs(arcs, 'start', ['end'], [bos, eos, 'a', 'b'])
+
+
+def NoAB(t):
+    return Mark('NoAB', -1 if (t.prec, t.x) == ('a', 'b') else 0)
+
+
+def test_arc_contexts_none():
+    M = ab_machine()
+    # No preceding symbol out of the start state
+    prec = lambda q: None if q in ('start', 'end') else q
+    ctx = arc_contexts(M, prec)
+    start = np.flatnonzero(M.src == 0)
+    assert (ctx[start, 0] == -1).all()
+    assert (ctx[:, 2] == -1).all()
+    (mm, inv) = EvalArcs(M, [NoAB], prec)
+    nodes = [mm.nodes[k] for k in inv]
+    assert nodes[start[0]] == ArcContext(None, bos, None)
+    assert sum(1 for node in mm.nodes if node[:2] == ('a', 'b')) == 1
+
+
+def test_from_wyfst_round_trip():
+    wyconfig = pytest.importorskip('wyfst.config')
+    wywrapfst = pytest.importorskip('wyfst.wywrapfst')
+    wyconfig.init({'sigma': ['a', 'b']})
+    M = wywrapfst.Wfst(wyconfig.symtable)
+    for q in range(3):
+        M.add_state(q)
+    M.set_start(0)
+    M.set_final(2)
+    M.add_arc(src=0, ilabel=wyconfig.bos, dest=1)
+    for x in ('a', 'b'):
+        M.add_arc(src=1, ilabel=x, dest=1)
+    M.add_arc(src=1, ilabel=wyconfig.eos, dest=2)
+
+    (machine, refs) = from_wyfst(M, [wyconfig.bos, wyconfig.eos, 'a', 'b'])
+    assert len(machine.src) == len(refs) == M.num_arcs() == 4
+    assert machine.states[machine.start] == 0
+    assert [machine.states[q] for q in np.flatnonzero(machine.finals)] == [2]
+    delim = (wyconfig.bos, wyconfig.eos)
+    assert count_words(machine, 3, delim) == [1, 2, 4, 8]
+    # Deleting arcs through refs agrees with delete_arcs
+    dead = (np.array(machine.sigma, dtype=object)[machine.olabel] == 'b')
+    Lang = M.delete_arcs([refs[k] for k in np.flatnonzero(dead)])
+    (lang, _) = from_wyfst(Lang, machine.sigma)
+    assert count_words(lang, 3, delim) == \
+        count_words(delete_arcs(machine, dead), 3, delim) == [1, 1, 1, 1]
+
+
+sigma = ['a', 'b', 'c']
+
+
+def NoCC(t):
+    return Mark('NoCC', -1 if (t.prec, t.x) == ('c', 'c') else 0)
+
+
+def NoA(t):
+    return Mark('NoA', -1 if t.x == 'a' else 0, 'upper')
+
+
+def LikeB(t):
+    return Mark('LikeB', +1 if t.x == 'b' else 0, 'upper')
+
+
+@symbolic('prec', 'x')
+def FinalB(prec, x):
+    return Mark('FinalB', -1 if (prec, x) == ('b', eos) else 0)
+
+
+word_Con = [NoCC, NoA, LikeB, FinalB]
+# Symbol preceding an arc out of a left ngram state
+ngram_prec = lambda q: q[-1] if q else None
+
+
+def word_arcs(word):
+    # Contexts of the arcs of the path of word through ngram(sigma)
+    symbols = (bos, ) + word + (eos, )
+    return [ArcContext(symbols[k - 1] if k > 0 else None, x, None) \
+        for (k, x) in enumerate(symbols)]
+
+
+def word_harmony(word, weights, stat_func=HGStat, Con=word_Con):
+    return [Stat1(MarkedNode(t, Eval1(t, Con)), weights, stat_func) \
+        for t in word_arcs(word)]
+
+
+def all_words(max_len):
+    return [word for n in range(max_len + 1) \
+        for word in itertools.product(sigma, repeat=n)]
+
+
+def random_grammar(rng, Con=word_Con):
+    if rng.random() < 0.5:
+        return (HGStat, {c.__name__: float(rng.choice([0, 1, 2])) \
+            for c in Con})
+    ranks = rng.sample(range(len(Con)), len(Con))
+    return (OTStat, {c.__name__: r for (c, r) in zip(Con, ranks)})
+
+
+def accepts(machine, word):
+    # Whether some path reads bos word eos to a final state
+    Q = {machine.start}
+    for x in (bos, ) + word + (eos, ):
+        arcs = [a for a in range(len(machine.src)) \
+            if machine.src[a] in Q and machine.sigma[machine.olabel[a]] == x]
+        Q = {int(machine.dest[a]) for a in arcs}
+    return any(machine.finals[q] for q in Q)
+
+
+def good_words(weights, stat_func, max_len=5):
+    # Words all of whose arcs are well-formed
+    return [word for word in all_words(max_len) \
+        if min(word_harmony(word, weights, stat_func)) == 0.0]
+
+
+def test_dead_arcs_match_brute_force():
+    rng = random.Random(0)
+    M = ngram(sigma)
+    for _ in range(20):
+        (stat_func, weights) = random_grammar(rng)
+        good = set(good_words(weights, stat_func))
+        dead = DeadArcs(M, word_Con, weights, stat_func, ngram_prec)
+        Lang = delete_arcs(M, dead)
+        for word in all_words(5):
+            assert accepts(Lang, word) == (word in good)
+
+
+def test_compose_prune_matches_dead_arcs():
+    rng = random.Random(3)
+    M = ngram(sigma)
+    # One-state acceptor of every symbol
+    M2 = from_arcs([(0, x, x, 0) for x in [bos, eos] + sigma], 0, [0])
+    for _ in range(20):
+        (stat_func, weights) = random_grammar(rng)
+        good = set(good_words(weights, stat_func))
+        Lang = ComposePrune(M, M2, word_Con, weights, stat_func,
+                            lambda q: ngram_prec(q[0]))
+        assert len(Lang.states) == len(trim(Lang).states)
+        for word in all_words(5):
+            assert accepts(Lang, word) == (word in good)
+
+
+def test_word_enumeration_matches_brute_force():
+    rng = random.Random(0)
+    M = ngram(sigma)
+    for _ in range(20):
+        (stat_func, weights) = random_grammar(rng)
+        good = good_words(weights, stat_func)
+        counts = [sum(len(word) == n for word in good) for n in range(6)]
+        dead = DeadArcs(M, word_Con, weights, stat_func, ngram_prec)
+        Lang = trim(delete_arcs(M, dead))
+        assert count_words(Lang, 5) == counts
+        # Shortlex order
+        assert list(iter_words(Lang, 5)) == good
+        for n in range(6):
+            sample = sample_words(Lang, n, 20, seed=n)
+            assert set(sample) <= set(good)
+            assert len(sample) == (20 if counts[n] else 0)
+
+
+def test_prune_arcs_matches_dead_arcs():
+    rng = random.Random(4)
+    M = ngram(sigma)
+    for _ in range(20):
+        (stat_func, weights) = random_grammar(rng)
+        cost = ArcCosts(M, word_Con, weights, stat_func, ngram_prec)
+        dead = DeadArcs(M, word_Con, weights, stat_func, ngram_prec)
+        assert ((cost > 0) == dead).all()
+        (Lang, cost) = prune_arcs(M, cost)
+        assert list(iter_words(Lang, 5)) == good_words(weights, stat_func)
+        assert not cost.any()
+
+
+def Star(t):
+    return Mark('Star', -1 if t.x in sigma else 0, 'star')
+
+
+def test_best_words_match_brute_force():
+    # Star makes longer words costlier, so costs vary
+    rng = random.Random(1)
+    M = ngram(sigma)
+    Con = word_Con + [Star]
+    words = all_words(6)
+    for _ in range(20):
+        (stat_func, weights) = random_grammar(rng, Con)
+        weights['Star'] = max(weights['Star'], 1)
+        harmony = [word_harmony(word, weights, stat_func, Con) \
+            for word in words]
+        # Minus harmony, or number of ill-formed arcs under OT
+        cost = {word: -sum(h) for (word, h) in zip(words, harmony)}
+        best = best_words(M, ArcCosts(M, Con, weights, stat_func,
+                                      ngram_prec), k=15)
+        assert len(best) == len(set(w for (w, _) in best)) == 15
+        for (word, c) in best:
+            assert math.isclose(c, cost[word])
+        assert [(c, len(w)) for (w, c) in best] == \
+            sorted((c, len(w)) for (w, c) in best)
+        # No cheaper word, or shorter word of equal cost, is missed
+        (c_max, n_max) = (best[-1][1], len(best[-1][0]))
+        assert {w for (w, c) in best if (c, len(w)) < (c_max, n_max)} == \
+            {w for w in words if (cost[w], len(w)) < (c_max, n_max) \
+                and len(w) < 6}
+
+
+def test_maxent_matches_enumeration():
+    rng = random.Random(2)
+    M = ngram(sigma)
+    for _ in range(10):
+        weights = {c.__name__: rng.uniform(0, 2) for c in word_Con}
+        maxent = MaxEnt(M, word_Con, weights, ngram_prec)
+        for n in range(5):
+            words = list(itertools.product(sigma, repeat=n))
+            harmony = [sum(word_harmony(w, weights)) for w in words]
+            log_Z = math.log(sum(math.exp(h) for h in harmony))
+            assert math.isclose(maxent.log_Z(n), log_Z)
+            for (w, h) in list(zip(words, harmony))[:5]:
+                assert math.isclose(maxent.log_prob(w), h - log_Z,
+                                    abs_tol=1e-9)
+            # Features: marks of arc subnodes with negative sum
+            expected = dict.fromkeys(weights, 0.0)
+            for (w, h) in zip(words, harmony):
+                for t in word_arcs(w):
+                    for marks in Eval1(t, word_Con).values():
+                        if sum(weights[c] * v for (c, v, _) in marks) < 0:
+                            for (c, v, _) in marks:
+                                expected[c] += math.exp(h - log_Z) * v
+            counts = maxent.expected_counts(n)
+            for c in weights:
+                assert math.isclose(counts.get(c, 0.0), expected[c],
+                                    abs_tol=1e-9)
+    assert maxent.log_prob(('z', )) == -math.inf
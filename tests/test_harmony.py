@@ -0,0 +1,282 @@
+import random
+import numpy as np
+
+from statgram.harmony import Mark, MarkedNode, MarkMatrix, HGStat, OTStat, \
+    Stat, Stat1, IncrementalStat, Eval, iter_eval, iter_stat, Wellformed, \
+    EvalMatrix, StatMatrix, StatBatch, CompiledOT, PrunedStat, IllFormed, \
+    bounds, locality, Memoize, profile, symbolic
+from statgram.fst import ArcContext, EvalArcs, from_arcs
+
+con = ['A', 'B', 'C', 'D']
+
+
+def random_markup(n, seed):
+    rng = random.Random(seed)
+    markup = []
+    for i in range(n):
+        marks = {}
+        for c in con:
+            v = rng.choice([-2, -1, 0, 0, 1])
+            if v == 0:
+                continue
+            subnode = rng.choice(['•', 'upper', 'lower'])
+            marks.setdefault(subnode, set()).add(Mark(c, v, subnode))
+        markup.append(MarkedNode(i, marks))
+    return markup
+
+
+def random_weights(rng):
+    return {c: float(rng.choice([0, 0.5, 1, 2, 3])) for c in con}
+
+
+def test_incremental_stat_matches_stat():
+    rng = random.Random(0)
+    for seed in range(20):
+        markup = random_markup(30, seed)
+        mm = MarkMatrix.from_markup(markup)
+        weights = random_weights(rng)
+        inc = IncrementalStat(mm, weights)
+        for _ in range(10):
+            c = rng.choice(mm.con)
+            (_, ill_before) = Stat(markup, weights, HGStat)
+            weights[c] = float(rng.choice([0, 0.5, 1, 2, 3]))
+            (total, newly_ill, newly_wellformed) = \
+                inc.set_weight(c, weights[c])
+            (harmony, ill) = Stat(markup, weights, HGStat)
+            ill = {node.n for node in ill}
+            before = {node.n for node in ill_before}
+            assert np.isclose(total,
+                              sum(HGStat(marks, weights) for node in markup \
+                                  for marks in node.marks.values()))
+            assert set(newly_ill.tolist()) == ill - before
+            assert set(newly_wellformed.tolist()) == before - ill
+            assert set(inc.ill_nodes().tolist()) == ill
+
+
+def test_incremental_stat_unmarked_constraint():
+    mm = MarkMatrix.from_markup(random_markup(10, 1))
+    weights = {c: 1.0 for c in mm.con}
+    weights['Unused'] = 2.0
+    inc = IncrementalStat(mm, weights)
+    total = inc.harmony_total
+    (total1, newly_ill, newly_wellformed) = inc.set_weight('Unused', 5.0)
+    assert total1 == total
+    assert len(newly_ill) == 0 and len(newly_wellformed) == 0
+    assert inc.weights() == dict(weights, Unused=5.0)
+
+
+def test_symbolic_tables_fill_on_demand():
+    calls = []
+
+    def Tri(prec, x, succ):
+        calls.append((prec, x, succ))
+        v = -1 if (prec, x, succ) == ('a', 'b', 'a') else 0
+        return Mark('Tri', v)
+
+    compiled = symbolic('prec', 'x', 'succ')(Tri)
+    sigma = [chr(ord('a') + k) for k in range(20)]
+    arcs = [(p, x, x, x) for p in sigma for x in sigma[:3]]
+    M = from_arcs(arcs, 'a', sigma, sigma)
+    prec = lambda q: q
+    succ = lambda q: 'a'
+    (mm, inv) = EvalArcs(M, [compiled], prec, succ)
+    # One call per distinct context, not per tuple of the alphabet
+    assert len(calls) == mm.num_nodes() == len(set(calls)) == 60
+    assert len(compiled.table) == 60  # of 20 ** 3
+    ref = Eval([ArcContext(prec(M.states[q]), M.sigma[x], 'a') \
+        for (q, x) in zip(M.src.tolist(), M.olabel.tolist())],
+               [lambda t: Tri(*t)])
+    assert [dict(mm[k].marks) for k in inv] == \
+        [{s: tuple(m) for (s, m) in x.marks.items()} for x in ref]
+    # Symbols outside the alphabet are evaluated but not stored
+    compiled(ArcContext('z', 'a', None))
+    assert ('z', 'a', None) not in compiled.table
+    # A new alphabet starts a new table
+    compiled.compile(sigma[:2])
+    assert compiled.table == {}
+
+
+def random_con(n, seed):
+    # Constraints over nodes 0..n-1 reading marks from a random table,
+    # each marking one subnode within declared bounds
+    rng = random.Random(seed)
+    Con = []
+    for (k, c) in enumerate(con):
+        subnode = ['•', 'upper', 'lower'][k % 3]
+        values = [rng.choice([-2, -1, 0, 0, 1]) for i in range(n)]
+        constraint = lambda i, c=c, values=values, subnode=subnode: \
+            Mark(c, values[i], subnode)
+        constraint.__name__ = c
+        Con.append(bounds(-2, 1, subnode)(constraint))
+    return Con
+
+
+def random_ranks(rng):
+    return dict(zip(con, rng.sample(range(len(con)), len(con))))
+
+
+def random_grammars(rng, k):
+    return [(HGStat, random_weights(rng)) for _ in range(k)] + \
+        [(OTStat, random_ranks(rng)) for _ in range(k)]
+
+
+def ill_set(ill_nodes):
+    return {node.n for node in ill_nodes}
+
+
+def test_stat_matrix_matches_stat():
+    rng = random.Random(0)
+    for seed in range(20):
+        markup = random_markup(30, seed)
+        mm = MarkMatrix.from_markup(markup)
+        for (stat_func, weights) in random_grammars(rng, 5):
+            (total, ill_nodes) = Stat(markup, weights, stat_func)
+            (total1, ill) = StatMatrix(mm, weights, stat_func)
+            assert np.isclose(total1, total)
+            assert set(np.flatnonzero(ill).tolist()) == ill_set(ill_nodes)
+
+
+def test_eval_matrix_matches_eval():
+    Con = random_con(40, 3)
+    mm = EvalMatrix(range(40), Con, ignore_func=lambda i: i % 7 == 0)
+    markup = Eval(range(40), Con, ignore_func=lambda i: i % 7 == 0)
+    assert list(mm.nodes) == [x.n for x in markup]
+    assert [{s: set(m) for (s, m) in x.marks.items()} for x in mm] == \
+        [x.marks for x in markup]
+
+
+def test_stat_batch_matches_stat():
+    rng = random.Random(5)
+    for seed in range(20):
+        markup = random_markup(30, seed)
+        mm = MarkMatrix.from_markup(markup)
+        grammars = random_grammars(rng, 5)
+        for stat_func in (HGStat, OTStat):
+            W = [weights for (f, weights) in grammars if f is stat_func]
+            (harmony, ill) = StatBatch(mm, W, stat_func, block_size=2)
+            for (k, weights) in enumerate(W):
+                assert np.allclose(harmony[k],
+                                   [Stat1(x, weights, stat_func) \
+                                       for x in markup])
+                assert ill[k].tolist() == [x in Stat(
+                    markup, weights, stat_func)[1] for x in markup]
+
+
+def test_memoize():
+    calls = []
+
+    @locality(lambda i: i % 5)
+    def Mod(i):
+        calls.append(i)
+        return Mark('Mod', -1 if i % 5 == 0 else 0)
+
+    plain = random_con(10, 0)[0]
+    Con = Memoize([Mod, plain], maxsize=3)
+    assert Con[1] is plain
+    markup = Eval([0, 1, 2, 0, 1, 2, 3, 4, 0], Con)
+    # One call per key until the key is evicted
+    assert calls == [0, 1, 2, 3, 4, 0]
+    assert Con[0].cache_info() == (3, 6, 3, 3)
+    assert [Mark('Mod', -1) in x.marks.get('•', ()) for x in markup] == \
+        [True, False, False, True, False, False, False, False, True]
+
+
+def test_iter_stat_early_exit():
+    rng = random.Random(1)
+    for seed in range(20):
+        Con = random_con(30, seed)
+        weights = random_weights(rng)
+        (_, ill_nodes) = Stat(Eval(range(30), Con), weights)
+        seen = [x.n for (x, _) in \
+            iter_stat(iter_eval(range(30), Con), weights, early_exit=True)]
+        if ill_nodes:
+            assert seen == list(range(ill_nodes[0].n + 1))
+        else:
+            assert seen == list(range(30))
+        assert Wellformed(range(30), Con, weights) == (not ill_nodes)
+
+
+def test_mark_matrix_views():
+    for seed in range(20):
+        markup = random_markup(30, seed)
+        mm = MarkMatrix.from_markup(markup)
+        assert len(mm) == mm.num_nodes() == len(markup)
+        assert [{s: set(m) for (s, m) in x.marks.items()} for x in mm] == \
+            [x.marks for x in markup]
+        assert mm.num_marks() == sum(
+            len(m) for x in markup for m in x.marks.values())
+        # Smallest dtypes that hold the indices and values
+        assert mm.col.dtype == np.uint8 and mm.val.dtype == np.int8
+        both = MarkMatrix.concat([mm, MarkMatrix.from_markup(markup[::-1])])
+        assert [{s: set(m) for (s, m) in x.marks.items()} for x in both] == \
+            [x.marks for x in markup + markup[::-1]]
+
+
+def test_compiled_ot_matches_stat():
+    rng = random.Random(6)
+    for seed in range(20):
+        markup = random_markup(30, seed)
+        mm = MarkMatrix.from_markup(markup)
+        R = [random_ranks(rng) for _ in range(5)]
+        # Without and with rank tables
+        for table_max in (0, 16):
+            compiled = CompiledOT(mm, table_max)
+            assert compiled.num_ill(R).tolist() == \
+                [len(Stat(markup, ranks, OTStat)[1]) for ranks in R]
+            for ranks in R:
+                (total, ill) = compiled.stat(ranks)
+                assert set(np.flatnonzero(ill).tolist()) == \
+                    ill_set(Stat(markup, ranks, OTStat)[1])
+
+
+def counted(Con, calls):
+    # Con with bounds kept, counting calls
+    return [
+        bounds(*c.bounds)(lambda i, c=c: calls.append(i) or c(i))
+        for c in Con
+    ]
+
+
+def test_pruned_stat_matches_stat():
+    rng = random.Random(2)
+    for seed in range(40):
+        Con = random_con(30, seed)
+        markup = Eval(range(30), Con)
+        for (stat_func, weights) in [(HGStat, random_weights(rng)),
+                                     (OTStat, random_ranks(rng))]:
+            (_, ill_nodes) = Stat(markup, weights, stat_func)
+            calls = []
+            pruned = IllFormed(range(30), counted(Con, calls), weights,
+                               stat_func)
+            assert ill_set(pruned) == ill_set(ill_nodes)
+            for x in pruned:
+                assert Stat1(x, weights, stat_func) < 0.0
+            # Verdicts are fixed before every constraint is called
+            assert len(calls) < 30 * len(Con)
+            pruned_stat = PrunedStat(Con, weights, stat_func)
+            for i in range(30):
+                pruned_stat(i)
+            assert pruned_stat.calls == len(calls)
+
+
+def test_profile_attribution():
+    Con = random_con(50, 4)
+    weights = {'A': 1.0, 'B': 2.0, 'C': 0.0, 'D': 1.0}
+    with profile() as prof:
+        markup = Eval(range(50), Con)
+        (_, ill_nodes) = Stat(markup, weights)
+    report = {x.constraint: x for x in prof.report()}
+    assert prof.nodes == 50 and prof.ill_nodes == len(ill_nodes)
+    for c in con:
+        marks = [m for x in markup for s in x.marks for m in x.marks[s] \
+            if m.c == c]
+        ill = [x for x in ill_nodes for s in x.marks \
+            if any(m.c == c and weights[c] * m.v < 0 for m in x.marks[s]) \
+            and HGStat(x.marks[s], weights) < 0]
+        assert report[c].calls == 50
+        assert report[c].marks == len(marks)
+        assert report[c].negative == sum(m.v < 0 for m in marks)
+        assert report[c].ill == len(ill)
+    # Profiling is off outside the context
+    Stat(markup, weights)
+    assert prof.nodes == 50
@@ -0,0 +1,119 @@
+import itertools, random
+
+from statgram.harmony import Mark, MarkedNode, HGStat, OTStat, Stat
+from statgram.learn import learn_weights, learn_ranking, stratified_ranks
+
+con = ['A', 'B', 'C', 'D', 'E']
+
+
+def separable(seed, subnodes):
+    """
+    Nodes with random marks, split into well-formed (pos) and
+    ill-formed (neg) by random integer weights.
+    """
+    rng = random.Random(seed)
+    weights = {c: rng.choice([0, 1, 2, 3]) for c in con}
+    (pos, neg) = ([], [])
+    for i in range(rng.randint(5, 25)):
+        marks = {}
+        for c in con:
+            v = rng.choice([-1, -1, 0, 0, 0, 1, 2])
+            if v != 0:
+                subnode = rng.choice(subnodes)
+                marks.setdefault(subnode, set()).add(Mark(c, v, subnode))
+        node = MarkedNode(i, marks)
+        (_, ill) = Stat([node], weights, HGStat)
+        (neg if ill else pos).append(node)
+    return (pos, neg)
+
+
+def classifies(pos, neg, weights):
+    return len(Stat(pos, weights, HGStat)[1]) == 0 \
+        and len(Stat(neg, weights, HGStat)[1]) == len(neg)
+
+
+def test_learned_weights_pass_stat():
+    # Linear program (one subnode) and MILP (several subnodes)
+    for subnodes in (['•'], ['•', 'x']):
+        for seed in range(150):
+            (pos, neg) = separable(seed, subnodes)
+            result = learn_weights(pos, neg, 'lp')
+            assert result.feasible is True, (subnodes, seed)
+            assert classifies(pos, neg, result.weights), (subnodes, seed)
+
+
+def test_perceptron_weights_pass_stat():
+    for seed in range(100):
+        (pos, neg) = separable(seed, ['•', 'x'])
+        result = learn_weights(pos, neg, 'perceptron', max_iter=2000)
+        if result.feasible:
+            assert classifies(pos, neg, result.weights), seed
+
+
+def test_infeasible_certificate():
+    # A is both required (pos) and fatal (neg) on its own
+    pos = [MarkedNode(0, {'•': {Mark('A', -1), Mark('B', 1)}})]
+    neg = [MarkedNode(0, {'•': {Mark('B', 1), Mark('A', -1)}})]
+    result = learn_weights(pos, neg, 'lp')
+    assert result.feasible is False and result.weights is None
+    assert {sign for (sign, _, _, _) in result.certificate} == {'+', '-'}
+
+
+def ot_consistent(good, bad, ranks):
+    return len(Stat(good, ranks, OTStat)[1]) == 0 \
+        and len(Stat(bad, ranks, OTStat)[1]) == len(bad)
+
+
+def test_learned_ranking_matches_brute_force():
+    # RCD finds a consistent ranking iff one of the 5! total
+    # rankings classifies the data; labels come from a random
+    # ranking (always consistent) or are random
+    for biased in (False, True):
+        for seed in range(150):
+            rng = random.Random(seed)
+            (pos, neg) = separable(seed, ['•'])
+            nodes = (pos + neg)[:8]
+            if seed % 2 == 0:
+                ranks = dict(zip(con, rng.sample(range(5), 5)))
+                bad = Stat(nodes, ranks, OTStat)[1]
+            else:
+                bad = [x for x in nodes if rng.random() < 0.5]
+            good = [x for x in nodes if x not in bad]
+            result = learn_ranking(good, bad, low=['A', 'B'], biased=biased)
+            exists = any(
+                ot_consistent(good, bad, dict(zip(order, range(5)))) \
+                for order in itertools.permutations(con))
+            assert result.consistent == exists, (biased, seed)
+            if result.consistent:
+                assert ot_consistent(good, bad,
+                                     stratified_ranks(result.strata))
+            else:
+                assert result.unresolved
+
+
+def test_ranking_requires_every_bad_subnode():
+    # Each ranking of A and B makes one subnode of the bad node
+    # ill-formed, but none makes both
+    bad = [MarkedNode(0, {
+        'a': {Mark('A', -1, 'a'), Mark('B', 1, 'a')},
+        'b': {Mark('A', 1, 'b'), Mark('B', -1, 'b')}
+    })]
+    assert all(
+        ot_consistent([], bad, dict(zip(order, range(2)))) \
+        for order in itertools.permutations(['A', 'B']))
+    result = learn_ranking([], bad)
+    assert not result.consistent
+    assert sorted(result.unresolved) == [('-', 0, 'a'), ('-', 0, 'b')]
+
+    # Satisfiable on every subnode: ill-formed for Stat too
+    bad[0].marks['b'] = {Mark('A', -1, 'b'), Mark('C', 1, 'b')}
+    result = learn_ranking([], bad)
+    assert result.consistent
+    assert ot_consistent([], bad, stratified_ranks(result.strata))
+
+    # A subnode ill-formed under any ranking settles the node
+    bad[0].marks['b'] = {Mark('B', -1, 'b')}
+    good = [MarkedNode(1, {'•': {Mark('A', -1), Mark('B', 1)}})]
+    result = learn_ranking(good, bad)
+    assert result.consistent and result.strata[0] == ['B']
+    assert ot_consistent(good, bad, stratified_ranks(result.strata))
@@ -0,0 +1,39 @@
+from statgram.fst import ArcContext
+from statgram.harmony import Eval, profile
+from statgram.parallel import ParallelEval
+
+from fixtures import nasal_sigma, nasal_Con, nasal_ignore
+
+
+def arcs():
+    sigma = nasal_sigma(1) + ['⋊', '⋉']
+    return [ArcContext(p, x, None) for p in sigma for x in sigma]
+
+
+def test_parallel_eval_matches_eval():
+    M = arcs()
+    ref = [(x.n, x.marks) for x in Eval(M, nasal_Con, nasal_ignore)]
+    for matrix in (False, True):
+        (markup, stats) = ParallelEval(M,
+                                       nasal_Con,
+                                       nasal_ignore,
+                                       processes=2,
+                                       chunksize=7,
+                                       matrix=matrix)
+        assert [(x.n, {k: set(v) for (k, v) in x.marks.items()}) \
+            for x in markup] == ref
+        assert sum(x.nodes for x in stats) == len(M)
+
+
+def test_parallel_eval_profiles_workers():
+    M = arcs()
+    with profile() as serial:
+        Eval(M, nasal_Con, nasal_ignore)
+    for matrix in (False, True):
+        with profile() as prof:
+            ParallelEval(M, nasal_Con, nasal_ignore, processes=2,
+                         matrix=matrix)
+        assert [(x.constraint, x.calls, x.positive, x.negative) \
+            for x in prof.report()] == \
+            [(x.constraint, x.calls, x.positive, x.negative) \
+            for x in serial.report()]
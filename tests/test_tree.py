@@ -0,0 +1,147 @@
+import random
+
+from nltk.tree import ParentedTree
+
+from statgram.forest import Grammar, Forest
+from statgram.harmony import Eval
+from statgram.tree import ArrayTree, Labels, EvalTrees
+
+from fixtures import foot_Con, grid_grammar, parses, AlignFeetLeft, \
+    AlignFeetLeftIndexed, footed_word
+
+labels = ['Ft', 'Syll', 'MainFt', 'StressSyll']
+
+
+def random_tree(rng, mixed, depth=0):
+    # With mixed, leaves may have siblings; otherwise leaves are only
+    # children of preterminals
+    label = rng.choice(labels)
+    if depth >= 3 or (depth > 0 and rng.random() < 0.3):
+        return ParentedTree(label, [rng.choice(['σ', 'x'])])
+    children = [
+        rng.choice(['σ', 'x']) if mixed and rng.random() < 0.2 else \
+            random_tree(rng, mixed, depth + 1)
+        for _ in range(rng.randint(1, 4))
+    ]
+    return ParentedTree(label, children)
+
+
+def random_trees(n, seed, mixed=True):
+    rng = random.Random(seed)
+    return [random_tree(rng, mixed) for _ in range(n)]
+
+
+def show(x):
+    # Label of a node, or the leaf itself
+    return x if (x is None or isinstance(x, str)) else x.label()
+
+
+def test_array_tree_matches_nltk():
+    table = Labels()
+    for t in random_trees(50, 0):
+        tree = ArrayTree.from_nltk(t, table)
+        assert str(tree.to_nltk()) == str(t)
+        assert tree.leaves() == t.leaves() and tree.pos() == t.pos()
+        nodes = list(t.subtrees())
+        refs = tree.subtrees()
+        assert len(refs) == len(nodes) == len(list(tree))
+        for (ref, node) in zip(refs, nodes):
+            assert ref.label() == node.label()
+            assert ref.treeposition() == node.treeposition()
+            assert show(ref.parent()) == show(node.parent())
+            assert show(ref.left_sibling()) == show(node.left_sibling())
+            assert show(ref.right_sibling()) == show(node.right_sibling())
+            assert ref.parent_index() == node.parent_index()
+            assert ref.depth() == len(node.treeposition())
+            assert len(ref) == len(node)
+            assert [show(x) for x in ref] == [show(x) for x in node]
+            assert show(ref[-1]) == show(node[-1])
+            assert ref.leaves() == node.leaves()
+            assert [x.label() for x in ref.subtrees()] == \
+                [x.label() for x in node.subtrees()]
+    assert len(table) == len(labels) + 2
+
+
+def test_eval_trees_matches_nltk():
+    # foot_Con reads only labels of a node, its immediate siblings
+    # and its children, so local evaluation agrees too
+    trees = random_trees(30, 1, mixed=False) + \
+        parses(Grammar.fromstring(grid_grammar), 4)
+    ref = [Eval(t.subtrees(), foot_Con) for t in trees]
+    arrays = [ArrayTree.from_nltk(t) for t in trees]
+    for local in (False, True):
+        markups = EvalTrees(arrays, foot_Con, local)
+        assert [[x.marks for x in markup] for markup in markups] == \
+            [[x.marks for x in markup] for markup in ref]
+        assert [[x.n.treeposition() for x in markup] for markup in markups] \
+            == [[x.n.treeposition() for x in markup] for markup in ref]
+
+
+def test_eval_trees_local_separates_label_tables():
+    # Same label ids for different labels in two tables
+    trees = [
+        ArrayTree.from_nltk(ParentedTree.fromstring(t), Labels())
+        for t in ('(Ft (Syll σ) (StressSyll σ))',
+                  '(Syll (Ft σ) (StressSyll σ))')
+    ]
+    assert trees[0].label == trees[1].label
+    (ref, markups) = (EvalTrees(trees, foot_Con),
+                      EvalTrees(trees, foot_Con, True))
+    assert [[x.marks for x in markup] for markup in markups] == \
+        [[x.marks for x in markup] for markup in ref]
+
+
+def test_forest_array_parses():
+    grammar = Grammar.fromstring(grid_grammar)
+    for n in range(1, 6):
+        forest = Forest(grammar, ['σ'] * n)
+        assert [str(t.to_nltk()) for t in forest.parses([], {}, array=True)] \
+            == [str(t) for t in forest.parses([], {})]
+
+
+def walk(node, side, labels):
+    # (count, gap to nearest) of the siblings labeled with labels
+    # on one side of node, by walking outwards
+    parent = node.parent()
+    if parent is None:
+        return (0, 0)
+    i = node.parent_index()
+    siblings = parent[:i][::-1] if side < 0 else parent[(i + 1):]
+    (count, gap) = (0, None)
+    for (k, s) in enumerate(siblings):
+        if show(s) in labels:
+            count += 1
+            if gap is None:
+                gap = k
+    return (count, len(siblings) if gap is None else gap)
+
+
+def test_positional_indexes_match_walking():
+    trees = random_trees(50, 2) + \
+        [ParentedTree.fromstring(footed_word(n)) for n in range(1, 12)]
+    for t in trees:
+        tree = ArrayTree.from_nltk(t)
+        leaves = t.treepositions('leaves')
+        for (ref, node) in zip(tree.subtrees(), t.subtrees()):
+            assert ref.siblings_before() == walk(node, -1, ())[1]
+            assert ref.siblings_after() == walk(node, +1, ())[1]
+            for key in ('Ft', ('Ft', 'MainFt'), frozenset(['Syll', 'σ'])):
+                names = key if isinstance(key, (tuple, frozenset)) \
+                    else (key, )
+                (before, gap_before) = walk(node, -1, names)
+                (after, gap_after) = walk(node, +1, names)
+                assert (ref.count_before(key), ref.gap_before(key)) == \
+                    (before, gap_before)
+                assert (ref.count_after(key), ref.gap_after(key)) == \
+                    (after, gap_after)
+            position = node.treeposition()
+            span = [k for (k, x) in enumerate(leaves) \
+                if x[:len(position)] == position]
+            assert ref.leaf_span() == (span[0], span[-1] + 1)
+    # Alignment from leaf spans agrees with walking left siblings
+    for n in range(1, 12):
+        t = ParentedTree.fromstring(footed_word(n))
+        tree = ArrayTree.from_nltk(t)
+        assert [x.marks for x in Eval(tree.subtrees(),
+                                      [AlignFeetLeftIndexed])] == \
+            [x.marks for x in Eval(t.subtrees(), [AlignFeetLeft])]
@@ -0,0 +1,57 @@
+from statgram.forest import Grammar
+from statgram.harmony import Eval, Stat, HGStat, OTStat
+from statgram.typology import Typology, load_patterns, stress_pattern, \
+    weight_sample, rankings
+
+from fixtures import grid_grammar, grid_Con, parses
+
+lengths = [1, 2, 3, 4]
+
+
+def direct_language(trees, weights, stat_func):
+    """
+    Patterns of the parses without ill-formed nodes, by input length.
+    """
+    language = {n: set() for n in lengths}
+    for n in lengths:
+        for tree in trees[n]:
+            (_, ill) = Stat(Eval(tree.subtrees(), grid_Con), weights,
+                            stat_func)
+            if not ill:
+                language[n].add(stress_pattern(tree))
+    return {n: frozenset(x) for (n, x) in language.items()}
+
+
+def test_typology_matches_direct_stat(tmp_path):
+    grammar = Grammar.fromstring(grid_grammar)
+    trees = {n: parses(grammar, n) for n in lengths}
+    for stat_func in (HGStat, OTStat):
+        typology = Typology(lambda n: trees[n], grid_Con, lengths, stat_func)
+        W = weight_sample(typology.con, 40, seed=0) \
+            if stat_func is HGStat else rankings(typology.con)
+        report = typology.report(W, chunksize=16)
+        assert sum(report.counts) == len(W)
+        direct = [
+            direct_language(trees, dict(zip(typology.con, w)), stat_func)
+            for w in W
+        ]
+        for (k, language) in enumerate(direct):
+            assert report.languages[report.grammar_language[k]] == language
+        assert len(report.languages) == len(set(
+            tuple(sorted(x.items())) for x in direct))
+        assert typology.report(W, processes=2, chunksize=16) \
+            .grammar_language.tolist() == report.grammar_language.tolist()
+
+    # Attested languages are matched on the evaluated lengths
+    path = tmp_path / 'patterns.txt'
+    path.write_text('Trochaic;1, 10, 102, 1020, 10202\n'
+                    'Initial;1, 10, 100, 1000\n')
+    attested = load_patterns(path)
+    assert attested['Initial'] == \
+        {1: {'1'}, 2: {'10'}, 3: {'100'}, 4: {'1000'}}
+    report = typology.report(W, attested,
+                             project=lambda x: x.replace('2', '1'))
+    trochaic = report.matches['Trochaic']
+    assert report.languages[trochaic] == \
+        {1: {'1'}, 2: {'10'}, 3: {'101'}, 4: {'1010'}}
+    assert report.matches['Initial'] is None